@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -10,11 +10,127 @@ class Settings(BaseSettings):
     mistral_api_key: Optional[str] = None
     letta_api_key: Optional[str] = None
     letta_base_url: Optional[str] = "http://localhost:8283"  # Default to local Letta server
+    # OpenAI-compatible provider endpoints (point at a local stub server for testing)
+    longcat_base_url: str = "https://api.longcat.chat/openai"
+    groq_base_url: str = "https://api.groq.com/openai/v1"
+    cerebras_base_url: str = "https://api.cerebras.ai/v1"
+    mistral_base_url: str = "https://api.mistral.ai/v1"
+    # Pooled provider connections (shared keep-alive / HTTP/2 clients, one per provider)
+    provider_http2: bool = True
+    provider_max_connections: int = 100
+    provider_max_keepalive_connections: int = 20
+    provider_keepalive_expiry_seconds: float = 30.0
+    provider_connect_timeout_seconds: float = 5.0
+    provider_read_timeout_seconds: float = 120.0
+    provider_pool_timeout_seconds: float = 10.0
+    provider_max_retries: int = 2
+    # Per-provider request scheduling: concurrent requests and requests / tokens per minute
+    # (0 = unlimited); overrides as JSON: {"groq": {"max_concurrent": 4, "rpm": 30, "tpm": 6000}}
+    provider_max_concurrent: int = 8
+    provider_rpm: float = 0
+    provider_tpm: float = 0
+    provider_limits: Dict[str, Dict[str, float]] = {}
+    provider_queue_timeout_seconds: float = 30.0  # Queued requests fail after this long
+    provider_completion_token_estimate: int = 1024  # Completion tokens reserved per request until usage is known
+    # Rolling per-provider latency / error stats and circuit breakers (open after N consecutive failures)
+    provider_stats_window: int = 100
+    circuit_breaker_failures: int = 5
+    circuit_breaker_cooldown_seconds: float = 30.0
+    # Equivalent models for failover and hedging, as JSON: {"llama-4-scout": ["llama-4-maverick"]}
+    model_equivalents: Dict[str, List[str]] = {}
+    # Hedging: after the primary's p<percentile> latency, also ask the next equivalent model
+    hedging_enabled: bool = False
+    hedge_percentile: float = 95.0
+    hedge_min_samples: int = 20  # Successful samples before the percentile is trusted
+    hedge_default_delay_seconds: float = 5.0
     data_folder: str = "./data"
     history_file_path: str = "./data/history.txt"
     faiss_index_path: str = "./storage/faiss_index.bin"
     metadata_path: str = "./storage/doc_metadata.json"
     file_hash_path: str = "./storage/file_hashes.json"
+    # Memory-mapped chunk texts, metadata and embeddings (see services/chunk_store.py)
+    chunk_store_path: str = "./storage/chunks"
+    # Incremental updates are appended to a log and merged by a background checkpoint
+    checkpoint_max_log_records: int = 32
+    checkpoint_interval_seconds: float = 300.0  # 0 disables the periodic checkpoint
+    # FAISS index backend: auto, flat, ivf, hnsw, ivfpq ("auto" picks by chunk count)
+    faiss_index_type: str = "auto"
+    faiss_flat_max_chunks: int = 20000
+    faiss_hnsw_max_chunks: int = 200000
+    faiss_ivfpq_min_chunks: int = 2000000
+    faiss_nprobe: int = 16
+    faiss_hnsw_m: int = 32
+    faiss_hnsw_ef_construction: int = 200
+    faiss_hnsw_ef_search: int = 64
+    faiss_pq_m: int = 48  # must divide the embedding dimension
+    faiss_pq_nbits: int = 8
+    # Updates go to a small exact delta index, merged into the main one past both limits
+    faiss_delta_max_chunks: int = 1000
+    faiss_delta_max_ratio: float = 0.05
+    # Vectors inside the index: fp32, fp16, sq8 or pq (ivfpq always uses pq)
+    faiss_vector_codec: str = "fp32"
+    # dtype of persisted/in-memory chunk embeddings: float32, float16 or int8
+    embedding_storage_dtype: str = "float32"
+    # Re-score rerank_factor * k candidates with the stored embeddings (useful with sq8 / pq codes)
+    rerank_enabled: bool = False
+    rerank_factor: int = 4
+    # Sampled recall@k of the index, measured after every rebuild (0 disables)
+    recall_sample_queries: int = 50
+    recall_k: int = 10
+    # BM25 inverted index kept alongside FAISS (exact identifiers, error codes, names)
+    bm25_enabled: bool = True
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    # Default retrieval mode: vector, lexical or hybrid (reciprocal rank fusion); overridable per request
+    retrieval_mode: str = "vector"
+    hybrid_candidates: int = 50  # Candidates taken from each ranking before fusion
+    hybrid_rrf_k: int = 60
+    # Chunk ID selections of recently used metadata filters, per index generation
+    filter_cache_max_entries: int = 256
+    # Background compaction of tombstoned chunks (runs when either limit is reached)
+    compaction_min_tombstones: int = 1000
+    compaction_tombstone_ratio: float = 0.2
+    # Persistent chunk-text -> embedding cache (LRU evicted past max entries)
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str = "./storage/embedding_cache.sqlite"
+    embedding_cache_max_entries: int = 500000
+    # Micro-batching of concurrent retrieval query embeddings
+    query_batch_max_size: int = 32
+    query_batch_max_wait_ms: float = 5.0
+    # LRU + TTL caches for repeated queries (embeddings and top-k result IDs)
+    query_cache_max_entries: int = 10000
+    query_cache_ttl_seconds: float = 3600.0
+    query_result_cache_enabled: bool = True
+    # Document parsing processes during ingestion (0 = one per CPU, 1 = parse in-process)
+    ingest_workers: int = 0
+    # Embedding model and runtime: torch, onnx or onnx-int8 (exported to onnx_export_dir on first use)
+    embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_backend: str = "torch"
+    onnx_export_dir: str = "./storage/onnx"
+    embedding_threads: int = 0  # Intra-op threads for the model (0 = runtime default)
+    # Compare ONNX embeddings against torch at startup and fall back below this cosine (0 disables)
+    embedding_parity_min_cosine: float = 0.0
+    # Chunks per embedding batch while ingesting (bounds peak memory)
+    embedding_batch_size: int = 256
+    # Encode processes for full rebuilds (1 = encode in-process, 0 = one per CPU); each
+    # batch is one shard, checkpointed to the embedding cache as it completes
+    encode_workers: int = 1
+    encode_worker_threads: int = 0  # Model threads per encode process (0 = CPUs / workers)
+    encode_shards_in_flight: int = 0  # Shards queued ahead of the one being collected (0 = 2 * workers)
+    # Per-session vector index of chat turns, fed by /api/chat (oldest turns evicted past either limit)
+    conversation_memory_enabled: bool = True
+    conversation_memory_path: str = "./storage/conversation_memory.npz"
+    conversation_memory_max_turns: int = 10000
+    conversation_memory_max_age_seconds: float = 604800.0  # 0 keeps turns until the size limit
+    conversation_memory_persist_interval_seconds: float = 60.0  # 0 persists only on shutdown
+    conversation_memory_k: int = 0  # Earlier turns added to the chat context (0 disables)
+    assistant_name: str = "Isabella"  # Speaker label of the assistant in recalled turns
+    # Semantic cache of direct LLM responses (use_letta=False), per model + retrieved chunks;
+    # cleared when the index generation changes
+    response_cache_enabled: bool = False
+    response_cache_max_entries: int = 1000
+    response_cache_ttl_seconds: float = 3600.0
+    response_cache_similarity_threshold: float = 0.95  # Cosine between prompt embeddings
     log_level: str = "DEBUG"
     
     class Config:
@@ -5,56 +5,108 @@ from routes.chat import router as chat_router
 from services.db_service import db_service
 from services.rag_service import rag_service
 from services.letta_service import letta_service
-from utils.logger import log_info, log_success, log_error
+from services.llm_service import llm_service
+from services.conversation_memory import conversation_memory
+from services.provider_clients import provider_clients
+from utils.logger import log_info, log_success
 from utils.file_watcher import FileWatcher
+from utils.readiness import readiness
 from config import settings
+import asyncio
 import uvicorn
 
 
 # File watcher instance
 file_watcher = None
 
+# Background task initializing the subsystems
+startup_task = None
+
+
+async def start_rag():
+    """Load the embedding model and index, then watch the data folder"""
+    global file_watcher
+    log_info("Initializing RAG service...")
+    # Load the embedding model and the index in parallel worker threads so
+    # requests are served meanwhile (check history.txt only at startup)
+    await asyncio.gather(
+        asyncio.to_thread(rag_service.warm_up),
+        asyncio.to_thread(rag_service.initialize_index, check_history=True)
+    )
+    
+    file_watcher = FileWatcher(
+        settings.data_folder,
+        lambda: rag_service.initialize_index(force_rebuild=False, check_history=False),  # Don't check history during file watch
+        ignore_file=settings.history_file_path  # Ignore history.txt changes
+    )
+    file_watcher.start()
+
+
+async def start_letta():
+    await asyncio.to_thread(letta_service.initialize)
+    if letta_service.client is None:
+        raise RuntimeError("running without Letta memory")
+
+
+async def start_subsystems():
+    """Initialize MongoDB, the RAG index and Letta concurrently"""
+    llm_service.log_configuration()
+    if settings.conversation_memory_enabled:
+        await asyncio.to_thread(conversation_memory.load)
+        conversation_memory.start()
+    results = await asyncio.gather(
+        readiness.run('mongodb', db_service.connect),
+        readiness.run('rag', start_rag),
+        readiness.run('letta', start_letta)
+    )
+    if all(results):
+        log_success("✅ LettaXRAG backend ready!")
+    else:
+        log_info("⚠️  LettaXRAG backend started with degraded subsystems (see /api/ready)")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Startup and shutdown events"""
+    """Startup and shutdown events
+    
+    The server starts accepting requests (liveness) right away while the
+    subsystems initialize in the background; /api/ready reports when they
+    are done.
+    """
     # Startup
     log_info("🚀 Starting LettaXRAG backend...")
-    
-    try:
-        # Initialize MongoDB
-        await db_service.connect()
-        
-        # Initialize RAG service (check history.txt only at startup)
-        log_info("Initializing RAG service...")
-        rag_service.initialize_index(check_history=True)
-        
-        # Initialize Letta service
-        letta_service.initialize()
-        
-        # Start file watcher
-        global file_watcher
-        file_watcher = FileWatcher(
-            settings.data_folder,
-            lambda: rag_service.initialize_index(force_rebuild=False, check_history=False),  # Don't check history during file watch
-            ignore_file=settings.history_file_path  # Ignore history.txt changes
-        )
-        file_watcher.start()
-        
-        log_success("✅ LettaXRAG backend ready!")
-        
-    except Exception as e:
-        log_error(f"Error during startup: {str(e)}")
+    global startup_task
+    for name in ('mongodb', 'rag', 'letta'):
+        readiness.register(name)
+    startup_task = asyncio.create_task(start_subsystems())
     
     yield
     
     # Shutdown
     log_info("Shutting down LettaXRAG backend...")
     
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+        try:
+            await startup_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    
     # Stop file watcher
     if file_watcher:
         file_watcher.stop()
     
+    # Write the final conversation memory snapshot
+    if settings.conversation_memory_enabled:
+        await conversation_memory.close()
+    
+    # Stop the query embedding scheduler
+    await rag_service.query_batcher.close()
+    
+    # Close the pooled provider and Letta streaming connections
+    await provider_clients.close()
+    await letta_service.close()
+    
     # Disconnect from MongoDB
     await db_service.disconnect()
     
@@ -1,19 +1,42 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 
+class RetrievalFilters(BaseModel):
+    sources: Optional[List[str]] = None  # File names, e.g. "about_isabella.md"
+    file_types: Optional[List[str]] = None  # Extensions, e.g. ".pdf"
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    exclude_history: bool = False
+
+
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
     model: Optional[str] = "longcat"
     use_rag: Optional[bool] = True
     use_letta: Optional[bool] = True
+    retrieval_mode: Optional[str] = None  # vector, lexical or hybrid (default from settings)
+    filters: Optional[RetrievalFilters] = None
+
+
+class RagHit(BaseModel):
+    id: int
+    score: float
+    distance: Optional[float] = None
+    lexical_score: Optional[float] = None
+    source: str
+    chunk_id: Optional[int] = None
+    file_path: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     response: str
     rag_sources: List[str] = []
+    rag_hits: List[RagHit] = []
+    cached: bool = False  # Answered from the response cache
+    route: Dict[str, Any] = {}  # How the answer was served (letta, provider, cache or fallback)
     timestamp: str
 
 
@@ -34,7 +57,25 @@ class HealthResponse(BaseModel):
     timestamp: str
 
 
+class ReadyResponse(BaseModel):
+    ready: bool
+    subsystems: Dict[str, Dict[str, Any]] = {}
+    timestamp: str
+
+
+class MemoryHit(BaseModel):
+    message: str
+    response: str
+    timestamp: float
+    score: float
+
+
 class StatsResponse(BaseModel):
     message_count: int
     indexed_documents: int
+    rag: Dict[str, Any] = {}
+    conversation_memory: Dict[str, Any] = {}
+    response_cache: Dict[str, Any] = {}
+    llm_routing: Dict[str, Any] = {}
+    provider_queues: Dict[str, Any] = {}
     timestamp: str
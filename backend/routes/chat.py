@@ -1,18 +1,27 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from models.schemas import ChatRequest, ChatResponse, HealthResponse, StatsResponse
+from fastapi import APIRouter, HTTPException, Request, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
+from models.schemas import ChatRequest, ChatResponse, HealthResponse, MemoryHit, ReadyResponse, StatsResponse, RagHit
+from services.conversation_memory import conversation_memory
 from services.db_service import db_service
 from services.rag_service import rag_service
-from services.letta_service import letta_service
-from services.llm_service import llm_service
+from services.retrieval_filter import RetrievalFilter
+from services.llm_service import FALLBACK_RESPONSE, StreamInterruptedError, llm_service
+from services.response_cache import context_key, response_cache
+from services.provider_router import provider_router
+from services.provider_scheduler import provider_scheduler
+from utils.readiness import readiness
 from utils.logger import (
-    log_user_prompt, log_rag_results, log_final_prompt,
+    log_user_prompt, log_rag_results,
     log_outgoing_response, log_info, log_error
 )
 from datetime import datetime, timezone
+import asyncio
+import json
 import uuid
 import os
 from config import settings
 from pathlib import Path
+from typing import List
 
 router = APIRouter()
 
@@ -41,6 +50,86 @@ def append_to_history(user_message: str, model_response: str):
         log_error(f"Error appending to history: {str(e)}")
 
 
+async def embed_message(message: str):
+    """Query embedding for the conversation memory and response cache (None when neither is enabled or it is unavailable)"""
+    if not (settings.conversation_memory_enabled or settings.response_cache_enabled):
+        return None
+    try:
+        return await rag_service.aembed_query(message)
+    except Exception as e:
+        log_error(f"Error embedding message: {str(e)}")
+        return None
+
+
+async def retrieve_for_chat(request: ChatRequest, session_id: str):
+    """RAG hits, prompt context and query embedding for a chat message"""
+    # Retrieve relevant context from RAG (skip if use_rag is disabled)
+    rag_hits = []
+    if request.use_rag:
+        filters = RetrievalFilter.from_dict(request.filters.model_dump()) if request.filters else None
+        rag_hits = await rag_service.asearch(request.message, k=3, mode=request.retrieval_mode, filters=filters)
+    rag_context = [hit['text'] for hit in rag_hits]
+    if request.use_rag:
+        log_rag_results(rag_context)
+    else:
+        log_info("RAG disabled by user toggle")
+    
+    # Earlier turns of this session (reuses the query embedding retrieval just computed)
+    query_embedding = await embed_message(request.message)
+    if query_embedding is not None and settings.conversation_memory_enabled and request.session_id and settings.conversation_memory_k > 0:
+        for turn in conversation_memory.search(session_id, query_embedding, k=settings.conversation_memory_k):
+            rag_context.append(f"Earlier in this conversation:\nUser: {turn['message']}\n{settings.assistant_name}: {turn['response']}")
+    
+    return rag_hits, rag_context, query_embedding
+
+
+async def record_turn(request: ChatRequest, session_id: str, rag_context: List[str], llm_response: str, query_embedding):
+    """Persist a completed turn to history.txt, the conversation memory and MongoDB"""
+    log_outgoing_response(llm_response)
+    
+    # Append to history.txt (do NOT trigger re-embedding)
+    append_to_history(request.message, llm_response)
+    
+    # Searchable in this session from the next turn on
+    if query_embedding is not None and settings.conversation_memory_enabled:
+        conversation_memory.add_turn(session_id, request.message, llm_response, query_embedding)
+    
+    # Save to database
+    message_data = {
+        "timestamp": datetime.utcnow(),
+        "user_prompt": request.message,
+        "letta_processed_prompt": request.message,  # Same as user prompt now
+        "rag_context":  rag_context,
+        "final_prompt": request.message,
+        "llm_response": llm_response,
+        "session_id": session_id
+    }
+    await db_service.save_message(message_data)
+
+
+def response_cache_context(request: ChatRequest, rag_hits: List[dict], rag_context: List[str]):
+    """Response cache context of a chat (None when the cache does not apply)
+    
+    Only direct provider answers are cached; with Letta memory the reply
+    also depends on the agent's state.
+    """
+    if not settings.response_cache_enabled or request.use_letta:
+        return None
+    # Anything beyond the retrieved chunks (earlier turns) is part of the key too
+    return context_key(request.model or "longcat", [hit['id'] for hit in rag_hits], rag_context[len(rag_hits):])
+
+
+def cache_response(request: ChatRequest, cache_context, query_embedding, llm_response: str, route: dict):
+    """Cache a complete answer (never a fallback or a reply whose route reports an error)"""
+    if cache_context is not None and llm_response and llm_response != FALLBACK_RESPONSE and not route.get("error"):
+        response_cache.put(cache_context, request.message, query_embedding, rag_service.index_generation, llm_response)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Main chat endpoint"""
@@ -50,54 +139,42 @@ async def chat(request: ChatRequest):
         # Log incoming user prompt
         log_user_prompt(request.message)
         
-        # Retrieve relevant context from RAG (skip if use_rag is disabled)
-        rag_context = []
-        if request.use_rag:
-            rag_context = rag_service.retrieve_context(request.message, k=3)
-            log_rag_results(rag_context)
-        else:
-            log_info("RAG disabled by user toggle")
-        
-        # Generate response from LLM (Letta handles memory inside this)
-        use_letta = bool(request.use_letta)
-        llm_response = await llm_service.generate_response(
-            prompt=request.message,  # Send original message, not Letta-processed
-            rag_context=rag_context,
-            model=request.model or "longcat",
-            use_memory=use_letta,
-        )
+        rag_hits, rag_context, query_embedding = await retrieve_for_chat(request, session_id)
         
-        log_outgoing_response(llm_response)
+        # Semantically repeated questions against the same chunks skip the provider
+        cache_context = response_cache_context(request, rag_hits, rag_context)
+        llm_response = None
+        if cache_context is not None:
+            llm_response = response_cache.get(cache_context, request.message, query_embedding, rag_service.index_generation)
+        cached = llm_response is not None
+        route = {}
+        if cached:
+            log_info("💾 Response served from cache")
+            route = {"via": "cache", "model": request.model or "longcat"}
+        else:
+            # Generate response from LLM (Letta handles memory inside this)
+            use_letta = bool(request.use_letta)
+            llm_response = await llm_service.generate_response(
+                prompt=request.message,  # Send original message, not Letta-processed
+                rag_context=rag_context,
+                model=request.model or "longcat",
+                use_memory=use_letta,
+                route=route,
+                session_id=session_id,
+            )
+            cache_response(request, cache_context, query_embedding, llm_response, route)
         
-        # Append to history.txt (do NOT trigger re-embedding)
-        append_to_history(request.message, llm_response)
+        await record_turn(request, session_id, rag_context, llm_response, query_embedding)
         
-        # Save to database
-        message_data = {
-            "timestamp": datetime.utcnow(),
-            "user_prompt": request.message,
-            "letta_processed_prompt": request.message,  # Same as user prompt now
-            "rag_context":  rag_context,
-            "final_prompt": request.message,
-            "llm_response": llm_response,
-            "session_id": session_id
-        }
-        await db_service.save_message(message_data)
-        
-        # Get source filenames
-        rag_sources = []
-        if rag_context:
-            for ctx in rag_context[: 3]: 
-                for meta in rag_service.metadata: 
-                    if rag_service.documents[rag_service.metadata.index(meta)] == ctx:
-                        source = meta.get('source', 'Unknown')
-                        if source not in rag_sources: 
-                            rag_sources. append(source)
-                        break
+        # Get source filenames straight from the search hits
+        rag_sources = list(dict.fromkeys(hit['source'] for hit in rag_hits))
         
         return ChatResponse(
             response=llm_response,
             rag_sources=rag_sources,
+            rag_hits=[RagHit(**hit) for hit in rag_hits],
+            cached=cached,
+            route=route,
             timestamp=datetime.utcnow().isoformat()
         )
         
@@ -106,6 +183,84 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """Streaming chat endpoint (Server-Sent Events)
+    
+    Emits a `sources` event as soon as retrieval is done, then `token`
+    events as the model generates, then `done`. The turn is saved only
+    after the stream completes; if the client disconnects the upstream
+    generation is cancelled and nothing is saved. A stream that fails
+    partway ends with an `error` event (`partial: true`) instead of `done`,
+    and the partial reply is not saved.
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    log_user_prompt(request.message)
+    
+    async def events():
+        try:
+            rag_hits, rag_context, query_embedding = await retrieve_for_chat(request, session_id)
+            yield sse_event("sources", {
+                "session_id": session_id,
+                "rag_sources": list(dict.fromkeys(hit['source'] for hit in rag_hits)),
+                "rag_hits": [RagHit(**hit).model_dump(mode='json') for hit in rag_hits]
+            })
+            
+            cache_context = response_cache_context(request, rag_hits, rag_context)
+            llm_response = None
+            if cache_context is not None:
+                llm_response = response_cache.get(cache_context, request.message, query_embedding, rag_service.index_generation)
+            cached = llm_response is not None
+            route = {}
+            if cached:
+                log_info("💾 Response served from cache")
+                route = {"via": "cache", "model": request.model or "longcat"}
+                yield sse_event("token", {"text": llm_response})
+            else:
+                parts = []
+                tokens = llm_service.stream_response(
+                    prompt=request.message,
+                    rag_context=rag_context,
+                    model=request.model or "longcat",
+                    use_memory=bool(request.use_letta),
+                    route=route,
+                    session_id=session_id,
+                )
+                completed = False  # Stays False if the stream is cut short
+                try:
+                    async for text in tokens:
+                        if await http_request.is_disconnected():
+                            log_info("Client disconnected, cancelling stream")
+                            return
+                        parts.append(text)
+                        yield sse_event("token", {"text": text})
+                    completed = True
+                finally:
+                    await tokens.aclose()  # Closes the upstream stream on early exit
+                llm_response = "".join(parts)
+                if completed:
+                    cache_response(request, cache_context, query_embedding, llm_response, route)
+            
+            await record_turn(request, session_id, rag_context, llm_response, query_embedding)
+            yield sse_event("done", {"cached": cached, "route": route, "timestamp": datetime.utcnow().isoformat()})
+        
+        except asyncio.CancelledError:
+            log_info("Client disconnected, stream cancelled")
+            raise
+        except StreamInterruptedError as e:
+            log_error(f"Chat stream interrupted, reply not saved: {str(e)}")
+            yield sse_event("error", {"detail": str(e), "partial": True, "route": route})
+        except Exception as e:
+            log_error(f"Error in chat stream: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
@@ -122,6 +277,19 @@ async def health_check():
     )
 
 
+@router.get("/ready", response_model=ReadyResponse)
+async def readiness_check(response: Response):
+    """Readiness endpoint: 200 once MongoDB and the RAG index are initialized, 503 until then"""
+    ready = readiness.is_ready()
+    if not ready:
+        response.status_code = 503
+    return ReadyResponse(
+        ready=ready,
+        subsystems=readiness.get_stats(),
+        timestamp=datetime.utcnow().isoformat()
+    )
+
+
 @router.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     """Upload file to data folder"""
@@ -147,7 +315,8 @@ async def upload_file(file: UploadFile = File(...)):
         
         # Trigger incremental re-indexing (not full rebuild, don't check history)
         log_info("Triggering incremental re-indexing...")
-        rag_service.initialize_index(force_rebuild=False, check_history=False)
+        # Runs in a worker thread; queries keep using the published index snapshot meanwhile
+        await asyncio.to_thread(rag_service.initialize_index, force_rebuild=False, check_history=False)
         
         return {
             "message": "File uploaded successfully",
@@ -170,9 +339,25 @@ async def get_stats():
         return StatsResponse(
             message_count=message_count,
             indexed_documents=rag_stats['indexed_documents'],
+            rag=rag_stats,
+            conversation_memory=conversation_memory.get_stats(),
+            response_cache=response_cache.get_stats(),
+            llm_routing=provider_router.get_stats(),
+            provider_queues=provider_scheduler.get_stats(),
             timestamp=datetime.utcnow().isoformat()
         )
         
     except Exception as e:
         log_error(f"Error getting stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/sessions/{session_id}/memory", response_model=List[MemoryHit])
+async def search_session_memory(session_id: str, q: str, k: int = 3):
+    """Search earlier turns of a session"""
+    try:
+        query_embedding = await rag_service.aembed_query(q)
+        return [MemoryHit(**turn) for turn in conversation_memory.search(session_id, query_embedding, k=k)]
+    except Exception as e:
+        log_error(f"Error searching conversation memory: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,445 @@
+import json
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from utils.logger import log_info, log_success, log_error
+
+
+# Fixed-width per-chunk metadata row. File paths, names and digests live once
+# per file in files.json and are referenced by file_idx.
+CHUNK_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('chunk_id', '<i4'),
+    ('file_idx', '<i4'),
+    ('deleted', '?'),
+])
+
+# Version 2 keeps the FAISS index, index info and the append log inside each generation
+STORE_VERSION = 2
+INDEX_FILE = 'index.faiss'
+LOG_FILE = 'log.jsonl'
+
+
+class TextColumn:
+    """Chunk texts stored as one UTF-8 blob plus an offsets array
+
+    The persisted part is memory-mapped, so opening a store costs nothing
+    and the pages are shared between processes. Appended texts live in an
+    in-memory tail until the next save.
+    """
+
+    def __init__(self, blob: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None):
+        self._blob = blob if blob is not None else np.zeros(0, dtype='uint8')
+        self._offsets = offsets if offsets is not None else np.zeros(1, dtype='int64')
+        self._tail: List[str] = []
+
+    @classmethod
+    def from_list(cls, texts: Iterable[str]) -> 'TextColumn':
+        column = cls()
+        column.extend(texts)
+        return column
+
+    def _base_len(self) -> int:
+        return len(self._offsets) - 1
+
+    def __len__(self) -> int:
+        return self._base_len() + len(self._tail)
+
+    def __getitem__(self, pos: int) -> str:
+        base_len = self._base_len()
+        if pos < 0:
+            pos += len(self)
+        if pos < base_len:
+            start, end = self._offsets[pos], self._offsets[pos + 1]
+            return self._blob[start:end].tobytes().decode('utf-8')
+        return self._tail[pos - base_len]
+
+    def __iter__(self) -> Iterator[str]:
+        for pos in range(len(self)):
+            yield self[pos]
+
+    def extend(self, texts: Iterable[str]):
+        self._tail.extend(texts)
+
+    def snapshot(self) -> 'TextColumn':
+        """Copy that later `extend` calls do not affect (shares the memory-mapped base)"""
+        column = TextColumn(self._blob, self._offsets)
+        column._tail = list(self._tail)
+        return column
+
+    def take(self, positions: Iterable[int]) -> 'TextColumn':
+        """New in-memory column with only the given rows"""
+        return TextColumn.from_list(self[pos] for pos in positions)
+
+    def write(self, directory: Path):
+        """Write texts.bin and text_offsets.npy (the persisted blob is copied as-is)"""
+        offsets = np.empty(len(self) + 1, dtype='int64')
+        base_len = self._base_len()
+        offsets[:base_len + 1] = self._offsets
+        with open(directory / 'texts.bin', 'wb') as f:
+            f.write(memoryview(self._blob))
+            position = int(self._offsets[-1])
+            for i, text in enumerate(self._tail, start=base_len + 1):
+                data = text.encode('utf-8')
+                f.write(data)
+                position += len(data)
+                offsets[i] = position
+        np.save(directory / 'text_offsets.npy', offsets)
+
+
+class MetadataColumn:
+    """Chunk metadata as a fixed-width table plus a per-file string table
+
+    Rows read back as the dicts used throughout RAGService
+    ({'id', 'source', 'chunk_id', 'file_hash', 'file_path', 'uploaded_at'}).
+    Per-file attributes (name, digest, upload time) live in the file table.
+    """
+
+    def __init__(self, table: Optional[np.ndarray] = None, files: Optional[List[dict]] = None):
+        self._table = table if table is not None else np.zeros(0, dtype=CHUNK_DTYPE)
+        self._files: List[dict] = list(files or [])
+        self._file_index = {(f['file_path'], f['file_hash']): i for i, f in enumerate(self._files)}
+        self._tail: List[Tuple[int, int, int]] = []  # (id, chunk_id, file_idx)
+
+    @classmethod
+    def from_dicts(cls, metadata: Iterable[dict]) -> 'MetadataColumn':
+        column = cls()
+        column.extend(metadata)
+        return column
+
+    def __len__(self) -> int:
+        return len(self._table) + len(self._tail)
+
+    def _row(self, pos: int) -> Tuple[int, int, int]:
+        if pos < 0:
+            pos += len(self)
+        if pos < len(self._table):
+            row = self._table[pos]
+            return int(row['id']), int(row['chunk_id']), int(row['file_idx'])
+        return self._tail[pos - len(self._table)]
+
+    def __getitem__(self, pos: int) -> dict:
+        chunk_uid, chunk_id, file_idx = self._row(pos)
+        file_info = self._files[file_idx]
+        return {
+            'id': chunk_uid,
+            'source': file_info['source'],
+            'chunk_id': chunk_id,
+            'file_hash': file_info['file_hash'],
+            'file_path': file_info['file_path'],
+            'uploaded_at': file_info.get('uploaded_at', 0.0)
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for pos in range(len(self)):
+            yield self[pos]
+
+    def _file_idx(self, meta: dict) -> int:
+        file_path = meta.get('file_path') or meta.get('source') or ''
+        key = (file_path, meta.get('file_hash', ''))
+        if key not in self._file_index:
+            self._file_index[key] = len(self._files)
+            self._files.append({
+                'file_path': file_path,
+                'source': meta.get('source') or Path(file_path).name,
+                'file_hash': meta.get('file_hash', ''),
+                'uploaded_at': float(meta.get('uploaded_at', 0.0))
+            })
+        return self._file_index[key]
+
+    def extend(self, metadata: Iterable[dict]):
+        for meta in metadata:
+            self._tail.append((int(meta['id']), int(meta.get('chunk_id', 0)), self._file_idx(meta)))
+
+    def snapshot(self) -> 'MetadataColumn':
+        """Copy that later `extend` calls do not affect (shares the memory-mapped base)"""
+        column = MetadataColumn(self._table, self._files)
+        column._tail = list(self._tail)
+        return column
+
+    def ids(self) -> np.ndarray:
+        """Chunk IDs of every row"""
+        tail_ids = np.array([row[0] for row in self._tail], dtype='int64')
+        return np.concatenate([np.asarray(self._table['id'], dtype='int64'), tail_ids])
+
+    def file_indexes(self) -> np.ndarray:
+        """Position in the file table (see `files`) of every row"""
+        return np.concatenate([
+            np.asarray(self._table['file_idx'], dtype='int64'),
+            np.array([row[2] for row in self._tail], dtype='int64')
+        ])
+
+    def files(self) -> List[dict]:
+        """The file table: {'file_path', 'source', 'file_hash', 'uploaded_at'} per file"""
+        return self._files
+
+    def file_paths(self) -> List[str]:
+        """File path of every row"""
+        paths = [f['file_path'] for f in self._files]
+        return [paths[i] for i in self.file_indexes().tolist()]
+
+    def deleted_mask(self) -> np.ndarray:
+        """Tombstone flags as persisted (rows appended since are live)"""
+        return np.concatenate([np.asarray(self._table['deleted'], dtype=bool), np.zeros(len(self._tail), dtype=bool)])
+
+    def take(self, positions: Iterable[int]) -> 'MetadataColumn':
+        """New in-memory column with only the given rows"""
+        return MetadataColumn.from_dicts(self[pos] for pos in positions)
+
+    def write(self, directory: Path, deleted_ids: Set[int]):
+        """Write chunks.npy and files.json"""
+        table = np.zeros(len(self), dtype=CHUNK_DTYPE)
+        base_len = len(self._table)
+        table[:base_len] = self._table
+        for i, (chunk_uid, chunk_id, file_idx) in enumerate(self._tail, start=base_len):
+            table[i] = (chunk_uid, chunk_id, file_idx, False)
+        table['deleted'] = np.isin(table['id'], np.fromiter(deleted_ids, dtype='int64', count=len(deleted_ids)))
+        np.save(directory / 'chunks.npy', table)
+        with open(directory / 'files.json', 'w') as f:
+            json.dump(self._files, f)
+
+
+def store_exists(root: str) -> bool:
+    """True if a chunk store has been written at `root`"""
+    return os.path.exists(os.path.join(root, 'CURRENT'))
+
+
+def current_generation(root: str) -> Path:
+    """Directory of the generation CURRENT points at"""
+    root_path = Path(root)
+    return root_path / (root_path / 'CURRENT').read_text().strip()
+
+
+def store_file(root: str, name: str) -> Optional[Path]:
+    """Path of a file in the current generation, or None if it is missing"""
+    if not store_exists(root):
+        return None
+    path = current_generation(root) / name
+    return path if path.exists() else None
+
+
+def _fsync(path: Path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def write_store(
+    root: str,
+    documents: TextColumn,
+    metadata: MetadataColumn,
+    deleted_ids: Set[int],
+    embeddings: np.ndarray,
+    info: Optional[dict] = None,
+    index_writer: Optional[Callable[[str], None]] = None,
+    extra_writers: Optional[List[Callable[[Path], None]]] = None
+):
+    """Write a new store generation (a checkpoint) and atomically point CURRENT at it
+
+    `info` is stored in store.json and `index_writer` is called with the path
+    the FAISS index should be written to, so chunks, index and index info of a
+    checkpoint are committed together. `extra_writers` are called with the
+    generation directory to add further files (e.g. the BM25 index). The new
+    generation starts with an empty log.
+
+    Older generations are removed afterwards; processes that still have them
+    memory-mapped keep reading the unlinked files until they reload.
+    """
+    root_path = Path(root)
+    root_path.mkdir(parents=True, exist_ok=True)
+    generation = f"gen-{time.time_ns()}"
+    directory = root_path / generation
+    directory.mkdir()
+
+    documents.write(directory)
+    metadata.write(directory, deleted_ids)
+    np.save(directory / 'embeddings.npy', np.ascontiguousarray(embeddings))
+    if index_writer is not None:
+        index_writer(str(directory / INDEX_FILE))
+    for writer in extra_writers or []:
+        writer(directory)
+    with open(directory / 'store.json', 'w') as f:
+        json.dump({**(info or {}), 'version': STORE_VERSION, 'chunks': len(metadata)}, f)
+    for path in directory.rglob('*'):
+        if path.is_file():
+            _fsync(path)
+
+    pointer_tmp = root_path / 'CURRENT.tmp'
+    pointer_tmp.write_text(generation)
+    os.replace(pointer_tmp, root_path / 'CURRENT')
+
+    for old in root_path.glob('gen-*'):
+        if old.name != generation:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def open_text_column(directory: Path) -> TextColumn:
+    """Memory-map a TextColumn written to `directory`"""
+    offsets = np.load(directory / 'text_offsets.npy', mmap_mode='r')
+    blob_path = directory / 'texts.bin'
+    if os.path.getsize(blob_path) > 0:
+        blob = np.memmap(blob_path, dtype='uint8', mode='r')
+    else:
+        blob = np.zeros(0, dtype='uint8')  # mmap of an empty file is not allowed
+    return TextColumn(blob, offsets)
+
+
+def _open_columns(directory: Path) -> Tuple[TextColumn, MetadataColumn, np.ndarray]:
+    """Memory-map the columns written to `directory`"""
+    texts = open_text_column(directory)
+    table = np.load(directory / 'chunks.npy', mmap_mode='r')
+    with open(directory / 'files.json', 'r') as f:
+        files = json.load(f)
+    embeddings = np.load(directory / 'embeddings.npy', mmap_mode='r')
+
+    return texts, MetadataColumn(table, files), embeddings
+
+
+def open_store(root: str) -> Tuple[TextColumn, MetadataColumn, np.ndarray]:
+    """Open the current store generation's checkpoint with every column memory-mapped
+
+    Updates appended since the checkpoint are not included; see `read_log`.
+    """
+    return _open_columns(current_generation(root))
+
+
+def read_store_info(root: str) -> dict:
+    """Index info saved with the current checkpoint
+
+    `next_chunk_id` also accounts for IDs issued by logged updates since.
+    """
+    path = store_file(root, 'store.json')
+    if path is None:
+        return {}
+    with open(path, 'r') as f:
+        info = json.load(f)
+    for record in read_log(root):
+        if 'next_chunk_id' in record:
+            info['next_chunk_id'] = max(info.get('next_chunk_id', 0), record['next_chunk_id'])
+    return info
+
+
+def append_log(
+    root: str,
+    documents: List[str],
+    metadata: List[dict],
+    embeddings: np.ndarray,
+    deleted_ids: Iterable[int],
+    next_chunk_id: int
+) -> int:
+    """Append one incremental update to the current generation's log
+
+    New chunks are written as a small segment (same column layout as a
+    checkpoint) and tombstoned IDs are listed in the record itself, so the
+    cost is proportional to the update, not the corpus. Segment files are
+    fsync'ed before the record is appended and the record is fsync'ed
+    before returning; a torn last line is ignored by `read_log`.
+
+    Returns the number of records now in the log.
+    """
+    directory = current_generation(root)
+    record = {'deleted': sorted(int(i) for i in deleted_ids), 'next_chunk_id': next_chunk_id}
+    if documents:
+        segment = f"seg-{time.time_ns()}"
+        segment_dir = directory / segment
+        segment_dir.mkdir()
+        TextColumn.from_list(documents).write(segment_dir)
+        MetadataColumn.from_dicts(metadata).write(segment_dir, set())
+        np.save(segment_dir / 'embeddings.npy', np.ascontiguousarray(embeddings))
+        for path in segment_dir.iterdir():
+            _fsync(path)
+        record['segment'] = segment
+
+    with open(directory / LOG_FILE, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return len(read_log(root))
+
+
+def read_log(root: str) -> List[dict]:
+    """Records appended to the current generation's log, oldest first
+
+    Stops at the first unreadable line (a write interrupted by a crash) and
+    skips records whose segment is missing.
+    """
+    path = store_file(root, LOG_FILE)
+    if path is None:
+        return []
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                log_error(f"Ignoring torn record at the end of {path}")
+                break
+            if record.get('segment') and not (path.parent / record['segment']).exists():
+                log_error(f"Ignoring log record with missing segment {record['segment']}")
+                continue
+            records.append(record)
+    return records
+
+
+def open_segment(root: str, segment: str) -> Tuple[TextColumn, MetadataColumn, np.ndarray]:
+    """Memory-map the columns of one logged segment"""
+    return _open_columns(current_generation(root) / segment)
+
+
+def migrate_legacy_storage(root: str, metadata_path: str, embedding_dim: int = 384) -> bool:
+    """One-time conversion of pickle/JSON/.npy storage into a chunk store
+
+    Reads `doc_metadata.json`, `doc_metadata_docs.pkl` and
+    `doc_metadata_embeddings.npy`, writes them as a chunk store at `root` and
+    renames the old files with a `.migrated` suffix. Chunk IDs and tombstones
+    are kept; metadata from before chunk IDs existed gets row positions as IDs.
+
+    Returns True if a migration happened.
+    """
+    docs_path = metadata_path.replace('.json', '_docs.pkl')
+    embeddings_path = metadata_path.replace('.json', '_embeddings.npy')
+    if store_exists(root) or not (os.path.exists(metadata_path) and os.path.exists(docs_path)):
+        return False
+
+    log_info(f"📦 Migrating {metadata_path} to memory-mapped chunk store at {root}...")
+    try:
+        with open(metadata_path, 'r') as f:
+            legacy_metadata = json.load(f)
+        with open(docs_path, 'rb') as f:
+            legacy_documents = pickle.load(f)
+        if os.path.exists(embeddings_path):
+            embeddings = np.load(embeddings_path).astype('float32')
+        else:
+            embeddings = np.array([]).astype('float32').reshape(0, embedding_dim)
+
+        deleted_ids = set()
+        for pos, meta in enumerate(legacy_metadata):
+            meta.setdefault('id', pos)
+            if meta.get('deleted'):
+                deleted_ids.add(meta['id'])
+
+        write_store(
+            root,
+            TextColumn.from_list(legacy_documents),
+            MetadataColumn.from_dicts(legacy_metadata),
+            deleted_ids,
+            embeddings
+        )
+        for path in (metadata_path, docs_path, embeddings_path):
+            if os.path.exists(path):
+                os.replace(path, f"{path}.migrated")
+        log_success(f"✅ Migrated {len(legacy_documents)} chunks to the chunk store")
+        return True
+    except Exception as e:
+        log_error(f"Error migrating legacy index storage: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    # python -m services.chunk_store  (run from backend/) converts an existing storage/ directory
+    from config import settings
+    if not migrate_legacy_storage(settings.chunk_store_path, settings.metadata_path):
+        log_info("Nothing to migrate")
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import List
+import numpy as np
+from config import settings
+from services.vector_codec import decode_vectors, encode_vectors, storage_dtype
+from utils.logger import log_info, log_success, log_error
+
+
+class ConversationMemory:
+    """In-memory vector index of chat turns, searchable per session
+
+    `/api/chat` appends every turn as it happens, keyed by the embedding of
+    the user message that retrieval already computed, so past turns are
+    searchable right away instead of after history.txt is re-embedded on a
+    restart. Turns are kept per session in arrival order; the oldest turns
+    (across all sessions) are evicted past `max_turns` or `max_age_seconds`.
+    The index is snapshotted to a single .npz file every
+    `persist_interval_seconds` when it changed, and on shutdown.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model_name: str,
+        max_turns: int = 10000,
+        max_age_seconds: float = 0.0,
+        persist_interval_seconds: float = 60.0,
+        dtype: str = 'float32'
+    ):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.max_turns = max(1, max_turns)
+        self.max_age_seconds = max_age_seconds
+        self.persist_interval_seconds = persist_interval_seconds
+        self.dtype = storage_dtype(dtype)
+        # session_id -> deque of (timestamp, user message, response, stored embedding)
+        self._sessions: OrderedDict = OrderedDict()
+        # (timestamp, session_id) of every turn, oldest first (eviction order)
+        self._order: deque = deque()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._persist_task = None
+        self.evictions = 0
+
+    def add_turn(self, session_id: str, message: str, response: str, embedding: np.ndarray):
+        """Append one turn of a session, evicting the oldest turns past the limits"""
+        now = time.time()
+        stored = encode_vectors(np.asarray(embedding, dtype='float32').reshape(-1), self.dtype)
+        with self._lock:
+            self._sessions.setdefault(session_id, deque()).append((now, message, response, stored))
+            self._order.append((now, session_id))
+            self._evict(now)
+            self._dirty = True
+
+    def _evict(self, now: float):
+        """Drop the oldest turns while over the size or age limit (caller holds the lock)"""
+        while self._order and (
+            len(self._order) > self.max_turns
+            or (self.max_age_seconds > 0 and now - self._order[0][0] > self.max_age_seconds)
+        ):
+            _, session_id = self._order.popleft()
+            turns = self._sessions[session_id]
+            turns.popleft()  # A session's oldest turn is the globally oldest of its turns
+            if not turns:
+                del self._sessions[session_id]
+            self.evictions += 1
+
+    def search(self, session_id: str, query_embedding: np.ndarray, k: int = 3) -> List[dict]:
+        """Top-k earlier turns of a session by cosine similarity to the query"""
+        with self._lock:
+            self._evict(time.time())
+            turns = list(self._sessions.get(session_id, ()))
+        if not turns or k <= 0:
+            return []
+        vectors = decode_vectors(np.stack([turn[3] for turn in turns]))
+        query = np.asarray(query_embedding, dtype='float32').reshape(-1)
+        norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+        scores = vectors @ query / np.clip(norms, 1e-12, None)
+        top = np.argsort(-scores)[:k]
+        return [
+            {
+                'message': turns[i][1],
+                'response': turns[i][2],
+                'timestamp': turns[i][0],
+                'score': float(scores[i])
+            }
+            for i in top
+        ]
+
+    def load(self):
+        """Restore the last snapshot (skipped if it was made with another embedding model)"""
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                header = json.loads(bytes(data['header']).decode('utf-8'))
+                if header.get('model') != self.model_name:
+                    log_info(f"⚠️  Conversation memory was embedded with {header.get('model')}, starting empty")
+                    return
+                embeddings = data['embeddings']
+                texts = json.loads(bytes(data['texts']).decode('utf-8'))
+                timestamps = data['timestamps']
+                sessions = header['sessions']
+                session_codes = data['session_codes']
+            with self._lock:
+                self._sessions.clear()
+                self._order.clear()
+                for i in np.argsort(timestamps, kind='stable'):  # Eviction order is global arrival order
+                    session_id = sessions[int(session_codes[i])]
+                    message, response = texts[i]
+                    stored = encode_vectors(embeddings[i], self.dtype)
+                    self._sessions.setdefault(session_id, deque()).append((float(timestamps[i]), message, response, stored))
+                    self._order.append((float(timestamps[i]), session_id))
+                self._evict(time.time())
+                count = len(self._order)
+            log_success(f"✅ Loaded conversation memory: {count} turns in {len(self._sessions)} sessions")
+        except Exception as e:
+            log_error(f"Error loading conversation memory: {str(e)}")
+
+    def persist(self):
+        """Write a snapshot of all turns if anything changed since the last one"""
+        with self._lock:
+            if not self._dirty:
+                return
+            sessions = list(self._sessions)
+            codes = {session_id: code for code, session_id in enumerate(sessions)}
+            turns = [(session_id, turn) for session_id in sessions for turn in self._sessions[session_id]]
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            header = {'model': self.model_name, 'sessions': sessions}
+            texts = [[turn[1], turn[2]] for _, turn in turns]
+            if turns:
+                embeddings = np.stack([turn[3] for _, turn in turns])
+            else:
+                embeddings = np.zeros((0, 0), dtype=self.dtype)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    header=np.frombuffer(json.dumps(header).encode('utf-8'), dtype='uint8'),
+                    texts=np.frombuffer(json.dumps(texts).encode('utf-8'), dtype='uint8'),
+                    embeddings=embeddings,
+                    timestamps=np.array([turn[0] for _, turn in turns], dtype='float64'),
+                    session_codes=np.array([codes[session_id] for session_id, _ in turns], dtype='int32')
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            with self._lock:
+                self._dirty = True  # Retry on the next interval
+            log_error(f"Error persisting conversation memory: {str(e)}")
+
+    def start(self):
+        """Start the periodic persistence loop (once)"""
+        if self.persist_interval_seconds <= 0 or self._persist_task is not None:
+            return
+
+        async def run():
+            while True:
+                await asyncio.sleep(self.persist_interval_seconds)
+                await asyncio.to_thread(self.persist)
+
+        self._persist_task = asyncio.create_task(run())
+
+    async def close(self):
+        """Stop the persistence loop and write a final snapshot"""
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            try:
+                await self._persist_task
+            except asyncio.CancelledError:
+                pass
+            self._persist_task = None
+        await asyncio.to_thread(self.persist)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'turns': len(self._order),
+                'max_turns': self.max_turns,
+                'max_age_seconds': self.max_age_seconds,
+                'evictions': self.evictions
+            }
+
+
+# Global conversation memory instance
+conversation_memory = ConversationMemory(
+    settings.conversation_memory_path,
+    settings.embedding_model,
+    max_turns=settings.conversation_memory_max_turns,
+    max_age_seconds=settings.conversation_memory_max_age_seconds,
+    persist_interval_seconds=settings.conversation_memory_persist_interval_seconds,
+    dtype=settings.embedding_storage_dtype
+)
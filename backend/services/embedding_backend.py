@@ -0,0 +1,229 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from utils.logger import log_info, log_success, log_error
+
+
+# Embedding model runtimes: PyTorch (sentence-transformers) or an exported ONNX graph,
+# optionally with int8 dynamically quantized weights
+EMBEDDING_BACKENDS = ['torch', 'onnx', 'onnx-int8']
+
+# Sentences used by the parity check and the benchmark when no corpus is given
+SAMPLE_TEXTS = [
+    "Isabella is a friendly assistant who remembers past conversations.",
+    "RAG stands for Retrieval-Augmented Generation.",
+    "Error code E1042: connection to the vector store timed out.",
+    "The FAISS index is rebuilt from stored embeddings when its codec changes.",
+    "Upload PDF, DOCX, TXT or Markdown files to add them to the knowledge base.",
+    "def search(query: str, k: int = 3) -> List[dict]:",
+    "Letta keeps long-term memory for every session.",
+    "How do I reset the chat history?",
+]
+
+
+class TorchEmbeddingBackend:
+    """sentence-transformers model running under PyTorch (the reference backend)"""
+
+    name = 'torch'
+
+    def __init__(self, model_name: str, num_threads: int = 0):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    @property
+    def cache_key(self) -> str:
+        """Identity used to key cached embeddings"""
+        return self.model_name
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype='float32')
+
+
+class OnnxEmbeddingBackend:
+    """The same model exported to ONNX and run with ONNX Runtime on the CPU
+
+    The transformer is exported once (and int8-quantized when `quantized`)
+    into `export_dir`; pooling and normalization follow the sentence-
+    transformers pipeline in numpy, so the runtime needs no PyTorch.
+    """
+
+    def __init__(self, model_name: str, export_dir: str, quantized: bool = False, num_threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.name = 'onnx-int8' if quantized else 'onnx'
+        model_dir = Path(export_dir) / model_name.replace('/', '__')
+        model_path = export_onnx_model(model_name, model_dir, quantized)
+        with open(model_dir / 'pipeline.json', 'r') as f:
+            pipeline = json.load(f)
+        self.max_seq_length = pipeline['max_seq_length']
+        self.normalize = pipeline['normalize']
+        self.dim = pipeline['dim']
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+
+        options = ort.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.model_name}#{self.name}"
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype='float32')
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                texts[start:start + batch_size], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors='np'
+            )
+            feeds = {name: tokens[name].astype('int64') for name in tokens if name in self._input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            # Mean pooling over real (non-padding) tokens
+            mask = tokens['attention_mask'][..., None].astype('float32')
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype('float32'))
+        return np.vstack(batches)
+
+
+def export_onnx_model(model_name: str, model_dir: Path, quantized: bool = False) -> Path:
+    """Export the model's transformer to ONNX (and an int8 copy) unless already exported
+
+    Returns the path of the graph to load.
+    """
+    fp32_path = model_dir / 'model.onnx'
+    int8_path = model_dir / 'model.int8.onnx'
+    if not fp32_path.exists():
+        import torch
+        from sentence_transformers import SentenceTransformer
+        log_info(f"📦 Exporting {model_name} to ONNX ({model_dir})...")
+        model_dir.mkdir(parents=True, exist_ok=True)
+        st_model = SentenceTransformer(model_name, device='cpu')
+        transformer = st_model[0].auto_model.eval()
+        st_model.tokenizer.save_pretrained(str(model_dir))
+        with open(model_dir / 'pipeline.json', 'w') as f:
+            json.dump({
+                'max_seq_length': st_model.max_seq_length,
+                'normalize': any(type(module).__name__ == 'Normalize' for module in st_model),
+                'dim': st_model.get_sentence_embedding_dimension()
+            }, f)
+
+        dummy = st_model.tokenizer(["export"], return_tensors='pt')
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['token_embeddings'] = {0: 'batch', 1: 'sequence'}
+        tmp_path = model_dir / 'model.onnx.tmp'
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer, tuple(dummy[name] for name in input_names), str(tmp_path),
+                input_names=input_names, output_names=['token_embeddings'],
+                dynamic_axes=dynamic_axes, opset_version=14
+            )
+        os.replace(tmp_path, fp32_path)
+
+    if quantized and not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        log_info("🗜️  Quantizing ONNX model weights to int8...")
+        tmp_path = model_dir / 'model.int8.onnx.tmp'
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path if quantized else fp32_path
+
+
+def create_embedding_backend(
+    name: str,
+    model_name: str,
+    export_dir: str,
+    num_threads: int = 0,
+    parity_min_cosine: Optional[float] = None
+):
+    """Load the configured embedding backend, falling back to PyTorch if it cannot be loaded
+
+    With `parity_min_cosine`, an ONNX backend is first compared against the
+    PyTorch model and rejected if any sample embedding drifts below it.
+    """
+    name = (name or 'torch').lower()
+    if name not in EMBEDDING_BACKENDS:
+        log_info(f"⚠️  Unknown embedding backend '{name}', using torch")
+        name = 'torch'
+    if name != 'torch':
+        try:
+            backend = OnnxEmbeddingBackend(model_name, export_dir, quantized=(name == 'onnx-int8'), num_threads=num_threads)
+            if parity_min_cosine is not None:
+                reference = TorchEmbeddingBackend(model_name, num_threads=num_threads)
+                parity = parity_check(reference, backend)
+                if parity['min_cosine'] < parity_min_cosine:
+                    log_error(f"{name} embeddings diverge from torch (min cosine {parity['min_cosine']:.4f}), using torch")
+                    return reference
+                log_info(f"🔬 {name} parity with torch: min cosine {parity['min_cosine']:.4f}")
+            log_success(f"✅ Embedding backend: {backend.name} ({model_name}, dim {backend.dim})")
+            return backend
+        except Exception as e:
+            log_error(f"Error loading {name} embedding backend, using torch: {str(e)}")
+    backend = TorchEmbeddingBackend(model_name, num_threads=num_threads)
+    log_success(f"✅ Embedding backend: torch ({model_name}, dim {backend.dim})")
+    return backend
+
+
+def parity_check(reference, candidate, texts: Optional[List[str]] = None) -> dict:
+    """Cosine similarity between a backend's embeddings and the reference (PyTorch) ones"""
+    texts = texts or SAMPLE_TEXTS
+    expected = reference.encode(texts)
+    actual = candidate.encode(texts)
+    expected = expected / np.clip(np.linalg.norm(expected, axis=1, keepdims=True), 1e-12, None)
+    actual = actual / np.clip(np.linalg.norm(actual, axis=1, keepdims=True), 1e-12, None)
+    cosines = (expected * actual).sum(axis=1)
+    return {
+        'backend': candidate.name,
+        'texts': len(texts),
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean())
+    }
+
+
+def benchmark(backend, texts: Optional[List[str]] = None, batch_size: int = 32, repeat: int = 256) -> dict:
+    """Encoding throughput of a backend (after one warm-up batch)"""
+    texts = texts or SAMPLE_TEXTS * (repeat // len(SAMPLE_TEXTS) or 1)
+    backend.encode(texts[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    backend.encode(texts, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    return {
+        'backend': backend.name,
+        'texts': len(texts),
+        'batch_size': batch_size,
+        'seconds': round(seconds, 3),
+        'texts_per_second': round(len(texts) / seconds, 1) if seconds > 0 else None
+    }
+
+
+if __name__ == "__main__":
+    # python -m services.embedding_backend [backend ...]  (run from backend/) compares
+    # every backend against PyTorch and prints their throughput
+    import sys
+    from config import settings
+    names = sys.argv[1:] or EMBEDDING_BACKENDS
+    reference = TorchEmbeddingBackend(settings.embedding_model, num_threads=settings.embedding_threads)
+    for backend_name in names:
+        if backend_name == 'torch':
+            backend = reference
+        else:
+            backend = create_embedding_backend(backend_name, settings.embedding_model, settings.onnx_export_dir, settings.embedding_threads)
+        if backend.name != 'torch':
+            log_info(f"🔬 Parity: {parity_check(reference, backend)}")
+        log_info(f"⏱️  Benchmark: {benchmark(backend, batch_size=settings.embedding_batch_size)}")
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+import numpy as np
+from utils.logger import log_error
+
+
+class EmbeddingBatcher:
+    """Micro-batching scheduler for query embeddings
+
+    Callers await `embed(text)`. A single collector task gathers requests that
+    arrive within `max_wait_ms` of the first one (up to `max_batch_size`),
+    encodes them in one call on a worker thread and resolves each caller's
+    future, so the event loop never runs the model itself.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embed")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop = None
+
+        # Batching statistics
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch = 0
+        self.total_encode_seconds = 0.0
+        self.total_queue_seconds = 0.0
+
+    def _ensure_started(self):
+        """Start the collector task on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed one text, batched with concurrent callers"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self) -> list:
+        """Wait for the first request, then gather more until the window closes"""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        """Collector loop: batch, encode off-loop, resolve futures"""
+        while True:
+            batch = await self._collect_batch()
+            # Callers that gave up (e.g. client disconnected) are skipped
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                vectors = await self._loop.run_in_executor(
+                    self._executor, self.encode_fn, [text for text, _, _ in batch]
+                )
+                for (_, future, _), vector in zip(batch, vectors):
+                    if not future.done():
+                        future.set_result(vector)
+            except Exception as e:
+                log_error(f"Error encoding query batch: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            finished = time.perf_counter()
+            self.batches += 1
+            self.items += len(batch)
+            self.max_observed_batch = max(self.max_observed_batch, len(batch))
+            self.total_encode_seconds += finished - started
+            self.total_queue_seconds += sum(started - enqueued for _, _, enqueued in batch)
+
+    async def close(self):
+        """Stop the collector task and the worker thread"""
+        if self._worker and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> dict:
+        """Batching statistics"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': self.batches,
+            'queries': self.items,
+            'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+            'max_observed_batch': self.max_observed_batch,
+            'avg_encode_ms': 1000.0 * self.total_encode_seconds / self.batches if self.batches else 0.0,
+            'avg_queue_wait_ms': 1000.0 * self.total_queue_seconds / self.items if self.items else 0.0,
+            'pending': self._queue.qsize() if self._queue else 0
+        }
@@ -0,0 +1,123 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from utils.logger import log_info, log_error
+
+
+class EmbeddingCache:
+    """Persistent chunk-text digest -> embedding cache with LRU eviction
+
+    Entries live in a small SQLite database so they survive restarts and full
+    rebuilds. Keys are SHA-256 digests of the model name and the chunk text, so
+    renamed or duplicated files hit the cache too. When the number of entries
+    exceeds `max_entries` the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, model_name: str, embedding_dim: int, max_entries: int = 500000):
+        self.path = path
+        self.model_name = model_name
+        self.embedding_dim = embedding_dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "digest BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+            self._conn.commit()
+        return self._conn
+
+    def digest(self, text: str) -> bytes:
+        """Content address of a chunk for the current model"""
+        hasher = hashlib.sha256()
+        hasher.update(self.model_name.encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(text.encode('utf-8'))
+        return hasher.digest()
+
+    def get_many(self, digests: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up cached vectors, refreshing their LRU timestamp"""
+        found = {}
+        if not digests:
+            return found
+        try:
+            with self._lock:
+                conn = self._connect()
+                unique = list(dict.fromkeys(digests))
+                # Stay below SQLite's bound-parameter limit
+                for start in range(0, len(unique), 900):
+                    batch = unique[start:start + 900]
+                    placeholders = ','.join('?' * len(batch))
+                    rows = conn.execute(
+                        f"SELECT digest, vector FROM embeddings WHERE digest IN ({placeholders})", batch
+                    ).fetchall()
+                    for digest, vector in rows:
+                        found[bytes(digest)] = np.frombuffer(vector, dtype='float32')
+                if found:
+                    now = time.time()
+                    conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE digest = ?",
+                        [(now, digest) for digest in found]
+                    )
+                    conn.commit()
+                self.hits += sum(1 for digest in digests if digest in found)
+                self.misses += sum(1 for digest in digests if digest not in found)
+        except sqlite3.Error as e:
+            log_error(f"Embedding cache lookup failed: {str(e)}")
+        return found
+
+    def put_many(self, digests: List[bytes], vectors: np.ndarray):
+        """Store vectors and evict least recently used entries past the size cap"""
+        if not digests:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                now = time.time()
+                vectors = np.ascontiguousarray(vectors, dtype='float32')
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (digest, vector, last_used) VALUES (?, ?, ?)",
+                    [(digest, vectors[i].tobytes(), now) for i, digest in enumerate(digests)]
+                )
+                count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if count > self.max_entries:
+                    excess = count - self.max_entries
+                    conn.execute(
+                        "DELETE FROM embeddings WHERE digest IN "
+                        "(SELECT digest FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (excess,)
+                    )
+                    log_info(f"🧹 Evicted {excess} least recently used cached embeddings")
+                conn.commit()
+        except sqlite3.Error as e:
+            log_error(f"Embedding cache write failed: {str(e)}")
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters and current size"""
+        entries = 0
+        try:
+            with self._lock:
+                entries = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        except sqlite3.Error:
+            pass
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,232 @@
+import math
+from typing import Optional, Tuple
+import numpy as np
+import faiss
+from config import settings
+from utils.logger import log_info
+
+
+# Supported FAISS index backends
+INDEX_TYPES = ['flat', 'ivf', 'hnsw', 'ivfpq']
+
+# How vectors are stored inside the index: full float32, float16, 8-bit scalar
+# quantization or product quantization (ivfpq always uses PQ)
+VECTOR_CODECS = ['fp32', 'fp16', 'sq8', 'pq']
+
+# FAISS needs roughly this many training points per centroid for k-means
+MIN_POINTS_PER_CENTROID = 39
+
+# Backends whose vectors can be deleted in place with `remove_ids`.
+# HNSW graphs cannot drop nodes, so deleted chunks are only tombstoned there
+# until compaction rebuilds the graph.
+REMOVABLE_INDEX_TYPES = {'flat', 'ivf', 'ivfpq'}
+
+
+def choose_index_type(num_vectors: int) -> str:
+    """Pick an index backend for the given corpus size
+
+    Uses `settings.faiss_index_type` when it is pinned, otherwise follows the
+    size policy: exact search for small corpora, HNSW for medium ones, IVF for
+    large ones and IVF-PQ once memory for full vectors becomes the bottleneck.
+    """
+    configured = (settings.faiss_index_type or 'auto').lower()
+    if configured != 'auto':
+        return configured
+
+    if num_vectors < settings.faiss_flat_max_chunks:
+        return 'flat'
+    if num_vectors < settings.faiss_hnsw_max_chunks:
+        return 'hnsw'
+    if num_vectors < settings.faiss_ivfpq_min_chunks:
+        return 'ivf'
+    return 'ivfpq'
+
+
+def _ivf_nlist(num_vectors: int) -> int:
+    """Number of IVF lists for a corpus (~4 * sqrt(N), capped by training data)"""
+    nlist = int(4 * math.sqrt(max(num_vectors, 1)))
+    max_nlist = max(1, num_vectors // MIN_POINTS_PER_CENTROID)
+    return max(1, min(nlist, max_nlist, 65536))
+
+
+def _training_sample(vectors: np.ndarray, max_points: int) -> np.ndarray:
+    """Random subset of vectors used for training IVF/PQ quantizers"""
+    if vectors.shape[0] <= max_points:
+        return vectors
+    rng = np.random.default_rng(1234)
+    rows = rng.choice(vectors.shape[0], size=max_points, replace=False)
+    return vectors[np.sort(rows)]
+
+
+def vector_codec() -> str:
+    """Configured index vector codec (unknown values fall back to fp32)"""
+    codec = (settings.faiss_vector_codec or 'fp32').lower()
+    return codec if codec in VECTOR_CODECS else 'fp32'
+
+
+def _pq_trainable(dim: int, num_vectors: int) -> bool:
+    """True if PQ with the configured m / nbits can be trained on num_vectors"""
+    return dim % settings.faiss_pq_m == 0 and num_vectors >= (1 << settings.faiss_pq_nbits) * MIN_POINTS_PER_CENTROID
+
+
+def _codec_fallback(codec: str, dim: int, num_vectors: int) -> str:
+    """Codec that can actually be trained on num_vectors"""
+    if codec == 'pq' and not _pq_trainable(dim, num_vectors):
+        log_info(f"⚠️  Not enough data or invalid PQ settings for PQ codes ({num_vectors} vectors), using SQ8")
+        codec = 'sq8'
+    if codec == 'sq8' and num_vectors == 0:
+        codec = 'fp16'  # SQ8 needs value ranges from training data; fp16 needs none
+    return codec
+
+
+def _scalar_quantizer_type(codec: str) -> int:
+    return faiss.ScalarQuantizer.QT_fp16 if codec == 'fp16' else faiss.ScalarQuantizer.QT_8bit
+
+
+def _train(index: faiss.Index, train_vectors: np.ndarray, max_points: int, label: str):
+    """Train an index on a sample of the corpus if it needs training"""
+    if index.is_trained:
+        return
+    sample = _training_sample(train_vectors, max_points)
+    log_info(f"🏋️  Training {label} on {sample.shape[0]} vectors...")
+    index.train(np.ascontiguousarray(sample, dtype='float32'))
+
+
+def build_index(
+    index_type: str,
+    dim: int,
+    train_vectors: Optional[np.ndarray] = None,
+    codec: Optional[str] = None
+) -> Tuple[faiss.Index, str, str]:
+    """Create (and train if needed) a FAISS index
+
+    Args:
+        index_type: One of INDEX_TYPES
+        dim: Embedding dimension
+        train_vectors: Vectors used for training IVF/PQ quantizers. Usually the
+            full corpus that will be added right after.
+        codec: One of VECTOR_CODECS (default: `settings.faiss_vector_codec`)
+
+    Returns:
+        (index, actual_type, actual_codec). Every index accepts `add_with_ids`
+        with the persistent 64-bit chunk IDs (flat and HNSW are wrapped in an
+        IndexIDMap2, IVF variants map IDs natively). Falls back to a flat index
+        when there is not enough data to train the requested type, and to a
+        cheaper-to-train codec when PQ / SQ8 cannot be trained.
+    """
+    if index_type not in INDEX_TYPES:
+        log_info(f"⚠️  Unknown FAISS index type '{index_type}', using flat")
+        index_type = 'flat'
+
+    num_vectors = 0 if train_vectors is None else train_vectors.shape[0]
+    codec = _codec_fallback(codec or vector_codec(), dim, num_vectors)
+
+    if index_type == 'flat':
+        return _build_flat(dim, codec, train_vectors)
+
+    if index_type == 'hnsw':
+        if codec == 'pq':
+            hnsw_index = faiss.IndexHNSWPQ(dim, settings.faiss_pq_m, settings.faiss_hnsw_m)
+        elif codec in ('fp16', 'sq8'):
+            hnsw_index = faiss.IndexHNSWSQ(dim, _scalar_quantizer_type(codec), settings.faiss_hnsw_m)
+        else:
+            hnsw_index = faiss.IndexHNSWFlat(dim, settings.faiss_hnsw_m)
+        hnsw_index.hnsw.efConstruction = settings.faiss_hnsw_ef_construction
+        _train(hnsw_index, train_vectors, 65536, f"HNSW {codec.upper()} codes")
+        index = faiss.IndexIDMap2(hnsw_index)
+        configure_search(index, 'hnsw')
+        return index, 'hnsw', codec
+
+    # IVF based indexes need training data
+    nlist = _ivf_nlist(num_vectors)
+    if index_type == 'ivfpq':
+        pq_m = settings.faiss_pq_m
+        min_train = max(nlist * MIN_POINTS_PER_CENTROID, (1 << settings.faiss_pq_nbits) * MIN_POINTS_PER_CENTROID)
+        if dim % pq_m != 0 or num_vectors < min_train:
+            log_info(f"⚠️  Not enough data or invalid PQ settings for IVF-PQ ({num_vectors} vectors), using IVF")
+            index_type = 'ivf'
+
+    if num_vectors < nlist * MIN_POINTS_PER_CENTROID or nlist < 2:
+        log_info(f"⚠️  Not enough data to train {index_type.upper()} ({num_vectors} vectors), using flat")
+        return _build_flat(dim, codec, train_vectors)
+
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == 'ivfpq' or codec == 'pq':
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, settings.faiss_pq_m, settings.faiss_pq_nbits)
+        index_type, codec = 'ivfpq', 'pq'
+    elif codec in ('fp16', 'sq8'):
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, _scalar_quantizer_type(codec))
+    else:
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+
+    _train(index, train_vectors, nlist * 256, f"{index_type.upper()} index (nlist={nlist}, {codec.upper()} codes)")
+    configure_search(index, index_type)
+    return index, index_type, codec
+
+
+def _build_flat(dim: int, codec: str, train_vectors: Optional[np.ndarray]) -> Tuple[faiss.Index, str, str]:
+    """Exhaustive index storing full, scalar-quantized or PQ-coded vectors"""
+    if codec == 'pq':
+        inner = faiss.IndexPQ(dim, settings.faiss_pq_m, settings.faiss_pq_nbits)
+    elif codec in ('fp16', 'sq8'):
+        inner = faiss.IndexScalarQuantizer(dim, _scalar_quantizer_type(codec))
+    else:
+        inner = faiss.IndexFlatL2(dim)
+    _train(inner, train_vectors, 65536, f"flat {codec.upper()} codes")
+    return faiss.IndexIDMap2(inner), 'flat', codec
+
+
+def bytes_per_vector(index_type: str, codec: str, dim: int) -> int:
+    """Approximate index memory per vector: codes, 64-bit ID and HNSW links"""
+    if codec == 'pq':
+        code_size = (settings.faiss_pq_m * settings.faiss_pq_nbits + 7) // 8
+    elif codec == 'sq8':
+        code_size = dim
+    elif codec == 'fp16':
+        code_size = 2 * dim
+    else:
+        code_size = 4 * dim
+    overhead = 8  # chunk ID (IVF list entry or IndexIDMap2 id_map)
+    if index_type in ('flat', 'hnsw'):
+        overhead += 16  # IndexIDMap2 reverse map entry
+    if index_type == 'hnsw':
+        overhead += 2 * settings.faiss_hnsw_m * 4  # level-0 neighbor links
+    return code_size + overhead
+
+
+def configure_search(index: faiss.Index, index_type: str):
+    """Apply query-time parameters (nprobe / efSearch) from settings"""
+    if index is None:
+        return
+    if index_type in ('ivf', 'ivfpq'):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(settings.faiss_nprobe, ivf.nlist)
+    elif index_type == 'hnsw':
+        hnsw_index = faiss.downcast_index(index)
+        if hasattr(hnsw_index, 'id_map'):
+            hnsw_index = faiss.downcast_index(hnsw_index.index)
+        hnsw_index.hnsw.efSearch = settings.faiss_hnsw_ef_search
+
+
+def search_parameters(index_type: str, bitmap: np.ndarray) -> faiss.SearchParameters:
+    """Search parameters that restrict a search to the chunk IDs set in `bitmap`
+
+    The selector is tested on chunk IDs inside the search (IndexIDMap2
+    translates its internal positions), so filtered queries visit the same
+    lists / graph nodes as unfiltered ones and still return k hits. nprobe /
+    efSearch are repeated here because explicit parameters override the
+    ones set on the index.
+
+    Build new parameters for every search: IndexIDMap2 swaps its own
+    selector into them while searching, so they must not be shared between
+    concurrent searches.
+    """
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))  # Size in bytes
+    if index_type in ('ivf', 'ivfpq'):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=settings.faiss_nprobe)
+    elif index_type == 'hnsw':
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=settings.faiss_hnsw_ef_search)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.referenced_objects = [selector, bitmap]  # Keep the bitmap alive as long as the parameters
+    return params
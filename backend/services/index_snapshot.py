@@ -0,0 +1,64 @@
+from typing import Dict, FrozenSet, Optional
+import numpy as np
+
+
+class IndexSnapshot:
+    """Immutable view of the RAG index published to readers
+
+    Writers build their changes on private working state and publish a new
+    snapshot with a single attribute assignment. Readers grab
+    `rag_service.snapshot` once per query and use only that object, so a
+    query always sees one consistent index, document and metadata set and
+    never waits for ingestion. Nothing a snapshot can read is mutated
+    afterwards: the FAISS index, BM25 segments and memory-mapped columns are
+    shared with later snapshots and copied only when they must change.
+    `id_to_pos` is shared with the writer, which only adds IDs newer than any
+    this snapshot can return and replaces the dict when rows move.
+    """
+
+    __slots__ = (
+        'generation', 'index', 'delta_index', 'index_tombstones', 'index_type', 'vector_codec', 'documents',
+        'metadata', 'embeddings', 'lexical', 'id_to_pos', 'deleted_ids', 'live_chunks', 'live_files'
+    )
+
+    def __init__(
+        self,
+        generation: int,
+        index,
+        index_type: str,
+        documents,
+        metadata,
+        embeddings: Optional[np.ndarray],
+        vector_codec: str,
+        lexical,
+        id_to_pos: Dict[int, int],
+        deleted_ids: FrozenSet[int],
+        live_files: int,
+        delta_index=None,
+        index_tombstones: int = 0
+    ):
+        self.generation = generation
+        self.index = index
+        self.delta_index = delta_index  # Exact index of chunks added since `index` was built, or None
+        self.index_tombstones = index_tombstones  # Deleted chunks still in `index` (over-fetched past)
+        self.index_type = index_type
+        self.documents = documents
+        self.metadata = metadata
+        self.embeddings = embeddings
+        self.vector_codec = vector_codec
+        self.lexical = lexical  # Read-only BM25Index view, or None when BM25 is disabled
+        self.id_to_pos = id_to_pos
+        self.deleted_ids = deleted_ids
+        self.live_chunks = len(metadata) - len(deleted_ids)
+        self.live_files = live_files
+
+    @property
+    def index_size(self) -> int:
+        """Vectors in the main and delta indexes"""
+        if self.index is None:
+            return 0
+        return self.index.ntotal + (self.delta_index.ntotal if self.delta_index is not None else 0)
+
+    @property
+    def is_empty(self) -> bool:
+        return self.index_size == 0 or self.live_chunks <= 0
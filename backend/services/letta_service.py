@@ -7,7 +7,10 @@ except ImportError:
 
 from config import settings
 from utils.logger import log_info, log_error, log_letta_processing
-from typing import Optional
+from services.provider_scheduler import estimate_tokens, provider_scheduler
+from typing import AsyncIterator, Optional
+import asyncio
+import json
 
 # Model handles in the format "provider_name/model_name".
 # These reference BYOK providers registered in Letta via _ensure_providers().
@@ -49,9 +52,19 @@ _BYOK_PROVIDERS = [
 ]
 
 
+def _message_text(content) -> str:
+    """Text of a streamed assistant message (a string or a list of content parts)"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
 class LettaService:
     def __init__(self):
         self.client = None
+        self.http_client = None  # Pooled async client for the streaming REST API
         self.agent_ids = {}
         self.agent_name = "Isabella"
         self.persona = """You are Isabella ("bella"), an advanced AI companion and personal assistant created for one user only.
@@ -278,24 +291,40 @@ Personality & Traits: Strong sense of responsibility as eldest sibling. Motivati
             log_error(f"Error getting/creating Letta agent for model '{model}': {str(e)}")
             return None
 
-    async def process_message(self, user_message, model: str = "longcat"):
-        """Process user message through the Letta agent for the selected model."""
+    @staticmethod
+    def _token_estimate(message: str) -> int:
+        """Tokens reserved against the provider's TPM budget for one agent step"""
+        return estimate_tokens(message) + settings.provider_completion_token_estimate
+
+    async def process_message(self, user_message, model: str = "longcat", provider: str = "letta", session_id: str = ""):
+        """Process user message through the Letta agent for the selected model.
+
+        The agent call waits for a slot within *provider*'s budgets (the
+        provider the agent's model runs on), queued fairly per *session_id*.
+        """
         try:
             if not self.client:
                 log_info("Letta not available, returning original message")
                 return None
 
-            agent_id = self._get_or_create_agent(model=model)
+            # The Letta SDK is synchronous; run it in a worker thread so a
+            # slow agent call does not block the event loop
+            agent_id = await asyncio.to_thread(self._get_or_create_agent, model=model)
             if not agent_id:
                 log_info("Could not get agent, returning original message")
                 return None
 
             log_info(f"Processing message through Letta agent (model: {model}, with memory)")
 
-            response = self.client.agents.messages.create(
-                agent_id=agent_id,
-                messages=[{"role": "user", "content":  user_message}]
-            )
+            async with provider_scheduler.slot(provider, self._token_estimate(user_message), key=session_id) as slot:
+                response = await asyncio.to_thread(
+                    self.client.agents.messages.create,
+                    agent_id=agent_id,
+                    messages=[{"role": "user", "content":  user_message}]
+                )
+                usage = getattr(response, 'usage', None)
+                if usage is not None and getattr(usage, 'total_tokens', None):
+                    slot.used_tokens = usage.total_tokens
 
             assistant_response = None
             if hasattr(response, 'messages') and response.messages:
@@ -324,12 +353,9 @@ Personality & Traits: Strong sense of responsibility as eldest sibling. Motivati
             log_error(f"Error processing message with Letta: {str(e)}")
             return None
 
-    async def process_with_memory(self, user_message, rag_context=None, user_id="default_user", model: str = "longcat"):
-        """Process with RAG context included.
-
-        Uses the Letta agent for the selected model so that the chosen
-        provider handles both memory management and response generation.
-        """
+    @staticmethod
+    def _with_rag_context(user_message, rag_context=None):
+        """Append the retrieved knowledge base chunks to the user message"""
         full_message = user_message
         if rag_context and len(rag_context) > 0:
             context_text = "\n\n---\nRelevant information from knowledge base:\n"
@@ -337,8 +363,72 @@ Personality & Traits: Strong sense of responsibility as eldest sibling. Motivati
                 context_text += f"\n[Source {i}]:  {ctx}\n"
             context_text += "---\n\nUse this information to help answer the user's question."
             full_message = f"{user_message}{context_text}"
+        return full_message
 
-        return await self.process_message(full_message, model=model)
+    async def process_with_memory(self, user_message, rag_context=None, user_id="default_user", model: str = "longcat", provider: str = "letta", session_id: str = ""):
+        """Process with RAG context included.
+
+        Uses the Letta agent for the selected model so that the chosen
+        provider handles both memory management and response generation.
+        """
+        return await self.process_message(
+            self._with_rag_context(user_message, rag_context), model=model, provider=provider, session_id=session_id
+        )
+
+    async def stream_with_memory(self, user_message, rag_context=None, model: str = "longcat", provider: str = "letta", session_id: str = "") -> AsyncIterator[str]:
+        """Stream the agent's reply token by token (Letta's streaming messages API).
+
+        Talks to the REST endpoint over a pooled async HTTP client, so
+        closing the generator closes the upstream response. Yields nothing
+        if Letta is unavailable; HTTP errors are raised to the caller.
+        """
+        if not self.client:
+            return
+
+        agent_id = await asyncio.to_thread(self._get_or_create_agent, model=model)
+        if not agent_id:
+            return
+
+        if self.http_client is None:
+            from services.provider_clients import create_http_client
+            self.http_client = create_http_client()
+
+        base_url = (settings.letta_base_url or "http://localhost:8283").rstrip("/")
+        headers = {"Accept": "text/event-stream"}
+        if getattr(settings, 'letta_api_key', None):
+            headers["Authorization"] = f"Bearer {settings.letta_api_key}"
+        full_message = self._with_rag_context(user_message, rag_context)
+        body = {
+            "messages": [{"role": "user", "content": full_message}],
+            "stream_tokens": True,
+        }
+
+        async with provider_scheduler.slot(provider, self._token_estimate(full_message), key=session_id):
+            log_info(f"Streaming message through Letta agent (model: {model}, with memory)")
+            async with self.http_client.stream(
+                "POST", f"{base_url}/v1/agents/{agent_id}/messages/stream", json=body, headers=headers
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        event = json.loads(data)
+                    except ValueError:
+                        continue
+                    if isinstance(event, dict) and event.get("message_type") == "assistant_message":
+                        text = _message_text(event.get("content"))
+                        if text:
+                            yield text
+
+    async def close(self):
+        """Close the streaming HTTP client (on shutdown)"""
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
 
     def reset_agent(self):
         """Reset agent memory. Removes all cached Letta agents."""
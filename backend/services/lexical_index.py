@@ -0,0 +1,365 @@
+import bisect
+import json
+import math
+import re
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from services.chunk_store import TextColumn, open_text_column
+
+
+# Words plus identifiers joined by . - : / (e.g. ERR_CONN_RESET, v2.3.1, foo.bar)
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-:/]\w+)*")
+COMPOUND_SEPARATORS = re.compile(r"[.\-:/]")
+
+# Directory of the BM25 files inside a chunk store generation
+LEXICAL_DIR = 'bm25'
+
+MAX_TF = np.iinfo(np.uint16).max
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens; compound identifiers are kept whole and also split into parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if COMPOUND_SEPARATORS.search(token):
+            tokens.extend(part for part in COMPOUND_SEPARATORS.split(token) if part)
+    return tokens
+
+
+class PostingsBlock:
+    """Immutable BM25 postings for a set of chunks
+
+    `terms` is the sorted term dictionary (a list, or a memory-mapped
+    TextColumn when loaded from disk) and `term_offsets[i]:term_offsets[i+1]`
+    is the postings range of term i. Postings hold chunk IDs sorted within
+    each term (delta-coded uint32 on disk) and term frequencies (uint16).
+    Document lengths are kept per chunk ID for length normalization.
+    """
+
+    def __init__(
+        self,
+        terms: Sequence[str],
+        term_offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        chunk_ids: np.ndarray,
+        chunk_lengths: np.ndarray,
+        delta_coded: bool = False
+    ):
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.chunk_ids = chunk_ids
+        self.chunk_lengths = chunk_lengths
+        self.delta_coded = delta_coded
+
+    @classmethod
+    def empty(cls) -> 'PostingsBlock':
+        return cls([], np.zeros(1, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros(0, dtype='uint16'),
+                   np.zeros(0, dtype='int64'), np.zeros(0, dtype='uint32'))
+
+    @classmethod
+    def from_postings(
+        cls,
+        terms: List[str],
+        term_idx: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        chunk_ids: np.ndarray,
+        chunk_lengths: np.ndarray
+    ) -> 'PostingsBlock':
+        """Build a block from unsorted postings (term_idx indexes `terms`, which may be unsorted)"""
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        rank = np.empty(len(terms), dtype='int64')
+        rank[order] = np.arange(len(terms))
+        sorted_terms = [terms[i] for i in order]
+
+        term_rank = rank[term_idx] if len(term_idx) else np.zeros(0, dtype='int64')
+        posting_order = np.lexsort((doc_ids, term_rank))
+        term_rank = term_rank[posting_order]
+        counts = np.bincount(term_rank, minlength=len(sorted_terms))
+        term_offsets = np.concatenate([[0], np.cumsum(counts)]).astype('int64')
+
+        chunk_order = np.argsort(chunk_ids, kind='stable')
+        return cls(
+            sorted_terms,
+            term_offsets,
+            np.asarray(doc_ids, dtype='int64')[posting_order],
+            np.asarray(tfs, dtype='uint16')[posting_order],
+            np.asarray(chunk_ids, dtype='int64')[chunk_order],
+            np.asarray(chunk_lengths, dtype='uint32')[chunk_order]
+        )
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def total_length(self) -> int:
+        return int(np.asarray(self.chunk_lengths, dtype='int64').sum())
+
+    def _term_index(self, term: str) -> Optional[int]:
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return None
+
+    def _decode(self, start: int, end: int) -> np.ndarray:
+        docs = np.asarray(self.doc_ids[start:end])
+        return np.cumsum(docs, dtype='int64') if self.delta_coded else docs.astype('int64')
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk IDs, term frequencies) of one term"""
+        i = self._term_index(term)
+        if i is None:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='uint16')
+        start, end = int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+        return self._decode(start, end), np.asarray(self.tfs[start:end])
+
+    def lengths(self, chunk_ids: np.ndarray) -> np.ndarray:
+        """Token counts of chunks in this block"""
+        return np.asarray(self.chunk_lengths)[np.searchsorted(self.chunk_ids, chunk_ids)]
+
+    def all_postings(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """(terms, term index per posting, chunk IDs, tfs) of the whole block"""
+        counts = np.diff(np.asarray(self.term_offsets))
+        term_idx = np.repeat(np.arange(len(counts)), counts)
+        doc_ids = np.asarray(self.doc_ids).astype('int64')
+        if self.delta_coded and len(doc_ids):
+            # Undo per-term delta coding: running sum minus the sum before each term's list
+            running = np.cumsum(doc_ids)
+            starts = np.asarray(self.term_offsets[:-1])[counts > 0]
+            before = running[starts] - doc_ids[starts]
+            doc_ids = running - np.repeat(before, counts[counts > 0])
+        return list(self.terms), term_idx, doc_ids, np.asarray(self.tfs)
+
+    def write(self, directory: Path):
+        """Write the block (term dictionary, delta-coded postings, lengths) to `directory`"""
+        directory.mkdir(parents=True, exist_ok=True)
+        TextColumn.from_list(self.terms).write(directory)
+        doc_ids = np.asarray(self.doc_ids, dtype='int64')
+        delta_coded = not len(doc_ids) or int(doc_ids.max()) < 2 ** 32
+        if delta_coded and len(doc_ids):
+            # Each term's list starts with an absolute ID, followed by gaps
+            offsets = np.asarray(self.term_offsets)
+            starts = offsets[:-1][np.diff(offsets) > 0]
+            deltas = np.diff(doc_ids, prepend=0)
+            deltas[starts] = doc_ids[starts]
+            doc_ids = deltas.astype('uint32')
+        np.save(directory / 'term_offsets.npy', np.asarray(self.term_offsets, dtype='int64'))
+        np.save(directory / 'postings_docs.npy', doc_ids)
+        np.save(directory / 'postings_tfs.npy', np.asarray(self.tfs, dtype='uint16'))
+        np.save(directory / 'chunk_ids.npy', np.asarray(self.chunk_ids, dtype='int64'))
+        np.save(directory / 'chunk_lengths.npy', np.asarray(self.chunk_lengths, dtype='uint32'))
+        with open(directory / 'bm25.json', 'w') as f:
+            json.dump({'delta_coded': delta_coded}, f)
+
+    @classmethod
+    def open(cls, directory: Path) -> 'PostingsBlock':
+        """Memory-map a block written by `write`"""
+        with open(directory / 'bm25.json', 'r') as f:
+            info = json.load(f)
+        return cls(
+            open_text_column(directory),
+            np.load(directory / 'term_offsets.npy', mmap_mode='r'),
+            np.load(directory / 'postings_docs.npy', mmap_mode='r'),
+            np.load(directory / 'postings_tfs.npy', mmap_mode='r'),
+            np.load(directory / 'chunk_ids.npy', mmap_mode='r'),
+            np.load(directory / 'chunk_lengths.npy', mmap_mode='r'),
+            delta_coded=info.get('delta_coded', False)
+        )
+
+
+class BM25Index:
+    """Incremental BM25 inverted index over chunk texts
+
+    The checkpointed postings are a memory-mapped `PostingsBlock`. Chunks
+    added since are accumulated in compact arrays and sealed into immutable
+    in-memory segments when a snapshot is taken; snapshots share the
+    segments instead of copying them. `write` merges everything (dropping
+    tombstoned chunks) into a new on-disk block at checkpoint time. Deleted
+    chunks are filtered at query time until then.
+    """
+
+    def __init__(self, base: Optional[PostingsBlock] = None, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.base = base or PostingsBlock.empty()
+        self.segments: Tuple[PostingsBlock, ...] = ()  # Chunks added since the checkpoint, sealed (oldest first)
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self._vocab: Dict[str, int] = {}
+        self._term_idx = array('I')
+        self._doc_ids = array('q')
+        self._tfs = array('H')
+        self._chunk_ids = array('q')
+        self._chunk_lengths = array('I')
+
+    @classmethod
+    def open(cls, directory: Path, k1: float = 1.2, b: float = 0.75) -> Optional['BM25Index']:
+        """Load the BM25 block of a store generation (None if it has none)"""
+        lexical_dir = Path(directory) / LEXICAL_DIR
+        if not (lexical_dir / 'bm25.json').exists():
+            return None
+        return cls(PostingsBlock.open(lexical_dir), k1=k1, b=b)
+
+    def add(self, chunk_uid: int, text: str):
+        """Index one chunk (called from the chunking pass)"""
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._term_idx.append(self._vocab.setdefault(term, len(self._vocab)))
+            self._tfs.append(min(tf, MAX_TF))
+        self._doc_ids.extend([chunk_uid] * len(counts))
+        self._chunk_ids.append(chunk_uid)
+        self._chunk_lengths.append(sum(counts.values()))
+
+    def _seal(self):
+        """Seal pending chunks into a new segment
+
+        The newest segments are merged while the one before is no larger
+        than the new one, so there are O(log n) segments and a chunk's
+        postings are re-merged O(log n) times in total, not once per snapshot.
+        """
+        if not self._chunk_ids:
+            return
+        block = PostingsBlock.from_postings(
+            list(self._vocab),
+            np.array(self._term_idx, dtype='int64'),
+            np.array(self._doc_ids, dtype='int64'),
+            np.array(self._tfs, dtype='uint16'),
+            np.array(self._chunk_ids, dtype='int64'),
+            np.array(self._chunk_lengths, dtype='uint32')
+        )
+        segments = list(self.segments)
+        while segments and segments[-1].num_chunks <= block.num_chunks:
+            block = PostingsBlock.from_postings(*_concat_blocks([self._block_arrays(segments.pop()), self._block_arrays(block)]))
+        self.segments = tuple(segments) + (block,)
+        self._reset_pending()
+
+    @staticmethod
+    def _block_arrays(block: PostingsBlock):
+        terms, term_idx, doc_ids, tfs = block.all_postings()
+        return terms, term_idx, doc_ids, tfs, np.asarray(block.chunk_ids), np.asarray(block.chunk_lengths)
+
+    def _blocks(self) -> List[PostingsBlock]:
+        return [block for block in (self.base, *self.segments) if block.num_chunks]
+
+    def snapshot(self) -> 'BM25Index':
+        """Read-only copy for an index snapshot (later `add` calls do not affect it)"""
+        self._seal()
+        view = BM25Index(self.base, k1=self.k1, b=self.b)
+        view.segments = self.segments  # Immutable, shared
+        return view
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        deleted_ids: Set[int] = frozenset(),
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """Top-k (chunk ID, BM25 score) for a query, skipping tombstoned chunks
+
+        `allowed_ids` (sorted chunk IDs) restricts the candidates to a metadata filter.
+        """
+        self._seal()
+        blocks = self._blocks()
+        num_chunks = sum(block.num_chunks for block in blocks)
+        if not blocks or num_chunks == 0 or k <= 0:
+            return []
+        avg_length = max(sum(block.total_length for block in blocks) / num_chunks, 1.0)
+
+        ids_parts, score_parts = [], []
+        for term in set(tokenize(query)):
+            postings = [(block, *block.postings(term)) for block in blocks]
+            df = sum(len(ids) for _, ids, _ in postings)
+            if df == 0:
+                continue
+            idf = math.log(1.0 + (num_chunks - df + 0.5) / (df + 0.5))
+            for block, ids, tfs in postings:
+                if not len(ids):
+                    continue
+                tfs = tfs.astype('float32')
+                lengths = block.lengths(ids).astype('float32')
+                norm = self.k1 * (1.0 - self.b + self.b * lengths / avg_length)
+                ids_parts.append(ids)
+                score_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not ids_parts:
+            return []
+
+        unique_ids, inverse = np.unique(np.concatenate(ids_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        if deleted_ids:
+            live = ~np.isin(unique_ids, np.fromiter(deleted_ids, dtype='int64', count=len(deleted_ids)))
+            unique_ids, scores = unique_ids[live], scores[live]
+        if allowed_ids is not None:
+            allowed = np.isin(unique_ids, allowed_ids, assume_unique=True)
+            unique_ids, scores = unique_ids[allowed], scores[allowed]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(unique_ids[i]), float(scores[i])) for i in top]
+
+    def write(self, directory: Path, deleted_ids: Set[int]):
+        """Merge all postings, drop tombstoned chunks and write them into a store generation"""
+        self._seal()
+        blocks = [self._block_arrays(block) for block in self._blocks()]
+        if blocks:
+            terms, term_idx, doc_ids, tfs, chunk_ids, chunk_lengths = _concat_blocks(blocks)
+        else:
+            terms, term_idx, doc_ids, tfs = [], np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros(0, dtype='uint16')
+            chunk_ids, chunk_lengths = np.zeros(0, dtype='int64'), np.zeros(0, dtype='uint32')
+
+        if deleted_ids:
+            deleted = np.fromiter(deleted_ids, dtype='int64', count=len(deleted_ids))
+            live_postings = ~np.isin(doc_ids, deleted)
+            term_idx, doc_ids, tfs = term_idx[live_postings], doc_ids[live_postings], tfs[live_postings]
+            live_chunks = ~np.isin(chunk_ids, deleted)
+            chunk_ids, chunk_lengths = chunk_ids[live_chunks], chunk_lengths[live_chunks]
+            # Drop terms that no longer have postings
+            used = np.unique(term_idx)
+            remap = np.full(len(terms), -1, dtype='int64')
+            remap[used] = np.arange(len(used))
+            terms = [terms[i] for i in used.tolist()]
+            term_idx = remap[term_idx]
+
+        PostingsBlock.from_postings(terms, term_idx, doc_ids, tfs, chunk_ids, chunk_lengths).write(Path(directory) / LEXICAL_DIR)
+
+    def get_stats(self) -> dict:
+        blocks = self._blocks()
+        return {
+            'chunks': sum(block.num_chunks for block in blocks) + len(self._chunk_ids),
+            'terms_on_disk': len(self.base.terms),
+            'postings_on_disk': len(self.base.doc_ids),
+            'pending_chunks': sum(segment.num_chunks for segment in self.segments) + len(self._chunk_ids),
+            'pending_segments': len(self.segments)
+        }
+
+
+def _concat_blocks(blocks: Iterable[tuple]) -> tuple:
+    """Concatenate (terms, term_idx, doc_ids, tfs, chunk_ids, chunk_lengths) tuples under one vocabulary"""
+    vocab: Dict[str, int] = {}
+    term_parts, doc_parts, tf_parts, chunk_parts, length_parts = [], [], [], [], []
+    for terms, term_idx, doc_ids, tfs, chunk_ids, chunk_lengths in blocks:
+        remap = np.array([vocab.setdefault(term, len(vocab)) for term in terms], dtype='int64')
+        term_parts.append(remap[term_idx] if len(term_idx) else np.zeros(0, dtype='int64'))
+        doc_parts.append(np.asarray(doc_ids, dtype='int64'))
+        tf_parts.append(np.asarray(tfs, dtype='uint16'))
+        chunk_parts.append(np.asarray(chunk_ids, dtype='int64'))
+        length_parts.append(np.asarray(chunk_lengths, dtype='uint32'))
+    return (
+        list(vocab),
+        np.concatenate(term_parts),
+        np.concatenate(doc_parts),
+        np.concatenate(tf_parts),
+        np.concatenate(chunk_parts),
+        np.concatenate(length_parts)
+    )
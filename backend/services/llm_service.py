@@ -1,15 +1,15 @@
+import asyncio
+import time
 from datetime import datetime
-from openai import OpenAI
+from typing import AsyncIterator, List, Optional, Tuple
 from config import settings
 from utils.logger import log_info, log_error, log_llm_response
 from services.letta_service import letta_service
+from services.provider_clients import provider_clients
+from services.provider_router import CircuitOpenError, provider_router
+from services.provider_scheduler import QueueTimeoutError, estimate_tokens, provider_scheduler
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env file
-print("LLM Service initialized with the following settings:")
-print(f"LongCat API Key: {'Set' if settings.longcat_api_key else 'Not Set'}")
-print(f"Cerebras API Key: {'Set' if settings.cerebras_api_key else 'Not Set'}")
-print(f"Groq API Key: {'Set' if settings.groq_api_key else 'Not Set'}")
-print(f"Mistral API Key: {'Set' if settings.mistral_api_key else 'Not Set'}")
 
 MODELS = {
     "longcat": {
@@ -49,39 +49,157 @@ MODELS = {
     },
 }
 
+# Returned (or streamed) when no provider could answer
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble processing your request right now.  Please try again later."
+
+
+class StreamInterruptedError(Exception):
+    """A streamed reply failed after some of it was already sent"""
+
 
 class LLMService:
     def __init__(self):
         self.system_instruction = "You are Isabella, a helpful AI assistant."
 
-    def _get_openai_client(self, provider: str) -> OpenAI:
-        if provider == "longcat":
-            return OpenAI(
-                api_key=settings.longcat_api_key,
-                base_url="https://api.longcat.chat/openai"
-            )
-        if provider == "groq":
-            return OpenAI(
-                api_key=settings.groq_api_key,
-                base_url="https://api.groq.com/openai/v1"
-            )
-        if provider == "cerebras":
-            from cerebras.cloud.sdk import Cerebras
-            return Cerebras(api_key=settings.cerebras_api_key)
-        raise ValueError(f"Unknown provider: {provider}")
-
-    def _call_mistral(self, model_id: str, messages: list, temperature: float, max_tokens: int) -> str:
-        from mistralai import Mistral
-        client = Mistral(api_key=settings.mistral_api_key)
-        chat_response = client.chat.complete(
-            model=model_id,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        return chat_response.choices[0].message.content
-
-    async def generate_response(self, prompt, rag_context=None, temperature=0.7, max_tokens=8192, use_memory=True, model: str = "longcat"):
+    def log_configuration(self):
+        """Log which provider API keys are configured (called at startup, not import)"""
+        log_info("LLM Service initialized with the following settings:")
+        log_info(f"LongCat API Key: {'Set' if settings.longcat_api_key else 'Not Set'}")
+        log_info(f"Cerebras API Key: {'Set' if settings.cerebras_api_key else 'Not Set'}")
+        log_info(f"Groq API Key: {'Set' if settings.groq_api_key else 'Not Set'}")
+        log_info(f"Mistral API Key: {'Set' if settings.mistral_api_key else 'Not Set'}")
+
+    @staticmethod
+    def _with_timestamp(prompt: str) -> str:
+        current_timestamp = datetime.now().strftime("%A, %B %d, %Y - %H:%M")
+        return f"[System Note: Current Time is {current_timestamp}] {prompt}"
+
+    def _direct_messages(self, prompt: str, rag_context=None) -> List[dict]:
+        """Chat messages for a direct provider call (no Letta memory)"""
+        messages = [{"role": "system", "content": self.system_instruction}]
+
+        if rag_context and len(rag_context) > 0:
+            context_text = "You have rag system buildin and these are its retrevals:\n\n"
+            for i, ctx in enumerate(rag_context, 1):
+                context_text += f"[Source {i}]\n{ctx}\n\n"
+            messages.append({"role": "system", "content": context_text})
+
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    @staticmethod
+    def _candidates(model: str) -> List[str]:
+        """The requested model followed by its configured equivalents"""
+        model = model if model in MODELS else "longcat"
+        equivalents = settings.model_equivalents.get(model, [])
+        return [model] + [m for m in equivalents if m in MODELS and m != model]
+
+    @staticmethod
+    def _next_allowed(candidates: List[str]) -> Optional[str]:
+        """Pop candidates until one whose provider's circuit breaker lets a request through"""
+        while candidates:
+            candidate = candidates.pop(0)
+            if provider_router.allow(MODELS[candidate]["provider"]):
+                return candidate
+            log_info(f"Circuit open for {MODELS[candidate]['provider']}, skipping {candidate}")
+        return None
+
+    @staticmethod
+    def _token_estimate(messages: List[dict], max_tokens: int) -> int:
+        """Tokens reserved against a provider's TPM budget before the real usage is known"""
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        return prompt_tokens + min(max_tokens, settings.provider_completion_token_estimate)
+
+    async def _call_model(self, model: str, messages: List[dict], temperature: float, max_tokens: int, session_id: str = "") -> str:
+        """One provider request, scheduled within the provider's budgets and recorded in its stats"""
+        model_config = MODELS[model]
+        provider = model_config["provider"]
+        try:
+            async with provider_scheduler.slot(provider, self._token_estimate(messages, max_tokens), key=session_id) as slot:
+                log_info(f"Sending request to {model_config['display']} (model: {model_config['model_id']})")
+                started = time.perf_counter()
+                try:
+                    client = provider_clients.get(provider)
+                    response = await client.chat.completions.create(
+                        model=model_config["model_id"],
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens
+                    )
+                except Exception:
+                    provider_router.record(provider, time.perf_counter() - started, ok=False)
+                    raise
+                provider_router.record(provider, time.perf_counter() - started, ok=True)
+                usage = getattr(response, "usage", None)
+                if usage is not None and usage.total_tokens:
+                    slot.used_tokens = usage.total_tokens
+        except (QueueTimeoutError, asyncio.CancelledError):
+            # Timed out in the queue, or cancelled (e.g. a losing hedge): not a provider failure
+            provider_router.release(provider)
+            raise
+        return response.choices[0].message.content
+
+    async def _complete(self, model: str, messages: List[dict], temperature: float, max_tokens: int, session_id: str = "") -> Tuple[str, dict]:
+        """Direct completion with circuit breakers, hedging and failover
+
+        Models whose provider's breaker is open are skipped in favour of a
+        configured equivalent. With hedging enabled, if the primary has not
+        answered within its provider's hedge delay (a latency percentile), the
+        same request is sent to the next equivalent model and whichever
+        answers first wins. A failed request fails over to the next one.
+
+        Returns the response and the route that served it.
+        """
+        started = time.perf_counter()
+        candidates = self._candidates(model)
+        primary = self._next_allowed(candidates)
+        if primary is None:
+            raise CircuitOpenError(f"Circuit open for every provider of {model}")
+
+        tasks = {asyncio.create_task(self._call_model(primary, messages, temperature, max_tokens, session_id)): primary}
+        hedged = failover = False
+        last_error = None
+        try:
+            if settings.hedging_enabled and candidates:
+                delay = provider_router.hedge_delay(MODELS[primary]["provider"])
+                done, _ = await asyncio.wait(set(tasks), timeout=delay)
+                if not done:
+                    backup = self._next_allowed(candidates)
+                    if backup is not None:
+                        log_info(f"⏱️  {primary} slower than {delay:.2f}s, hedging with {backup}")
+                        tasks[asyncio.create_task(self._call_model(backup, messages, temperature, max_tokens, session_id))] = backup
+                        hedged = True
+
+            while tasks:
+                done, _ = await asyncio.wait(set(tasks), return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    served_by = tasks.pop(finished)
+                    if finished.exception() is None:
+                        route = {
+                            "via": "provider",
+                            "model": served_by,
+                            "provider": MODELS[served_by]["provider"],
+                            "hedged": hedged,
+                            "hedge_won": hedged and served_by != primary,
+                            "failover": failover,
+                            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                        }
+                        provider_router.record_route(route)
+                        return finished.result(), route
+                    last_error = finished.exception()
+                    log_error(f"Error calling {served_by}: {str(last_error)}")
+                if not tasks:
+                    backup = self._next_allowed(candidates)
+                    if backup is not None:
+                        log_info(f"Failing over to {backup}")
+                        tasks[asyncio.create_task(self._call_model(backup, messages, temperature, max_tokens, session_id))] = backup
+                        failover = True
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise last_error
+
+    async def generate_response(self, prompt, rag_context=None, temperature=0.7, max_tokens=8192, use_memory=True, model: str = "longcat", route: Optional[dict] = None, session_id: str = ""):
         """Generate response from LLM with optional Letta memory.
 
         When *use_memory* is True the Letta agent for the selected model is
@@ -90,11 +208,16 @@ class LLMService:
         returned directly when it succeeds.
 
         When *use_memory* is False (or Letta is unavailable / fails) the
-        selected provider is called directly without memory.
+        selected provider is called directly without memory, through the
+        provider router (see `_complete`).
+
+        When given, *route* is filled in with how the response was served.
+        Provider requests wait for a slot within the provider's concurrency
+        and rate budgets, queued fairly per *session_id*.
         """
+        route = route if route is not None else {}
         try:
-            current_timestamp = datetime.now().strftime("%A, %B %d, %Y - %H:%M")
-            prompt = f"[System Note: Current Time is {current_timestamp}] {prompt}"
+            prompt = self._with_timestamp(prompt)
 
             letta_context = None
             if use_memory and letta_service.client:
@@ -103,51 +226,147 @@ class LLMService:
                     user_message=prompt,
                     rag_context=rag_context,
                     model=model,
+                    provider=MODELS.get(model, MODELS["longcat"])["provider"],
+                    session_id=session_id,
                 )
 
             # The Letta agent uses the selected provider, so its response IS
             # the final response for any model.
             if letta_context is not None:
+                route.update(via="letta", model=model)
                 log_llm_response(letta_context)
                 return letta_context
 
             log_info(f"Letta response empty for {model}, falling back to direct LLM call")
 
             # Fallback: call the provider directly without Letta memory.
-            model_config = MODELS.get(model, MODELS["longcat"])
-            provider = model_config["provider"]
-            model_id = model_config["model_id"]
-
-            messages = [{"role": "system", "content": self.system_instruction}]
-
-            if rag_context and len(rag_context) > 0:
-                context_text = "You have rag system buildin and these are its retrevals:\n\n"
-                for i, ctx in enumerate(rag_context, 1):
-                    context_text += f"[Source {i}]\n{ctx}\n\n"
-                messages.append({"role": "system", "content": context_text})
-
-            messages.append({"role": "user", "content": prompt})
-
-            log_info(f"Sending request to {model_config['display']} (model: {model_id})")
-
-            if provider == "mistral":
-                llm_response = self._call_mistral(model_id, messages, temperature, max_tokens)
-            else:
-                client = self._get_openai_client(provider)
-                response = client.chat.completions.create(
-                    model=model_id,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                llm_response = response.choices[0].message.content
+            messages = self._direct_messages(prompt, rag_context)
+            llm_response, served = await self._complete(model, messages, temperature, max_tokens, session_id)
+            route.update(served)
 
             log_llm_response(llm_response)
             return llm_response
 
         except Exception as e:
             log_error(f"Error calling LLM: {str(e)}")
-            return "I apologize, but I'm having trouble processing your request right now.  Please try again later."
+            route.update(via="fallback", model=model, error=str(e))
+            return FALLBACK_RESPONSE
 
+    async def stream_response(self, prompt, rag_context=None, temperature=0.7, max_tokens=8192, use_memory=True, model: str = "longcat", route: Optional[dict] = None, session_id: str = "") -> AsyncIterator[str]:
+        """Stream the response as text deltas, routed like generate_response.
+
+        With memory, Letta's streaming API is used; if it fails before any
+        text arrives the provider is streamed directly instead. A failure
+        after text was sent cannot be retried, so it sets `route["error"]`
+        and raises StreamInterruptedError: the reply is incomplete. Direct
+        streams skip providers with an open circuit breaker and fail over
+        to an equivalent model until the first token (they are not hedged).
+        Closing the generator (e.g. on client disconnect) closes the
+        upstream stream, so the provider stops generating.
+        """
+        route = route if route is not None else {}
+        prompt = self._with_timestamp(prompt)
+
+        if use_memory and letta_service.client:
+            log_info(f"Streaming from Letta (model: {model}) for memory-aware response")
+            streamed = False
+            letta_stream = letta_service.stream_with_memory(
+                prompt, rag_context, model=model,
+                provider=MODELS.get(model, MODELS["longcat"])["provider"], session_id=session_id
+            )
+            try:
+                async for text in letta_stream:
+                    streamed = True
+                    yield text
+            except Exception as e:
+                log_error(f"Error streaming from Letta: {str(e)}")
+                if streamed:
+                    route.update(via="letta", model=model, error=str(e))
+                    raise StreamInterruptedError(f"Letta stream failed mid-reply: {e}") from e
+            finally:
+                await letta_stream.aclose()
+            if streamed:
+                route.update(via="letta", model=model)
+                return
+            log_info(f"Letta stream empty for {model}, falling back to direct LLM stream")
+
+        messages = self._direct_messages(prompt, rag_context)
+        candidates = self._candidates(model)
+        started = time.perf_counter()
+        failover = False
+        while True:
+            current = self._next_allowed(candidates)
+            if current is None:
+                log_error(f"No provider available to stream {model}")
+                route.update(via="fallback", model=model, error="circuit open")
+                yield FALLBACK_RESPONSE
+                return
+
+            streamed = False
+            model_stream = self._stream_model(current, messages, temperature, max_tokens, session_id)
+            try:
+                async for text in model_stream:
+                    if not streamed:
+                        route.update(
+                            via="provider", model=current, provider=MODELS[current]["provider"], hedged=False,
+                            hedge_won=False, failover=failover,
+                            latency_ms=round((time.perf_counter() - started) * 1000, 1)
+                        )
+                        streamed = True
+                    yield text
+                provider_router.record_route(route)
+                return
+            except Exception as e:
+                # `_stream_model` has already recorded the failure against the provider's circuit breaker
+                log_error(f"Error streaming from {current}: {str(e)}")
+                if streamed:
+                    route.update(error=str(e), interrupted=True)
+                    provider_router.record_route(route)
+                    raise StreamInterruptedError(f"{current} stream failed mid-reply: {e}") from e
+                if not candidates:
+                    route.update(via="fallback", model=model, error=str(e))
+                    yield FALLBACK_RESPONSE
+                    return
+                failover = True
+            finally:
+                await model_stream.aclose()
+
+    async def _stream_model(self, model: str, messages: List[dict], temperature: float, max_tokens: int, session_id: str = "") -> AsyncIterator[str]:
+        """One streamed provider request, scheduled and recorded like `_call_model`"""
+        model_config = MODELS[model]
+        provider = model_config["provider"]
+        estimated = self._token_estimate(messages, max_tokens)
+        completion_reserve = min(max_tokens, settings.provider_completion_token_estimate)
+        try:
+            async with provider_scheduler.slot(provider, estimated, key=session_id) as slot:
+                log_info(f"Streaming from {model_config['display']} (model: {model_config['model_id']})")
+                stream = None
+                generated = []
+                started = time.perf_counter()
+                try:
+                    client = provider_clients.get(provider)
+                    stream = await client.chat.completions.create(
+                        model=model_config["model_id"],
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True
+                    )
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            generated.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                except Exception:
+                    provider_router.record(provider, time.perf_counter() - started, ok=False)
+                    raise
+                finally:
+                    if stream is not None:
+                        await stream.close()
+                    slot.used_tokens = estimated - completion_reserve + estimate_tokens("".join(generated))
+                provider_router.record(provider, time.perf_counter() - started, ok=True)
+        except (QueueTimeoutError, asyncio.CancelledError, GeneratorExit):
+            # Timed out in the queue, or the client went away: not a provider failure
+            provider_router.release(provider)
+            raise
 
 llm_service = LLMService()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+from utils.logger import log_info
+
+
+# Embedding backend of this worker process (loaded once by `_init_worker`)
+_worker_backend = None
+
+
+def _init_worker(backend_name: str, model_name: str, export_dir: str, num_threads: int):
+    global _worker_backend
+    from services.embedding_backend import create_embedding_backend
+    _worker_backend = create_embedding_backend(backend_name, model_name, export_dir, num_threads=num_threads)
+
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    """Embed one shard of chunk texts (runs in a worker process)"""
+    return _worker_backend.encode(texts)
+
+
+def encode_worker_count(workers: int) -> int:
+    """Configured number of encode processes (0 means one per CPU)"""
+    return workers or os.cpu_count() or 1
+
+
+class ParallelEncoder:
+    """Pool of embedding processes for bulk indexing
+
+    Each spawn-based worker loads its own copy of the embedding backend with
+    a share of the CPU threads, so a rebuild uses every core instead of the
+    intra-op threads of one model. Shards are submitted as the caller
+    produces them and collected in submission order, with at most
+    `max_in_flight` outstanding, so vectors stream back in chunk order and
+    memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        backend_name: str,
+        model_name: str,
+        export_dir: str,
+        workers: int,
+        threads_per_worker: int = 0,
+        max_in_flight: int = 0
+    ):
+        self.workers = max(1, workers)
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        log_info(f"⚙️  Encoding with {self.workers} worker processes ({threads_per_worker} threads each)...")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(backend_name, model_name, export_dir, threads_per_worker)
+        )
+
+    def submit(self, texts: List[str]) -> Future:
+        return self._executor.submit(_encode_shard, texts)
+
+    def map_ordered(self, shards: Iterable[Tuple[object, List[str]]]) -> Iterator[Tuple[object, Future]]:
+        """Submit (tag, texts) shards and yield (tag, finished future) in submission order"""
+        in_flight = deque()
+        for tag, texts in shards:
+            in_flight.append((tag, self.submit(texts)))
+            while len(in_flight) >= self.max_in_flight:
+                tag_done, future = in_flight.popleft()
+                future.exception()  # Wait for it
+                yield tag_done, future
+        while in_flight:
+            tag_done, future = in_flight.popleft()
+            future.exception()
+            yield tag_done, future
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> 'ParallelEncoder':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,101 @@
+import importlib.util
+from typing import Dict
+import httpx
+from openai import AsyncOpenAI
+from config import settings
+from utils.logger import log_info, log_error
+
+
+# Every provider exposes an OpenAI-compatible chat completions API; base URLs
+# are configurable (e.g. pointed at a local stub server for testing)
+PROVIDERS = {
+    "longcat": {"api_key_attr": "longcat_api_key", "base_url_attr": "longcat_base_url"},
+    "groq": {"api_key_attr": "groq_api_key", "base_url_attr": "groq_base_url"},
+    "cerebras": {"api_key_attr": "cerebras_api_key", "base_url_attr": "cerebras_base_url"},
+    "mistral": {"api_key_attr": "mistral_api_key", "base_url_attr": "mistral_base_url"},
+}
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None  # httpx[http2]
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 if configured and the h2 package is installed"""
+    return settings.provider_http2 and _http2_available()
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Keep-alive connection pool with the configured limits and timeouts"""
+    return httpx.AsyncClient(
+        http2=http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=settings.provider_max_connections,
+            max_keepalive_connections=settings.provider_max_keepalive_connections,
+            keepalive_expiry=settings.provider_keepalive_expiry_seconds,
+        ),
+        timeout=httpx.Timeout(
+            settings.provider_read_timeout_seconds,
+            connect=settings.provider_connect_timeout_seconds,
+            pool=settings.provider_pool_timeout_seconds,
+        ),
+    )
+
+
+class ProviderClientRegistry:
+    """Long-lived async clients, one per LLM provider
+
+    A client (and its HTTP connection pool) is created on first use and
+    reused by every later request, so requests share warm keep-alive / HTTP/2
+    connections instead of paying a TCP+TLS handshake each, and provider
+    calls never block the event loop.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, AsyncOpenAI] = {}
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, provider: str) -> AsyncOpenAI:
+        client = self._clients.get(provider)
+        if client is None:
+            client = self._create(provider)
+        return client
+
+    def _create(self, provider: str) -> AsyncOpenAI:
+        config = PROVIDERS.get(provider)
+        if config is None:
+            raise ValueError(f"Unknown provider: {provider}")
+        base_url = getattr(settings, config["base_url_attr"])
+        http_client = create_http_client()
+        client = AsyncOpenAI(
+            api_key=getattr(settings, config["api_key_attr"]) or "not-set",
+            base_url=base_url,
+            http_client=http_client,
+            max_retries=settings.provider_max_retries,
+        )
+        self._http_clients[provider] = http_client
+        self._clients[provider] = client
+        log_info(f"🔌 {provider} client pool created ({base_url}, HTTP/2 {'on' if http2_enabled() else 'off'})")
+        return client
+
+    async def close(self):
+        """Close every connection pool (on shutdown)"""
+        for provider, http_client in self._http_clients.items():
+            try:
+                await http_client.aclose()
+            except Exception as e:
+                log_error(f"Error closing {provider} client: {str(e)}")
+        self._http_clients.clear()
+        self._clients.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            'clients': sorted(self._clients),
+            'http2': http2_enabled(),
+            'max_connections': settings.provider_max_connections,
+            'max_keepalive_connections': settings.provider_max_keepalive_connections,
+        }
+
+
+# Global provider client registry
+provider_clients = ProviderClientRegistry()
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+from config import settings
+from utils.logger import log_info
+
+
+class CircuitOpenError(Exception):
+    """Every provider that could serve a request has an open circuit breaker"""
+
+
+class ProviderHealth:
+    """Rolling latency / error statistics and circuit breaker of one provider
+
+    The breaker opens after `failure_threshold` consecutive failures, so
+    requests fail fast (or go to an equivalent model) instead of waiting for
+    each failure. After `cooldown_seconds` one trial request is let through
+    (half-open); its success closes the breaker, its failure reopens it.
+    """
+
+    def __init__(self, window: int, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_seconds = cooldown_seconds
+        self.samples = deque(maxlen=max(1, window))  # (latency seconds, ok)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now (claims the half-open trial)"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            self.state = 'half_open'
+            self.trial_in_flight = False
+        if self.state == 'half_open' and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record(self, latency: float, ok: bool) -> Optional[str]:
+        """Add one outcome; returns the new breaker state if it changed"""
+        self.samples.append((latency, ok))
+        self.requests += 1
+        previous = self.state
+        if ok:
+            self.consecutive_failures = 0
+            self.state = 'closed'
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+        return self.state if self.state != previous else None
+
+    def release(self):
+        """Give back a half-open trial whose request was cancelled"""
+        self.trial_in_flight = False
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Latency percentile of recent successful requests (None without samples)"""
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, int(round(percentile / 100.0 * len(latencies))) - 1))
+        return latencies[index]
+
+    def get_stats(self) -> dict:
+        recent_errors = sum(1 for _, ok in self.samples if not ok)
+        p50, p95 = self.latency_percentile(50), self.latency_percentile(95)
+        return {
+            'state': self.state,
+            'requests': self.requests,
+            'failures': self.failures,
+            'recent_error_rate': recent_errors / len(self.samples) if self.samples else 0.0,
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class ProviderRouter:
+    """Per-provider health, breakers and hedging policy for direct LLM calls"""
+
+    def __init__(self):
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+        self.routes = Counter()  # "model (provider)" -> requests answered
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.interrupted = 0  # Streams that failed after the first token
+
+    def _get(self, provider: str) -> ProviderHealth:
+        health = self._health.get(provider)
+        if health is None:
+            health = self._health[provider] = ProviderHealth(
+                settings.provider_stats_window,
+                settings.circuit_breaker_failures,
+                settings.circuit_breaker_cooldown_seconds
+            )
+        return health
+
+    def allow(self, provider: str) -> bool:
+        with self._lock:
+            return self._get(provider).allow()
+
+    def record(self, provider: str, latency: float, ok: bool):
+        with self._lock:
+            changed = self._get(provider).record(latency, ok)
+        if changed == 'open':
+            log_info(f"⛔ Circuit breaker for {provider} opened")
+        elif changed == 'closed':
+            log_info(f"✅ Circuit breaker for {provider} closed")
+
+    def release(self, provider: str):
+        with self._lock:
+            self._get(provider).release()
+
+    def hedge_delay(self, provider: str) -> float:
+        """How long to wait for a provider before sending a hedged duplicate
+
+        The configured latency percentile of its recent successful requests,
+        or the default delay until enough samples exist.
+        """
+        with self._lock:
+            health = self._get(provider)
+            ok_samples = sum(1 for _, ok in health.samples if ok)
+            delay = health.latency_percentile(settings.hedge_percentile)
+        if delay is None or ok_samples < settings.hedge_min_samples:
+            return settings.hedge_default_delay_seconds
+        return delay
+
+    def record_route(self, route: dict):
+        with self._lock:
+            if route.get('interrupted'):
+                self.interrupted += 1
+                return
+            self.routes[f"{route['model']} ({route['provider']})"] += 1
+            if route.get('hedged'):
+                self.hedges += 1
+                if route.get('hedge_won'):
+                    self.hedge_wins += 1
+            if route.get('failover'):
+                self.failovers += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'providers': {name: health.get_stats() for name, health in self._health.items()},
+                'routes': dict(self.routes),
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'failovers': self.failovers,
+                'interrupted': self.interrupted,
+            }
+
+
+# Global provider router
+provider_router = ProviderRouter()
@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from config import settings
+from utils.logger import log_info
+
+
+class QueueTimeoutError(Exception):
+    """A request waited in a provider's queue past its deadline"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Budget of `per_minute` units refilled continuously (0 = unlimited)"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (0 if it is now)"""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # A request larger than the bucket waits for a full one
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.per_minute
+
+    def take(self, amount: float, now: float):
+        if self.per_minute > 0:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Refund (negative) or charge the difference between estimated and actual use"""
+        if self.per_minute > 0:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class _Waiter:
+    __slots__ = ('future', 'tokens', 'deadline', 'key', 'enqueued_at')
+
+    def __init__(self, future: asyncio.Future, tokens: int, deadline: float, key: str):
+        self.future = future
+        self.tokens = tokens
+        self.deadline = deadline
+        self.key = key
+        self.enqueued_at = time.monotonic()
+
+
+class ProviderLimiter:
+    """Concurrency, requests/minute and tokens/minute budget of one provider
+
+    Requests over budget wait in a queue instead of being sent (and
+    rejected with 429s). The queue is fair across callers (sessions): a
+    caller's n-th queued request is served in round n, so one busy session
+    cannot starve the others. Within a round the earliest deadline goes
+    first, and a request still queued at its deadline fails with
+    QueueTimeoutError.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, rpm: float, tpm: float):
+        self.name = name
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self._heap = []  # (round, deadline, seq, waiter)
+        self._seq = itertools.count()
+        self._queued_per_key = Counter()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.max_queue_depth = 0
+        self.wait_times = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, waiter in self._heap if not waiter.future.done())
+
+    async def acquire(self, tokens: int, key: str = "", timeout: Optional[float] = None):
+        """Wait for a slot and budget for a request of about `tokens` tokens"""
+        now = time.monotonic()
+        if not self._heap and self._ready(tokens, now) == 0.0:
+            self._admit(tokens, now, 0.0)
+            return
+        loop = asyncio.get_running_loop()
+        timeout = settings.provider_queue_timeout_seconds if timeout is None else timeout
+        waiter = _Waiter(loop.create_future(), tokens, now + timeout, key)
+        round_number = self._queued_per_key[key]
+        self._queued_per_key[key] += 1
+        heapq.heappush(self._heap, (round_number, waiter.deadline, next(self._seq), waiter))
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max(0.0, waiter.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self.timeouts += 1
+                self._forget(waiter)
+                raise QueueTimeoutError(f"{self.name} queue wait exceeded {timeout:g}s")
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()  # Admitted just as the caller went away
+            else:
+                waiter.future.cancel()
+                self._forget(waiter)
+            raise
+
+    def _forget(self, waiter: _Waiter):
+        """Drop a waiter that left the queue without being admitted"""
+        self._dequeue_key(waiter.key)
+        self._dispatch()  # It may have been blocking the head of the queue
+
+    def _dequeue_key(self, key: str):
+        self._queued_per_key[key] -= 1
+        if self._queued_per_key[key] <= 0:
+            del self._queued_per_key[key]
+
+    def _ready(self, tokens: int, now: float) -> Optional[float]:
+        """0 if a request can start now, seconds until the budgets allow it, or None if no slot is free"""
+        if self.in_flight >= self.max_concurrent:
+            return None
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _admit(self, tokens: int, now: float, waited: float):
+        self.in_flight += 1
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self.admitted += 1
+        self.wait_times.append(waited)
+
+    def _dispatch(self):
+        """Admit queued requests in order while slots and budget allow"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap:
+            waiter = self._heap[0][3]
+            if waiter.future.done():  # Timed out or cancelled
+                heapq.heappop(self._heap)
+                continue
+            now = time.monotonic()
+            delay = self._ready(waiter.tokens, now)
+            if delay is None:
+                return  # Woken by release()
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._heap)
+            self._dequeue_key(waiter.key)
+            self._admit(waiter.tokens, now, now - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def release(self, estimated_tokens: int = 0, used_tokens: Optional[int] = None):
+        """Free the slot, charging or refunding the token estimate against actual use"""
+        self.in_flight -= 1
+        if used_tokens is not None:
+            self.tokens.adjust(used_tokens - estimated_tokens)
+        self._dispatch()
+
+    def get_stats(self) -> dict:
+        waits = sorted(self.wait_times)
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            'p95_wait_ms': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            'rpm_available': round(self.requests.level, 1) if self.requests.per_minute > 0 else None,
+            'tpm_available': round(self.tokens.level) if self.tokens.per_minute > 0 else None,
+        }
+
+
+class Slot:
+    """An admitted request; set `used_tokens` once the actual usage is known"""
+
+    __slots__ = ('estimated_tokens', 'used_tokens')
+
+    def __init__(self, estimated_tokens: int):
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens: Optional[int] = None
+
+
+class ProviderScheduler:
+    """Per-provider limiters shared by LLMService and LettaService"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def _get(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limits = settings.provider_limits.get(provider, {})
+            limiter = self._limiters[provider] = ProviderLimiter(
+                provider,
+                limits.get('max_concurrent', settings.provider_max_concurrent),
+                limits.get('rpm', settings.provider_rpm),
+                limits.get('tpm', settings.provider_tpm)
+            )
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, provider: str, tokens: int, key: str = "", timeout: Optional[float] = None) -> AsyncIterator[Slot]:
+        """Hold one of the provider's request slots for the duration of a call"""
+        limiter = self._get(provider)
+        started = time.monotonic()
+        await limiter.acquire(tokens, key=key or "", timeout=timeout)
+        waited = time.monotonic() - started
+        if waited >= 1.0:
+            log_info(f"⏳ Waited {waited:.1f}s for a {provider} request slot")
+        slot = Slot(tokens)
+        try:
+            yield slot
+        finally:
+            limiter.release(slot.estimated_tokens, slot.used_tokens)
+
+    def get_stats(self) -> dict:
+        return {name: limiter.get_stats() for name, limiter in self._limiters.items()}
+
+
+# Global provider scheduler
+provider_scheduler = ProviderScheduler()
@@ -1,238 +1,463 @@
 import os
 import json
-import pickle
-from typing import List, Tuple
+import hashlib
+import itertools
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 from config import settings
+from services.chunk_store import (
+    INDEX_FILE, MetadataColumn, TextColumn, append_log, current_generation, migrate_legacy_storage,
+    open_segment, open_store, read_log, read_store_info, store_exists, store_file, write_store
+)
+from services.embedding_backend import create_embedding_backend
+from services.embedding_batcher import EmbeddingBatcher
+from services.embedding_cache import EmbeddingCache
+from services.index_factory import (
+    REMOVABLE_INDEX_TYPES, build_index, bytes_per_vector, choose_index_type, configure_search,
+    search_parameters, vector_codec
+)
+from services.index_snapshot import IndexSnapshot
+from services.lexical_index import BM25Index
+from services.parallel_encoder import ParallelEncoder, encode_worker_count
+from services.retrieval_filter import RetrievalFilter, id_bitmap
+from services.vector_codec import decode_vectors, encode_vectors, evaluate_recall, storage_dtype
 from utils.logger import log_info, log_success, log_error
-import hashlib
+from utils.ttl_cache import TTLCache
 from pathlib import Path
-from PyPDF2 import PdfReader
-from docx import Document
+from utils.document_loader import SUPPORTED_EXTENSIONS, iter_document_chunks, read_tail_chunks
+from utils.file_manifest import FileManifest, hash_file, scan_files
+
+
+# Retrieval modes selectable per request: embeddings, BM25, or both fused with RRF
+RETRIEVAL_MODES = ['vector', 'lexical', 'hybrid']
 
 
 class RAGService:
-    """FAISS-based RAG service for document retrieval"""
+    """FAISS-based RAG service for document retrieval
+    
+    Ingestion (serialized by `_write_lock`) works on private state: `index`,
+    `documents`, `metadata`, `embeddings` and the ID maps. When a write
+    finishes it is published as an immutable `IndexSnapshot`; queries only
+    ever read `self.snapshot`, so they take no lock and never see a
+    half-applied update. Incremental updates never copy the published
+    index: added vectors go to a small delta index and removed ones are
+    tombstoned, until enough changes pile up to merge them (see
+    `_maybe_merge_delta`).
+    """
     
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model_name = settings.embedding_model
+        self._embedder = None  # Loaded on first use (see `embedder`)
+        self._embedder_lock = threading.Lock()
         self.index = None
-        self.documents = []
-        self.metadata = []
+        self.delta_index = None  # Exact index of vectors added since `index` was built (see `_writable_delta`)
+        self.delta_ids = set()  # Chunk IDs in delta_index
+        self.index_tombstones = set()  # Deleted chunk IDs whose vectors are still in `index`
+        self.documents = TextColumn()  # Chunk texts (memory-mapped once loaded)
+        self.metadata = MetadataColumn()  # Chunk metadata rows as dicts
         self.embeddings = None  # ✅ Store embeddings to avoid re-encoding
-        self.embedding_dim = 384  # Dimension for all-MiniLM-L6-v2
+        self._embedding_buffer = None  # Spare capacity `embeddings` grows into (see `_append_embeddings`)
+        self.index_type = 'flat'  # Backend actually built (see services/index_factory.py)
+        self.requested_index_type = 'flat'  # Backend the size policy asked for
+        self.vector_codec = 'fp32'  # How the index stores vectors (fp32, fp16, sq8, pq)
+        self.requested_vector_codec = 'fp32'
+        self.embedding_dtype = storage_dtype(settings.embedding_storage_dtype)  # dtype of self.embeddings
+        self.recall = None  # Sampled recall@k of the index, measured on rebuild
+        self.lexical = self._new_lexical_index()  # BM25 inverted index over the same chunks
         
-    def _get_file_hash(self, filepath: str) -> str:
-        """Calculate hash of file for change detection"""
-        hasher = hashlib.md5()
-        with open(filepath, 'rb') as f:
-            hasher.update(f.read())
-        return hasher.hexdigest()
+        # Persistent 64-bit chunk IDs (stored as metadata['id'] and in the FAISS ID map)
+        self.next_chunk_id = 0
+        self.id_to_pos: Dict[int, int] = {}  # chunk ID -> row in documents/metadata/embeddings
+        self.file_chunk_ids: Dict[str, List[int]] = {}  # file path -> live chunk IDs
+        self.deleted_ids = set()  # Tombstoned chunk IDs waiting for compaction
+        self._write_lock = threading.RLock()
+        self._compaction_thread = None
+        
+        # Append-only persistence: what the store already holds, and the log since the last checkpoint
+        self._persisted_rows = 0  # Rows [0, _persisted_rows) are in the checkpoint or the log
+        self._persisted_deleted = set()  # Tombstones already in the checkpoint or the log
+        self._needs_checkpoint = False  # FAISS index was rebuilt, so the log cannot describe the change
+        self._log_records = 0
+        self._checkpoint_thread = None
+        self._checkpointer = None
+        self._loaded_generation = None  # Store generation the working state matches (None: load it first)
+        
+        # Indexed state of every data file: stat signature, digest and chunk IDs
+        self.manifest = FileManifest(settings.file_hash_path)
+        self._history_tail = None  # history.txt tail state indexed in this pass (see `_index_history_tail`)
+        
+        # Content-addressed chunk embeddings shared by full rebuilds and incremental updates
+        # (opened together with the embedding model, whose identity keys it)
+        self.embedding_cache = None
+        
+        # Concurrent retrieval queries are encoded together off the event loop
+        self.query_batcher = EmbeddingBatcher(
+            self._encode_queries,
+            max_batch_size=settings.query_batch_max_size,
+            max_wait_ms=settings.query_batch_max_wait_ms
+        )
+        
+        # Snapshot read by queries; swapped atomically after every write
+        self.snapshot = None
+        self._dirty = False  # Working state differs from the published snapshot
+        
+        # Hot-path caches for repeated queries. Result IDs are only valid for the
+        # index generation (snapshot) they were computed against.
+        self.index_generation = 0
+        self.query_embedding_cache = TTLCache(settings.query_cache_max_entries, settings.query_cache_ttl_seconds)
+        self.query_result_cache = TTLCache(settings.query_cache_max_entries, settings.query_cache_ttl_seconds)
+        self.filter_cache = TTLCache(settings.filter_cache_max_entries)  # (filter, generation) -> allowed chunk IDs + selector bitmap
+        
+    @property
+    def embedder(self):
+        """The embedding model backend, loaded on first use
+        
+        Loading the model is the slowest part of startup, so importing this
+        module stays cheap and the load runs in whichever worker thread
+        needs the model first (see `warm_up`).
+        """
+        if self._embedder is None:
+            with self._embedder_lock:
+                if self._embedder is None:
+                    embedder = create_embedding_backend(
+                        settings.embedding_backend,
+                        self.model_name,
+                        settings.onnx_export_dir,
+                        num_threads=settings.embedding_threads,
+                        parity_min_cosine=settings.embedding_parity_min_cosine or None
+                    )
+                    if settings.embedding_cache_enabled:
+                        self.embedding_cache = EmbeddingCache(
+                            settings.embedding_cache_path,
+                            embedder.cache_key,
+                            embedder.dim,
+                            max_entries=settings.embedding_cache_max_entries
+                        )
+                    self._embedder = embedder
+        return self._embedder
     
-    def _load_text_file(self, filepath: str) -> str:
-        """Load text from .txt or .md file"""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
+    @property
+    def embedding_dim(self) -> int:
+        return self.embedder.dim
     
-    def _load_pdf_file(self, filepath: str) -> str:
-        """Load text from PDF file"""
-        try:
-            reader = PdfReader(filepath)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            log_error(f"Error loading PDF {filepath}: {str(e)}")
-            return ""
+    def warm_up(self):
+        """Load the embedding model ahead of the first query"""
+        return self.embedder
     
-    def _load_docx_file(self, filepath: str) -> str:
-        """Load text from DOCX file"""
-        try:
-            doc = Document(filepath)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            return text
-        except Exception as e:
-            log_error(f"Error loading DOCX {filepath}: {str(e)}")
-            return ""
-    
-    def _chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk:
-                chunks.append(chunk)
-        return chunks
-    
-    def _load_documents_from_folder(self, include_history: bool = False) -> Tuple[List[str], List[dict]]:
-        """Load all supported documents from data folder
+    def _split_cached(self, chunks: List[str]) -> Tuple[list, dict, dict]:
+        """Look chunks up in the embedding cache
+        
+        Returns: (key of every chunk, cached vectors by key, texts still to
+        encode by key). Each distinct missing text is encoded once
+        (duplicated chunks share a digest); without a cache every chunk is
+        missing and keyed by its position.
+        """
+        self.embedder  # Opens the embedding cache on first use
+        if self.embedding_cache is None:
+            return list(range(len(chunks))), {}, dict(enumerate(chunks))
+        
+        digests = [self.embedding_cache.digest(chunk) for chunk in chunks]
+        cached = self.embedding_cache.get_many(digests)
+        missing = {}
+        for chunk, digest in zip(chunks, digests):
+            if digest not in cached and digest not in missing:
+                missing[digest] = chunk
+        return digests, cached, missing
+    
+    def _merge_encoded(self, keys: list, cached: dict, missing: dict, new_embeddings: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Cache newly encoded vectors and assemble the embeddings of a batch in chunk order"""
+        if missing:
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(list(missing.keys()), new_embeddings)
+            cached.update(zip(missing.keys(), new_embeddings))
+        
+        embeddings = np.empty((len(keys), self.embedding_dim), dtype='float32')
+        for i, key in enumerate(keys):
+            embeddings[i] = cached[key]
+        return embeddings, len(keys) - len(missing)
+    
+    def _encode_chunks(self, chunks: List[str]) -> Tuple[np.ndarray, int]:
+        """Embed document chunks, reusing cached vectors for unchanged chunk texts
+        
+        Returns: (embeddings, number of chunks served from the cache)
+        """
+        keys, cached, missing = self._split_cached(chunks)
+        new_embeddings = self.embedder.encode(list(missing.values())) if missing else None
+        return self._merge_encoded(keys, cached, missing, new_embeddings)
+    
+    def _encode_batches(self, batches: Iterable[List[str]], encoder: Optional[ParallelEncoder] = None) -> Iterator[Tuple[np.ndarray, int]]:
+        """Embed a stream of chunk batches, yielding (embeddings, reused) per batch in order
+        
+        With an `encoder`, the texts missing from the embedding cache are
+        sharded across its worker processes while later batches are still
+        being parsed. Every shard is written to the embedding cache as soon
+        as it comes back, which is what makes a rebuild resumable: after a
+        crash the next rebuild finds the finished shards in the cache and
+        only encodes the rest.
+        """
+        if encoder is None:
+            for batch in batches:
+                yield self._encode_chunks(batch)
+            return
+        
+        def shards():
+            for batch in batches:
+                keys, cached, missing = self._split_cached(batch)
+                yield (batch, keys, cached, missing), list(missing.values())
+        
+        for (batch, keys, cached, missing), future in encoder.map_ordered(shards()):
+            if not missing:
+                yield self._merge_encoded(keys, cached, missing, None)
+                continue
+            try:
+                new_embeddings = future.result()
+            except Exception as e:
+                log_error(f"Encode worker failed, encoding shard in-process: {str(e)}")
+                new_embeddings = self.embedder.encode(list(missing.values()))
+            yield self._merge_encoded(keys, cached, missing, new_embeddings)
+    
+    def _ingest_files(
+        self,
+        file_paths: List[str],
+        current: Dict[str, dict],
+        encoder: Optional[ParallelEncoder] = None,
+        chunks: Optional[Iterable[Tuple[str, int, str]]] = None
+    ) -> Tuple[List[str], List[dict], np.ndarray]:
+        """Parse, chunk and embed files as a stream
+        
+        Chunks flow from the (possibly parallel) parser straight into
+        embedding batches of `settings.embedding_batch_size`, so no document's
+        full text or word list is ever materialized. Each chunk gets its
+        persistent ID and is added to the BM25 index in the same pass.
         
         Args:
-            include_history: If True, include history.txt in loading. Default is False.
+            file_paths: Files to ingest
+            current: This pass's file state from `_scan_data_folder` (digests are taken from it)
+            encoder: Optional encode process pool (see `_encode_batches`)
+            chunks: (file_path, chunk_index, chunk) stream to use instead of parsing file_paths
+        
+        Returns: (documents, metadata, embeddings) for the new chunks (metadata includes 'id')
         """
         documents = []
         metadata = []
+        embedding_batches = []
+        encoded = 0
+        reused = 0
+        file_hashes = {path: current[path]['digest'] for path in file_paths if path in current}
+        
+        def batches():
+            batch = []
+            for file_path, chunk_index, chunk in (chunks if chunks is not None else iter_document_chunks(file_paths)):
+                if file_path not in file_hashes:
+                    file_hashes[file_path] = hash_file(file_path)
+                meta = {
+                    'source': Path(file_path).name,
+                    'chunk_id': chunk_index,
+                    'file_hash': file_hashes[file_path],
+                    'file_path': file_path,
+                    'uploaded_at': current[file_path]['mtime_ns'] / 1e9 if file_path in current else os.path.getmtime(file_path)
+                }
+                self._allocate_chunk_ids([meta])
+                if self.lexical is not None:
+                    self.lexical.add(meta['id'], chunk)
+                documents.append(chunk)
+                metadata.append(meta)
+                batch.append(chunk)
+                if len(batch) >= settings.embedding_batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        
+        for batch_embeddings, batch_reused in self._encode_batches(batches(), encoder):
+            embedding_batches.append(batch_embeddings)
+            encoded += len(batch_embeddings)
+            reused += batch_reused
+            if len(embedding_batches) % 10 == 0:
+                log_info(f"🔢 Encoded {encoded} chunks so far...")
+        
+        if embedding_batches:
+            embeddings = np.vstack(embedding_batches)
+        else:
+            embeddings = np.array([]).astype('float32').reshape(0, self.embedding_dim)
+        
+        if documents and self.embedding_cache is not None:
+            log_info(f"♻️  Embedding cache: {reused} of {len(documents)} chunks reused")
+        return documents, metadata, embeddings
+    
+    def _scan_data_folder(self) -> Dict[str, dict]:
+        """Scan the data folder once and return the current state of every supported file
+        
+        One directory walk and one stat per file; only files whose
+        (size, mtime_ns, inode) changed since they were indexed are re-hashed.
+        history.txt is keyed by its resolved path.
         
+        Returns: {path: {'size', 'mtime_ns', 'inode', 'digest'}}
+        """
         data_path = Path(settings.data_folder)
         if not data_path.exists():
             data_path.mkdir(parents=True)
             log_info(f"Created data folder: {settings.data_folder}")
-            return documents, metadata
         
-        supported_extensions = ['.txt', '.md', '.pdf', '.docx']
-        history_file = Path(settings.history_file_path).resolve()
+        scan = scan_files(settings.data_folder, SUPPORTED_EXTENSIONS, extra_files=[settings.history_file_path])
+        return self.manifest.refresh(scan)
+    
+    def _history_path(self) -> str:
+        """Resolved path of history.txt, the key used for it in metadata and the manifest"""
+        return str(Path(settings.history_file_path).resolve())
+    
+    @staticmethod
+    def _history_fingerprint(file_path: str, size: int) -> str:
+        """Digest of the first and last 4 KiB of the first `size` bytes of a file
         
-        for filepath in data_path.rglob('*'):
-            # Skip history.txt file unless include_history is True
-            if filepath.resolve() == history_file:
-                if not include_history:
-                    log_info(f"Skipping history file: {filepath}")
-                    continue
-                else:
-                    log_info(f"Including history file in initial load: {filepath}")
-                
-            if filepath.is_file() and filepath.suffix in supported_extensions:
-                log_info(f"Loading file: {filepath}")
-                
-                text = ""
-                if filepath.suffix in ['.txt', '.md']:
-                    text = self._load_text_file(str(filepath))
-                elif filepath.suffix == '.pdf':
-                    text = self._load_pdf_file(str(filepath))
-                elif filepath.suffix == '.docx':
-                    text = self._load_docx_file(str(filepath))
-                
-                if text:
-                    chunks = self._chunk_text(text)
-                    for i, chunk in enumerate(chunks):
-                        documents.append(chunk)
-                        metadata.append({
-                            'source': str(filepath.name),
-                            'chunk_id': i,
-                            'file_hash': self._get_file_hash(str(filepath)),
-                            'file_path': str(filepath)
-                        })
+        Compared on the next pass to tell an append (indexed bytes unchanged)
+        from an edited, truncated or rotated file.
+        """
+        window = 4096
+        hasher = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            hasher.update(f.read(min(window, size)))
+            f.seek(max(0, size - window))
+            hasher.update(f.read(min(window, size)))
+        return hasher.hexdigest()
+    
+    def _history_tail_chunks(self, current: Dict[str, dict], tail: dict) -> List[Tuple[str, int, str]]:
+        """Chunk history.txt from the recorded tail offset and record the new tail state
+        
+        Args:
+            tail: Tail state recorded after the last pass ({} to chunk the whole file)
+        
+        Sets `self._history_tail` to {'offset', 'sealed_chunks', 'size',
+        'inode', 'fingerprint', 'chunks'}: the byte offset and global index of
+        the first unsealed chunk, the file size and identity that were
+        indexed, and how many chunks this pass added. Unsealed chunks are
+        replaced on the next pass, which keeps the overlap at the boundary
+        identical to chunking the whole file.
+        """
+        history_path_str = self._history_path()
+        size = current[history_path_str]['size']
+        offset = tail.get('offset', 0)
+        sealed_before = tail.get('sealed_chunks', 0)
+        chunks, sealed, next_offset = read_tail_chunks(history_path_str, offset, size)
+        self._history_tail = {
+            'offset': next_offset,
+            'sealed_chunks': sealed_before + sealed,
+            'size': size,
+            'inode': current[history_path_str].get('inode'),
+            'fingerprint': self._history_fingerprint(history_path_str, size),
+            'chunks': len(chunks),
+            'unsealed_chunks': len(chunks) - sealed
+        }
+        return [(history_path_str, sealed_before + i, chunk) for i, chunk in enumerate(chunks)]
+    
+    def _index_history_tail(self, current: Dict[str, dict]):
+        """Index only the part of history.txt appended since the last pass
+        
+        The unsealed chunks from the last pass are replaced by re-chunking
+        from their start offset; everything before it is kept. If the
+        indexed part of the file changed (truncated, rotated to a new inode
+        or edited), history.txt is re-indexed from the beginning.
+        """
+        history_path_str = self._history_path()
+        entry = current[history_path_str]
+        tail = (self.manifest.entries.get(history_path_str) or {}).get('tail') or {}
+        indexed_ids = self.file_chunk_ids.get(history_path_str, [])
+        
+        if tail:
+            reason = None
+            if entry['size'] < tail['size']:
+                reason = "truncated"
+            elif entry.get('inode') != tail.get('inode'):
+                reason = "rotated"
+            elif self._history_fingerprint(history_path_str, tail['size']) != tail.get('fingerprint'):
+                reason = "rewritten"
+            elif len(indexed_ids) != tail['sealed_chunks'] + tail.get('unsealed_chunks', 0):
+                reason = "out of sync with the index"
+            if reason:
+                log_info(f"📝 history.txt was {reason}, re-indexing it from the start...")
+                tail = {}
+        elif indexed_ids:
+            log_info("📝 No indexed offset recorded for history.txt, re-indexing it once...")
+        else:
+            log_info("📝 Adding history.txt to index for the first time...")
+        
+        # Drop the chunks that will be re-created: the unsealed tail, or everything
+        if tail:
+            stale = indexed_ids[tail['sealed_chunks']:]
+            self.file_chunk_ids[history_path_str] = indexed_ids[:tail['sealed_chunks']]
+            log_info(f"📝 Indexing history.txt from byte {tail['offset']} ({entry['size'] - tail['offset']} bytes)...")
+        else:
+            stale = indexed_ids
+            self.file_chunk_ids.pop(history_path_str, None)
+        if stale:
+            self._remove_chunk_ids(stale)
         
-        return documents, metadata
+        self._add_files_to_index([history_path_str], current, chunks=self._history_tail_chunks(current, tail))
     
-    def _check_history_file_changed(self) -> bool:
+    def _check_history_file_changed(self, current: Dict[str, dict]) -> bool:
         """
         Check if history.txt has changed since last indexing
         Returns: True if history file is new or modified, False otherwise
         """
-        history_file = Path(settings.history_file_path).resolve()
+        history_path_str = self._history_path()
         
         # If history file doesn't exist, no change
-        if not history_file.exists():
+        if history_path_str not in current:
             return False
         
-        # Load saved file hashes
-        saved_hashes = {}
-        if os.path.exists(settings.file_hash_path):
-            try:
-                with open(settings.file_hash_path, 'r') as f:
-                    saved_hashes = json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                log_error(f"Error loading file hashes: {str(e)}")
-                return True  # Treat as changed to trigger re-indexing
-        
-        # Check if history file is in saved hashes and if hash changed
-        history_path_str = str(history_file)
-        if history_path_str not in saved_hashes:
-            # History file is new
-            return True
-        
-        # Check if hash changed
-        try:
-            current_hash = self._get_file_hash(history_path_str)
-            return current_hash != saved_hashes[history_path_str]
-        except Exception as e:
-            log_error(f"Error getting history file hash: {str(e)}")
-            return True  # Treat as changed to trigger re-indexing
+        # New or different digest from the one recorded when it was indexed
+        return current[history_path_str]['digest'] != self.manifest.digest(history_path_str)
     
-    def _get_changed_files(self) -> Tuple[List[str], List[str], List[str]]:
+    def _get_changed_files(self, current: Dict[str, dict]) -> Tuple[List[str], List[str], List[str]]:
         """
         Identify new, modified, and deleted files (excluding history.txt)
         Returns: (new_files, modified_files, deleted_files)
         """
-        # Load saved file hashes
-        saved_hashes = {}
-        if os.path.exists(settings.file_hash_path):
-            with open(settings.file_hash_path, 'r') as f:
-                saved_hashes = json.load(f)
-        
-        # Get current files
-        data_path = Path(settings.data_folder)
-        supported_extensions = ['.txt', '.md', '.pdf', '.docx']
-        history_file = Path(settings.history_file_path).resolve()
-        history_path_str = str(history_file)
+        history_path_str = self._history_path()
         
-        current_files = {}
-        for filepath in data_path.rglob('*'):
-            if filepath.resolve() == history_file:
+        new_files = []
+        modified_files = []
+        for file_path, entry in current.items():
+            if file_path == history_path_str:
                 continue
-            if filepath.is_file() and filepath.suffix in supported_extensions:
-                file_path = str(filepath)
-                current_files[file_path] = self._get_file_hash(file_path)
+            recorded_digest = self.manifest.digest(file_path)
+            if recorded_digest is None:
+                new_files.append(file_path)
+            elif recorded_digest != entry['digest']:
+                modified_files.append(file_path)
         
-        # Identify changes (excluding history.txt from saved_hashes for deletion check)
-        new_files = [f for f in current_files if f not in saved_hashes]
-        modified_files = [f for f in current_files if f in saved_hashes and current_files[f] != saved_hashes[f]]
-        deleted_files = [f for f in saved_hashes if f not in current_files and f != history_path_str]
+        # Identify deletions (excluding history.txt)
+        deleted_files = [f for f in self.manifest.entries if f not in current and f != history_path_str]
         
         return new_files, modified_files, deleted_files
     
-    def _save_file_hashes(self):
-        """Save current file hashes to disk (including history.txt)"""
-        data_path = Path(settings.data_folder)
-        supported_extensions = ['.txt', '.md', '.pdf', '.docx']
-        history_file = Path(settings.history_file_path).resolve()
-        history_path_str = str(history_file)
-        
-        file_hashes = {}
-        for filepath in data_path.rglob('*'):
-            if filepath.resolve() == history_file:
-                continue
-            if filepath.is_file() and filepath.suffix in supported_extensions:
-                file_path = str(filepath)
-                file_hashes[file_path] = self._get_file_hash(file_path)
-        
-        # Also save history.txt hash if it exists
-        if history_file.exists():
-            file_hashes[history_path_str] = self._get_file_hash(history_path_str)
-        
-        # Create storage directory if needed
-        storage_path = Path(settings.file_hash_path).parent
-        if not storage_path.exists():
-            storage_path.mkdir(parents=True)
-        
-        with open(settings.file_hash_path, 'w') as f:
-            json.dump(file_hashes, f, indent=2)
-    
-    def _should_rebuild_index(self) -> bool:
-        """Check if index needs to be rebuilt"""
-        # Check if index files exist
-        if not os.path.exists(settings.faiss_index_path):
-            return True
-        if not os.path.exists(settings.metadata_path):
-            return True
-        
-        # Load saved metadata
-        with open(settings.metadata_path, 'r') as f:
-            saved_metadata = json.load(f)
-        
-        # Get current files
-        _, current_metadata = self._load_documents_from_folder()
+    def _save_file_hashes(self, current: Dict[str, dict], history_indexed: bool = True):
+        """Record this pass's file state and chunk IDs in the manifest (file_hashes.json)
         
-        # Compare file hashes
-        saved_hashes = set(m['file_hash'] for m in saved_metadata)
-        current_hashes = set(m['file_hash'] for m in current_metadata)
-        
-        return saved_hashes != current_hashes
+        Args:
+            current: File state from `_scan_data_folder`
+            history_indexed: False when this pass did not re-index history.txt; its
+                previously recorded entry is kept so the change is picked up later.
+        """
+        state = dict(current)
+        history_path_str = self._history_path()
+        recorded = self.manifest.entries.get(history_path_str)
+        if not history_indexed:
+            state.pop(history_path_str, None)
+            if recorded:
+                state[history_path_str] = recorded
+        elif history_path_str in state:
+            # Remember how far history.txt has been indexed (kept while it is unchanged)
+            tail = self._history_tail
+            if tail is None and recorded and recorded.get('digest') == state[history_path_str]['digest']:
+                tail = recorded.get('tail')
+            if tail is not None:
+                state[history_path_str] = {**state[history_path_str], 'tail': tail}
+        self.manifest.commit(state, self.file_chunk_ids)
     
     def initialize_index(self, force_rebuild: bool = False, check_history: bool = True):
         """Initialize or load FAISS index with incremental updates
@@ -241,277 +466,1123 @@ class RAGService:
             force_rebuild: If True, rebuild the entire index from scratch
             check_history: If True, check if history.txt has changed (only at startup)
         """
+        with self._write_lock:
+            self._initialize_index(force_rebuild=force_rebuild, check_history=check_history)
+            if self._dirty or self.snapshot is None:
+                self._publish()
+        self._start_checkpointer()
+    
+    def _initialize_index(self, force_rebuild: bool, check_history: bool):
+        """Body of initialize_index, called with the write lock held"""
         try:
             # Create storage directory if it doesn't exist
-            storage_path = Path(settings.faiss_index_path).parent
+            storage_path = Path(settings.chunk_store_path).parent
             if not storage_path.exists():
                 storage_path.mkdir(parents=True)
             
+            # One directory scan per pass; only files with a changed stat signature are re-hashed
+            self._history_tail = None
+            state_current = self._state_is_current()
+            manifest_ok = True if state_current else self.manifest.load()
+            current = self._scan_data_folder()
+            
             # Check for file changes (excluding history.txt)
-            new_files, modified_files, deleted_files = self._get_changed_files()
+            new_files, modified_files, deleted_files = self._get_changed_files(current)
             files_to_embed = new_files + modified_files
             
             # Check if history.txt changed (only on startup, not during file watching)
             history_changed = False
             if check_history:
-                history_changed = self._check_history_file_changed()
+                history_changed = self._check_history_file_changed(current)
                 if history_changed:
                     log_info("📝 History.txt has been updated since last startup")
             
             has_changes = len(files_to_embed) > 0 or len(deleted_files) > 0 or history_changed
-            index_exists = os.path.exists(settings.faiss_index_path) and os.path.exists(settings.metadata_path)
+            index_exists = self._stored_index_exists()
             
-            # If force rebuild or no existing index, rebuild from scratch
-            if force_rebuild or not index_exists:
+            # If force rebuild, no existing index or an unreadable manifest, rebuild from scratch
+            if force_rebuild or not index_exists or not manifest_ok:
                 log_info("🔄 Building embeddings from scratch...")
-                self._build_full_index()
+                self._build_full_index(current)
                 return
             
-            # If no changes, load existing index
+            # Load the stored index unless this process already holds it (watcher / upload passes).
+            # Index saved before chunk IDs existed and without embeddings cannot be updated in place
+            if not state_current and not self._load_index():
+                log_info("🔄 Stored index predates chunk IDs. Building embeddings from scratch...")
+                self._build_full_index(current)
+                return
+            
+            # If no changes, keep the loaded index (and remember new stat signatures of touched files)
             if not has_changes:
-                log_info("✅ No file changes detected. Loading existing embeddings...")
-                self._load_index()
-                log_success(f"✅ Loaded index with {len(self.documents)} chunks from {len(set(m['source'] for m in self.metadata))} files")
+                if self._needs_checkpoint:
+                    self._save_index()  # Storage format conversion done while loading
+                self._save_file_hashes(current, history_indexed=check_history)
+                log_success(f"✅ No file changes detected. Loaded index with {self._live_chunk_count()} chunks from {self._live_file_count()} files")
                 return
             
             # Incremental update
             log_info(f"🔄 Incremental update: {len(new_files)} new, {len(modified_files)} modified, {len(deleted_files)} deleted files")
             
-            # Load existing index
-            self._load_index()
-            
             # Remove chunks from deleted/modified files
             files_to_remove = set(deleted_files + modified_files)
             if files_to_remove:
                 self._remove_files_from_index(files_to_remove)
             
-            # Handle history.txt if it changed
+            # Handle history.txt if it changed (only its appended tail is embedded)
             if history_changed:
-                history_file = Path(settings.history_file_path).resolve()
-                history_path_str = str(history_file)
-                
-                # Check if history.txt chunks exist in the index
-                has_history_chunks = any(meta.get('file_path') == history_path_str for meta in self.metadata)
-                
-                if has_history_chunks:
-                    log_info("📝 Updating history.txt in index...")
-                    self._remove_files_from_index({history_path_str})
-                else:
-                    log_info("📝 Adding history.txt to index for the first time...")
-                
-                # Add updated history.txt
-                if history_file.exists():
-                    self._add_files_to_index([history_path_str])
+                self._index_history_tail(current)
             
             # Add new/modified files
             if files_to_embed:
-                self._add_files_to_index(files_to_embed)
+                self._add_files_to_index(files_to_embed, current)
             
-            # Save updated index
-            self._save_index()
-            self._save_file_hashes()
+            # Persist only what changed (log append); a background checkpoint merges the log
+            self._persist_changes()
+            self._save_file_hashes(current, history_indexed=check_history)
             
-            log_success(f"✅ Index updated! Now contains {len(self.documents)} chunks from {len(set(m['source'] for m in self.metadata))} files")
+            log_success(f"✅ Index updated! Now contains {self._live_chunk_count()} chunks from {self._live_file_count()} files")
+            self._maybe_schedule_compaction()
                 
         except Exception as e:
             log_error(f"Error initializing index: {str(e)}")
-            # Create empty index as fallback
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
-            self.documents = []
-            self.metadata = []
+            # Create empty index as fallback (the next pass loads the stored one again)
+            self._loaded_generation = None
+            self.index, self.index_type, self.vector_codec = build_index('flat', self.embedding_dim)
+            self._reset_delta()
+            self.requested_index_type = 'flat'
+            self.documents = TextColumn()
+            self.metadata = MetadataColumn()
             self.embeddings = np.array([]).astype('float32').reshape(0, self.embedding_dim)
+            self.lexical = self._new_lexical_index()
+            self._rebuild_id_maps()
+            self._needs_checkpoint = True
+    
+    def _state_is_current(self) -> bool:
+        """True if the working state already matches the stored index
+        
+        Set once the store was loaded or checkpointed by this process;
+        logged updates are appended by this process too, so only a new
+        generation on disk (or none at all) requires loading it again.
+        """
+        if self.index is None or self._loaded_generation is None:
+            return False
+        return store_exists(settings.chunk_store_path) and \
+            current_generation(settings.chunk_store_path).name == self._loaded_generation
+    
+    def _live_chunk_count(self) -> int:
+        """Number of chunks that are not tombstoned"""
+        return len(self.metadata) - len(self.deleted_ids)
     
-    def _build_full_index(self):
-        """Build complete index from all documents"""
-        # Load documents (including history.txt on initial startup)
-        self.documents, self.metadata = self._load_documents_from_folder(include_history=True)
+    def _live_file_count(self) -> int:
+        """Number of files with at least one live chunk"""
+        return sum(1 for chunk_ids in self.file_chunk_ids.values() if chunk_ids)
+    
+    def _allocate_chunk_ids(self, metadata: List[dict]):
+        """Assign fresh persistent chunk IDs to new metadata entries"""
+        for meta in metadata:
+            meta['id'] = self.next_chunk_id
+            self.next_chunk_id += 1
+    
+    def _mark_changed(self):
+        """Record that the working state changed, so the next publish starts a new generation"""
+        self._dirty = True
+    
+    def _publish(self):
+        """Publish the working state to readers as a new immutable snapshot
+        
+        Only state proportional to the changes since the last checkpoint is
+        copied (column tails, tombstones, which compaction keeps bounded).
+        The FAISS index, delta index, BM25 segments, embeddings and ID map
+        are shared until a writer replaces them. A change bumps
+        `index_generation`, which invalidates cached query results.
+        """
+        if self._dirty:
+            self.index_generation += 1
+        self.snapshot = IndexSnapshot(
+            generation=self.index_generation,
+            index=self.index,
+            index_type=self.index_type,
+            documents=self.documents.snapshot(),
+            metadata=self.metadata.snapshot(),
+            embeddings=self.embeddings,
+            vector_codec=self.vector_codec,
+            lexical=self.lexical.snapshot() if self.lexical is not None else None,
+            id_to_pos=self.id_to_pos,
+            deleted_ids=frozenset(self.deleted_ids),
+            live_files=self._live_file_count(),
+            delta_index=self.delta_index,
+            index_tombstones=len(self.index_tombstones)
+        )
+        if self._dirty:
+            self.query_result_cache.clear()  # Old generations can no longer be hit
+            self.filter_cache.clear()
+        self._dirty = False
+    
+    def _writable_delta(self):
+        """The delta index to add vectors to, cloned first if the published snapshot still uses it
+        
+        The delta is a small exact (flat) index, so copying it is cheap;
+        the main index is never modified while published.
+        """
+        if self.delta_index is None:
+            self.delta_index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.index.d))
+        elif self.snapshot is not None and self.delta_index is self.snapshot.delta_index:
+            self.delta_index = faiss.clone_index(self.delta_index)
+        return self.delta_index
+    
+    def _reset_delta(self):
+        """Forget the delta and tombstones (the main index was just built or loaded with everything)"""
+        self.delta_index = None
+        self.delta_ids = set()
+        self.index_tombstones = set()
+    
+    def _maybe_merge_delta(self):
+        """Merge the delta once it holds `faiss_delta_max_chunks` and `faiss_delta_max_ratio` of the index
+        
+        Merging copies the main index once, so it is amortized over many
+        updates instead of paid by each.
+        """
+        pending = len(self.delta_ids)
+        if self.index_type in REMOVABLE_INDEX_TYPES:
+            pending += len(self.index_tombstones)
+        if pending and pending >= max(settings.faiss_delta_max_chunks, settings.faiss_delta_max_ratio * self.index.ntotal):
+            log_info(f"🧩 Merging {pending} pending vector changes into the {self.index_type.upper()} index...")
+            self._merge_delta()
+    
+    def _merge_delta(self):
+        """Add the delta's vectors to the main index and drop tombstoned vectors from it
+        
+        Works on a copy when the published snapshot still uses the main
+        index. HNSW cannot remove vectors, so its tombstones stay until
+        compaction rebuilds the graph.
+        """
+        removable = self.index_type in REMOVABLE_INDEX_TYPES
+        has_delta = self.delta_index is not None and self.delta_index.ntotal > 0
+        if not has_delta and not (removable and self.index_tombstones):
+            return
+        
+        index = self.index
+        if self.snapshot is not None and index is self.snapshot.index:
+            index = faiss.clone_index(index)
+            configure_search(index, self.index_type)
+        if has_delta:
+            vectors = faiss.downcast_index(self.delta_index.index).reconstruct_n(0, self.delta_index.ntotal)
+            index.add_with_ids(vectors, faiss.vector_to_array(self.delta_index.id_map))
+        if removable and self.index_tombstones:
+            index.remove_ids(np.array(sorted(self.index_tombstones), dtype='int64'))
+            self.index_tombstones = set()
+        self.index = index
+        self.delta_index = None
+        self.delta_ids = set()
+    
+    def _append_embeddings(self, new_embeddings: np.ndarray):
+        """Append rows to the stored embeddings without copying the existing ones
+        
+        Rows are written into the spare capacity of a buffer that grows
+        geometrically; `embeddings` is a view of its filled part, so the
+        view held by the published snapshot never sees later appends.
+        """
+        current = self.embeddings
+        rows = 0 if current is None else current.shape[0]
+        stored = encode_vectors(new_embeddings, current.dtype.name if rows else self.embedding_dtype)
+        needed = rows + stored.shape[0]
+        buffer = self._embedding_buffer
+        if buffer is None or current is None or current.base is not buffer or buffer.dtype != stored.dtype or buffer.shape[0] < needed:
+            buffer = np.empty((max(2 * needed, 1024), stored.shape[1]), dtype=stored.dtype)
+            if rows:
+                buffer[:rows] = current
+            self._embedding_buffer = buffer
+        buffer[rows:needed] = stored
+        self.embeddings = buffer[:needed]
+    
+    def _rebuild_id_maps(self):
+        """Rebuild the chunk ID -> row and file -> chunk IDs lookups from metadata
+        
+        Reads the ID, tombstone and file columns directly, so no per-row
+        metadata dicts are built.
+        """
+        self._mark_changed()
+        ids = self.metadata.ids().tolist()
+        deleted = self.metadata.deleted_mask().tolist()
+        self.id_to_pos = dict(zip(ids, range(len(ids))))
+        self.file_chunk_ids = {}
+        self.deleted_ids = set()
+        for chunk_uid, is_deleted, file_key in zip(ids, deleted, self.metadata.file_paths()):
+            if is_deleted:
+                self.deleted_ids.add(chunk_uid)
+                continue
+            self.file_chunk_ids.setdefault(file_key, []).append(chunk_uid)
+    
+    def _build_full_index(self, current: Dict[str, dict] = None):
+        """Build complete index from all documents
+        
+        Args:
+            current: File state from `_scan_data_folder` (scanned here if not given)
+        """
+        if current is None:
+            current = self._scan_data_folder()
+        
+        # Keep counting from previously issued IDs so chunk IDs are never reused
+        self.next_chunk_id = max(self.next_chunk_id, self._load_index_info().get('next_chunk_id', 0))
+        self.lexical = self._new_lexical_index()
+        
+        # Load and embed documents as one stream (including history.txt on initial startup)
+        log_info(f"Loading and encoding chunks from {len(current)} files...")
+        encoder = self._bulk_encoder(len(current))
+        history_path_str = self._history_path()
+        file_paths = [path for path in current if path != history_path_str]
+        chunks = iter_document_chunks(file_paths)
+        if history_path_str in current:
+            # history.txt goes through the tail indexer so its indexed offset is recorded
+            # (a new list: the lazy chunk stream above must not see it)
+            chunks = itertools.chain(chunks, self._history_tail_chunks(current, {}))
+            file_paths = file_paths + [history_path_str]
+        try:
+            documents, metadata, embeddings = self._ingest_files(file_paths, current, encoder, chunks=chunks)
+        finally:
+            if encoder is not None:
+                encoder.close()
+        self.embeddings = encode_vectors(embeddings, self.embedding_dtype)
+        self.documents = TextColumn.from_list(documents)
+        self.metadata = MetadataColumn.from_dicts(metadata)
+        self._rebuild_id_maps()
         
         if not self.documents:
             log_info("No documents found. Creating empty index.")
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
-            self.embeddings = np.array([]).astype('float32').reshape(0, self.embedding_dim)
+            self._rebuild_index_from_embeddings()
             self._save_index()
-            self._save_file_hashes()
+            self._save_file_hashes(current)
             return
         
-        # Generate embeddings
-        log_info(f"Encoding {len(self.documents)} document chunks...")
-        self.embeddings = self.model.encode(self.documents, show_progress_bar=True)
-        self.embeddings = np.array(self.embeddings).astype('float32')
-        
-        # Create FAISS index
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
-        self.index.add(self.embeddings)
+        # Create FAISS index (backend chosen from corpus size)
+        self._rebuild_index_from_embeddings()
         
         # Save index and metadata
         self._save_index()
-        self._save_file_hashes()
-        log_success(f"✅ Embeddings ready! Indexed {len(self.documents)} chunks from {len(set(m['source'] for m in self.metadata))} files")
+        self._save_file_hashes(current)
+        log_success(f"✅ Embeddings ready! Indexed {len(self.documents)} chunks from {self._live_file_count()} files")
+    
+    def _bulk_encoder(self, num_files: int) -> Optional[ParallelEncoder]:
+        """Encode process pool for a full rebuild (None for single-process encoding)"""
+        workers = encode_worker_count(settings.encode_workers)
+        if settings.encode_workers == 1 or workers <= 1 or num_files == 0:
+            return None
+        self.warm_up()  # Opens the embedding cache the workers' shards are checkpointed to
+        if self.embedding_cache is None:
+            log_info("⚠️  Embedding cache disabled: an interrupted rebuild will start over")
+        return ParallelEncoder(
+            settings.embedding_backend,
+            self.model_name,
+            settings.onnx_export_dir,
+            workers,
+            threads_per_worker=settings.encode_worker_threads,
+            max_in_flight=settings.encode_shards_in_flight
+        )
+    
+    def _rebuild_index_from_embeddings(self):
+        """Create a fresh FAISS index from stored embeddings (no re-encoding)
+
+        The index backend is picked by `choose_index_type` from the number of
+        live chunks, the vector codec comes from `settings.faiss_vector_codec`,
+        and IVF/PQ/SQ quantizers are trained on the stored embeddings.
+        Tombstoned chunks are left out. Recall of the new index is sampled
+        afterwards (see `_measure_recall`).
+        """
+        stored = self.embeddings
+        if stored is None:
+            stored = np.array([]).astype('float32').reshape(0, self.embedding_dim)
+        
+        chunk_ids = self.metadata.ids()
+        if self.deleted_ids:
+            live_rows = self._live_rows()
+            stored = stored[live_rows]
+            chunk_ids = chunk_ids[live_rows]
+        embeddings = decode_vectors(stored)
+        
+        self.requested_index_type = choose_index_type(embeddings.shape[0])
+        self.requested_vector_codec = vector_codec()
+        self.index, self.index_type, self.vector_codec = build_index(
+            self.requested_index_type, self.embedding_dim, embeddings, self.requested_vector_codec
+        )
+        self._reset_delta()
+        if embeddings.shape[0] > 0:
+            self.index.add_with_ids(embeddings, chunk_ids)
+        del embeddings
+        self._needs_checkpoint = True
+        
+        if self.index_type != 'flat' or self.vector_codec != 'fp32':
+            log_info(f"🧭 Using {self.index_type.upper()} index with {self.vector_codec.upper()} codes for {stored.shape[0]} chunks")
+        self._measure_recall(stored, chunk_ids)
+    
+    def _measure_recall(self, stored: np.ndarray, chunk_ids: np.ndarray):
+        """Sample recall@k of the working index against exact search over the stored embeddings"""
+        if self.index_type == 'flat' and self.vector_codec == 'fp32':
+            self.recall = {'recall': 1.0, 'reranked_recall': None, 'k': settings.recall_k, 'queries': 0, 'exact': True}
+            return
+        
+        def index_search(queries, k):
+            return self.index.search(queries, k)[1]
+        
+        def reranked_search(queries, k):
+            candidates = self.index.search(queries, k * max(1, settings.rerank_factor))[1]
+            return [
+                [chunk_uid for chunk_uid, _ in self._rerank(self.embeddings, self.id_to_pos, query, row.tolist(), k)]
+                for query, row in zip(queries, candidates)
+            ]
+        
+        try:
+            measured = evaluate_recall(index_search, stored, chunk_ids, settings.recall_k, settings.recall_sample_queries)
+            if measured is None:
+                self.recall = None
+                return
+            recall, queries = measured
+            reranked = None
+            if settings.rerank_enabled:
+                reranked = evaluate_recall(reranked_search, stored, chunk_ids, settings.recall_k, settings.recall_sample_queries)[0]
+            self.recall = {'recall': recall, 'reranked_recall': reranked, 'k': settings.recall_k, 'queries': queries, 'exact': False}
+            log_info(f"🎯 Sampled recall@{settings.recall_k}: {recall:.3f}" + (f" ({reranked:.3f} after rerank)" if reranked is not None else ""))
+        except Exception as e:
+            log_error(f"Error measuring index recall: {str(e)}")
     
     def _remove_files_from_index(self, file_paths: set):
-        """Remove chunks from specified files WITHOUT re-encoding everything"""
-        # Find indices to remove and keep
-        indices_to_remove = []
-        indices_to_keep = []
-        
-        for i, meta in enumerate(self.metadata):
-            meta_file_path = meta.get('file_path') or meta.get('source') or ''
-            if meta_file_path in file_paths:
-                indices_to_remove.append(i)
-            else:
-                indices_to_keep.append(i)
+        """Remove chunks from specified files WITHOUT touching the rest of the index
         
-        if not indices_to_remove:
+        The chunks' IDs are tombstoned in `deleted_ids` (persisted as the
+        store's deleted column) and skipped at query time; their vectors are
+        dropped from the delta index right away and from the main index at
+        the next merge. Rows are reclaimed later by `compact_index`.
+        """
+        ids_to_remove = []
+        for file_path in file_paths:
+            ids_to_remove.extend(self.file_chunk_ids.pop(file_path, []))
+        self._remove_chunk_ids(ids_to_remove)
+    
+    def _remove_chunk_ids(self, ids_to_remove: List[int]):
+        """Remove chunks from the FAISS index and tombstone them (see `_remove_files_from_index`)"""
+        if not ids_to_remove:
             log_info("No chunks to remove")
             return
         
-        log_info(f"🗑️  Removing {len(indices_to_remove)} chunks from index (keeping {len(indices_to_keep)} chunks)...")
+        log_info(f"🗑️  Removing {len(ids_to_remove)} chunks from index (keeping {self._live_chunk_count() - len(ids_to_remove)} chunks)...")
         
-        if not indices_to_keep:
-            # All documents removed
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
-            self.documents = []
-            self.metadata = []
-            self.embeddings = np.array([]).astype('float32').reshape(0, self.embedding_dim)
-            log_info("All documents removed from index")
-            return
+        in_delta = [chunk_uid for chunk_uid in ids_to_remove if chunk_uid in self.delta_ids]
+        if in_delta:
+            self._writable_delta().remove_ids(np.array(in_delta, dtype='int64'))
+            self.delta_ids.difference_update(in_delta)
+        self.index_tombstones.update(chunk_uid for chunk_uid in ids_to_remove if chunk_uid not in in_delta)
         
-        # ✅ Keep embeddings without re-encoding
-        self.embeddings = self.embeddings[indices_to_keep]
-        self.documents = [self.documents[i] for i in indices_to_keep]
-        self.metadata = [self.metadata[i] for i in indices_to_keep]
+        self.deleted_ids.update(ids_to_remove)
+        self._mark_changed()
+        self._maybe_merge_delta()
         
-        # Rebuild FAISS index with kept embeddings (no encoding needed!)
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
-        self.index.add(self.embeddings)
+        log_success(f"✅ Removed {len(ids_to_remove)} chunks without re-encoding")
+    
+    def _live_rows(self) -> np.ndarray:
+        """Row positions of chunks that are not tombstoned"""
+        ids = self.metadata.ids()
+        deleted = np.fromiter(self.deleted_ids, dtype='int64', count=len(self.deleted_ids))
+        return np.flatnonzero(~np.isin(ids, deleted))
+    
+    def _maybe_schedule_compaction(self):
+        """Start a background compaction once enough chunks are tombstoned"""
+        if not self.deleted_ids:
+            return
+        if len(self.deleted_ids) < settings.compaction_min_tombstones and \
+                len(self.deleted_ids) < settings.compaction_tombstone_ratio * len(self.metadata):
+            return
+        if self._compaction_thread and self._compaction_thread.is_alive():
+            return
         
-        log_success(f"✅ Removed {len(indices_to_remove)} chunks without re-encoding")
+        self._compaction_thread = threading.Thread(target=self.compact_index, name="rag-compaction", daemon=True)
+        self._compaction_thread.start()
     
-    def _add_files_to_index(self, file_paths: List[str]):
-        """Add chunks from specified files to index"""
-        log_info(f"Processing {len(file_paths)} files...")
+    def compact_index(self):
+        """Reclaim the rows of tombstoned chunks
         
-        new_documents = []
-        new_metadata = []
+        Drops deleted rows from documents, metadata and embeddings. Chunk IDs
+        are stable, so the FAISS index itself only needs rebuilding for
+        backends that cannot remove vectors in place (HNSW).
+        """
+        with self._write_lock:
+            try:
+                if not self.deleted_ids:
+                    return
+                
+                removed = len(self.deleted_ids)
+                log_info(f"🧹 Compacting index: reclaiming {removed} tombstoned chunks...")
+                
+                self._merge_delta()  # No tombstoned vectors may outlive their rows
+                keep = self._live_rows()
+                self.embeddings = self.embeddings[keep]
+                self.documents = self.documents.take(keep.tolist())
+                self.metadata = self.metadata.take(keep.tolist())
+                self._rebuild_id_maps()
+                
+                if self.index_type not in REMOVABLE_INDEX_TYPES:
+                    self._rebuild_index_from_embeddings()
+                
+                self._save_index()
+                self._publish()
+                log_success(f"✅ Compaction done: reclaimed {removed} chunks, {len(self.documents)} remain")
+            except Exception as e:
+                log_error(f"Error compacting index: {str(e)}")
+    
+    def _add_files_to_index(self, file_paths: List[str], current: Dict[str, dict], chunks: Optional[Iterable[Tuple[str, int, str]]] = None):
+        """Add chunks from specified files (or a given chunk stream) to index"""
+        log_info(f"Processing {len(file_paths)} files...")
         
-        for filepath in file_paths:
-            path = Path(filepath)
-            log_info(f"📄 Loading file: {path.name}")
-            
-            text = ""
-            if path.suffix in ['.txt', '.md']:
-                text = self._load_text_file(str(path))
-            elif path.suffix == '.pdf':
-                text = self._load_pdf_file(str(path))
-            elif path.suffix == '.docx':
-                text = self._load_docx_file(str(path))
-            
-            if text:
-                chunks = self._chunk_text(text)
-                for i, chunk in enumerate(chunks):
-                    new_documents.append(chunk)
-                    new_metadata.append({
-                        'source': str(path.name),
-                        'chunk_id': i,
-                        'file_hash': self._get_file_hash(str(path)),
-                        'file_path': str(path)
-                    })
+        # Parse, chunk and embed new documents only
+        new_documents, new_metadata, new_embeddings = self._ingest_files(file_paths, current, chunks=chunks)
         
         if not new_documents:
             log_info("No new content to add")
             return
         
-        # Generate embeddings for new documents only
-        log_info(f"🔢 Encoding {len(new_documents)} new chunks...")
-        new_embeddings = self.model.encode(new_documents, show_progress_bar=True)
-        new_embeddings = np.array(new_embeddings).astype('float32')
-        
-        # Add to index
-        self.index.add(new_embeddings)
         
         # ✅ Append embeddings to stored embeddings
-        if self.embeddings is None or self.embeddings.shape[0] == 0:
-            self.embeddings = new_embeddings
-        else:
-            self.embeddings = np.vstack([self.embeddings, new_embeddings])
+        self._append_embeddings(new_embeddings)
         
+        first_pos = len(self.metadata)
         self.documents.extend(new_documents)
         self.metadata.extend(new_metadata)
+        for offset, meta in enumerate(new_metadata):
+            self.id_to_pos[meta['id']] = first_pos + offset
+            self.file_chunk_ids.setdefault(meta['file_path'], []).append(meta['id'])
+        
+        # Switch backend when the corpus outgrew the current one, otherwise add in place
+        live_count = self._live_chunk_count()
+        if choose_index_type(live_count) != self.requested_index_type:
+            log_info(f"🔁 Corpus size changed index policy ({self.requested_index_type} → {choose_index_type(live_count)}), rebuilding index...")
+            self._rebuild_index_from_embeddings()
+        else:
+            new_ids = np.array([meta['id'] for meta in new_metadata], dtype='int64')
+            self._writable_delta().add_with_ids(new_embeddings, new_ids)
+            self.delta_ids.update(new_ids.tolist())
+            self._maybe_merge_delta()
+        self._mark_changed()
         
         log_success(f"✅ Added {len(new_documents)} new chunks")
     
+    def _stored_index_exists(self) -> bool:
+        """True if an index was saved, as a chunk store or in the legacy pickle/JSON layout"""
+        if store_exists(settings.chunk_store_path):
+            return store_file(settings.chunk_store_path, INDEX_FILE) is not None or os.path.exists(settings.faiss_index_path)
+        return os.path.exists(settings.faiss_index_path) and os.path.exists(settings.metadata_path)
+    
     def _save_index(self):
-        """Save FAISS index, embeddings, and metadata to disk"""
-        # Save FAISS index
-        faiss.write_index(self.index, settings.faiss_index_path)
-        
-        # Save metadata
-        with open(settings.metadata_path, 'w') as f:
-            json.dump(self.metadata, f)
-        
-        # Save documents
-        docs_path = settings.metadata_path.replace('.json', '_docs.pkl')
-        with open(docs_path, 'wb') as f:
-            pickle.dump(self.documents, f)
-        
-        # ✅ Save embeddings separately
-        embeddings_path = settings.metadata_path.replace('.json', '_embeddings.npy')
-        np.save(embeddings_path, self.embeddings)
-    
-    def _load_index(self):
-        """Load FAISS index, embeddings, and metadata from disk"""
-        # Load FAISS index
-        self.index = faiss.read_index(settings.faiss_index_path)
-        
-        # Load metadata
-        with open(settings.metadata_path, 'r') as f:
-            self.metadata = json.load(f)
-        
-        # Load documents
-        docs_path = settings.metadata_path.replace('.json', '_docs.pkl')
-        with open(docs_path, 'rb') as f:
-            self.documents = pickle.load(f)
-        
-        # ✅ Load embeddings
-        embeddings_path = settings.metadata_path.replace('.json', '_embeddings.npy')
-        if os.path.exists(embeddings_path):
-            self.embeddings = np.load(embeddings_path)
-        else:
-            # Fallback: embeddings file doesn't exist (old version)
-            log_info("⚠️  Embeddings file not found. This is expected on first run with new code.")
-            self.embeddings = np.array([]).astype('float32').reshape(0, self.embedding_dim)
+        """Checkpoint: save FAISS index, embeddings, and metadata to disk as a new store generation
+        
+        The FAISS index and its backend info are written into the generation
+        too, so the whole checkpoint becomes visible at once and the log of
+        the previous generation is discarded with it. The delta is merged
+        first, so a checkpoint always holds a single index.
+        """
+        self._merge_delta()
+        embeddings = self.embeddings
+        if embeddings is None:
+            embeddings = np.array([]).astype('float32').reshape(0, self.embedding_dim)
+        
+        # Index backend info so query-time settings can be re-applied on load
+        index_info = {
+            'index_type': self.index_type,
+            'requested_index_type': self.requested_index_type,
+            'vector_codec': self.vector_codec,
+            'requested_vector_codec': self.requested_vector_codec,
+            'embedding_dtype': self.embeddings.dtype.name if self.embeddings is not None else self.embedding_dtype,
+            'recall': self.recall,
+            'ntotal': self.index.ntotal,
+            'next_chunk_id': self.next_chunk_id
+        }
+        extra_writers = []
+        if self.lexical is not None:
+            extra_writers.append(lambda directory: self.lexical.write(directory, self.deleted_ids))
+        write_store(
+            settings.chunk_store_path, self.documents, self.metadata, self.deleted_ids, embeddings,
+            info=index_info,
+            index_writer=lambda path: faiss.write_index(self.index, path),
+            extra_writers=extra_writers
+        )
+        
+        # Reopen memory-mapped so the in-memory tails are released
+        self.documents, self.metadata, self.embeddings = open_store(settings.chunk_store_path)
+        if self.lexical is not None:
+            self.lexical = self._open_lexical_index()
+        self._persisted_rows = len(self.metadata)
+        self._persisted_deleted = set(self.deleted_ids)
+        self._needs_checkpoint = False
+        self._log_records = 0
+        self._loaded_generation = current_generation(settings.chunk_store_path).name
     
-    def retrieve_context(self, query: str, k: int = 3) -> List[str]:
-        """Retrieve top-k relevant document chunks for query"""
+    def _persist_changes(self):
+        """Persist an incremental update by appending it to the store's log
+        
+        Only the rows added and the chunk IDs tombstoned since the last
+        persist are written. Falls back to a full checkpoint when the FAISS
+        index was rebuilt (backend switch) or the store has no checkpointed
+        index yet.
+        """
+        if self._needs_checkpoint or store_file(settings.chunk_store_path, INDEX_FILE) is None:
+            self._save_index()
+            return
+        
+        new_rows = range(self._persisted_rows, len(self.metadata))
+        removed = self.deleted_ids - self._persisted_deleted
+        if not new_rows and not removed:
+            return
+        
+        self._log_records = append_log(
+            settings.chunk_store_path,
+            [self.documents[pos] for pos in new_rows],
+            [self.metadata[pos] for pos in new_rows],
+            self.embeddings[self._persisted_rows:],
+            removed,
+            self.next_chunk_id
+        )
+        self._persisted_rows = len(self.metadata)
+        self._persisted_deleted |= removed
+        log_info(f"📝 Logged {len(new_rows)} new and {len(removed)} removed chunks ({self._log_records} log records since checkpoint)")
+        
+        if self._log_records >= settings.checkpoint_max_log_records:
+            self._schedule_checkpoint()
+    
+    def _replay_log(self):
+        """Apply updates logged since the loaded checkpoint (crash recovery)
+        
+        Logged segments are appended to the memory-mapped columns and added
+        to the FAISS index; logged tombstones are removed from it.
+        """
+        records = read_log(settings.chunk_store_path)
+        self._log_records = len(records)
+        if not records:
+            return
+        
+        log_info(f"📜 Replaying {len(records)} index log records since the last checkpoint...")
+        new_embeddings = [self.embeddings]
+        removed = set()
+        for record in records:
+            if record.get('segment'):
+                documents, metadata, embeddings = open_segment(settings.chunk_store_path, record['segment'])
+                self.documents.extend(documents)
+                self.metadata.extend(metadata)
+                if self.lexical is not None:
+                    for chunk_uid, text in zip(metadata.ids().tolist(), documents):
+                        self.lexical.add(chunk_uid, text)
+                new_embeddings.append(encode_vectors(embeddings, self.embeddings.dtype.name))
+                self.index.add_with_ids(decode_vectors(embeddings), metadata.ids())
+            removed.update(record.get('deleted', []))
+            self.next_chunk_id = max(self.next_chunk_id, record.get('next_chunk_id', 0))
+        self.embeddings = np.vstack(new_embeddings)
+        self._rebuild_id_maps()
+        
+        removed -= self.deleted_ids
+        if removed:
+            if self.index_type in REMOVABLE_INDEX_TYPES:
+                self.index.remove_ids(np.array(sorted(removed), dtype='int64'))
+            self.deleted_ids |= removed
+            for file_path in list(self.file_chunk_ids):
+                live_ids = [chunk_uid for chunk_uid in self.file_chunk_ids[file_path] if chunk_uid not in removed]
+                if live_ids:
+                    self.file_chunk_ids[file_path] = live_ids
+                else:
+                    del self.file_chunk_ids[file_path]
+        log_success(f"✅ Replayed index log: {self._live_chunk_count()} live chunks")
+    
+    def _schedule_checkpoint(self):
+        """Merge the log into a new checkpoint on a background thread"""
+        if self._checkpoint_thread and self._checkpoint_thread.is_alive():
+            return
+        self._checkpoint_thread = threading.Thread(target=self.checkpoint, name="rag-checkpoint", daemon=True)
+        self._checkpoint_thread.start()
+    
+    def _start_checkpointer(self):
+        """Start the periodic checkpoint loop (once)"""
+        if settings.checkpoint_interval_seconds <= 0 or self._checkpointer is not None:
+            return
+        
+        def run():
+            while True:
+                time.sleep(settings.checkpoint_interval_seconds)
+                if self._log_records:
+                    self.checkpoint()
+        
+        self._checkpointer = threading.Thread(target=run, name="rag-checkpointer", daemon=True)
+        self._checkpointer.start()
+    
+    def checkpoint(self):
+        """Rewrite the store with all logged updates merged in and start an empty log"""
+        with self._write_lock:
+            try:
+                if not self._log_records:
+                    return
+                merged = self._log_records
+                log_info(f"💾 Checkpointing index: merging {merged} log records...")
+                self._save_index()
+                self._publish()  # Same content, now backed by the new generation's files
+                log_success(f"✅ Checkpoint written with {self._live_chunk_count()} chunks")
+            except Exception as e:
+                log_error(f"Error checkpointing index: {str(e)}")
+    
+    def _load_index_info(self) -> dict:
+        """Load saved index backend info (empty for indexes saved before it existed)
+        
+        Read from the chunk store; stores that predate checkpointed indexes
+        fall back to the separate doc_metadata_index_info.json.
+        """
+        index_info = read_store_info(settings.chunk_store_path)
+        if 'next_chunk_id' in index_info:
+            return index_info
+        index_info_path = settings.metadata_path.replace('.json', '_index_info.json')
+        if not os.path.exists(index_info_path):
+            return {}
+        with open(index_info_path, 'r') as f:
+            return json.load(f)
+    
+    def _load_index(self) -> bool:
+        """Load FAISS index, embeddings, and metadata from disk
+        
+        The chunk store is memory-mapped, not read; pickle/JSON storage from
+        older versions is converted to a chunk store first. Updates logged
+        after the last checkpoint are replayed on top of it.
+        
+        Returns False when the stored index predates chunk IDs and has no
+        embeddings to rebuild it from, in which case a full rebuild is needed.
+        """
+        # One-time conversion of pickle/JSON storage (IDs default to row positions)
+        migrate_legacy_storage(settings.chunk_store_path, settings.metadata_path, self.embedding_dim)
+        if not store_exists(settings.chunk_store_path):
+            return False
+        
+        # Load FAISS index (stores from before checkpointed indexes keep it at faiss_index_path)
+        index_path = store_file(settings.chunk_store_path, INDEX_FILE) or settings.faiss_index_path
+        self.index = faiss.read_index(str(index_path))
+        self._reset_delta()
+        
+        # Load index backend info (indexes saved before it existed are flat)
+        index_info = self._load_index_info()
+        self.index_type = index_info.get('index_type', 'flat')
+        self.requested_index_type = index_info.get('requested_index_type', self.index_type)
+        self.vector_codec = index_info.get('vector_codec', 'fp32')
+        self.requested_vector_codec = index_info.get('requested_vector_codec', self.vector_codec)
+        self.recall = index_info.get('recall')
+        configure_search(self.index, self.index_type)
+        
+        # Memory-map documents, metadata and embeddings
+        self.documents, self.metadata, self.embeddings = open_store(settings.chunk_store_path)
+        
+        # Indexes saved before chunk IDs existed are not ID-mapped; rebuild with the migrated IDs
+        if 'next_chunk_id' not in index_info:
+            if self.embeddings.shape[0] != len(self.metadata):
+                return False
+            log_info("🔢 Assigning persistent chunk IDs to existing index...")
+            self.next_chunk_id = len(self.metadata)
+            self._rebuild_id_maps()
+            self._load_lexical_index()
+            self._rebuild_index_from_embeddings()
+            self._save_index()
+            return True
+        
+        self.next_chunk_id = index_info['next_chunk_id']
+        self._rebuild_id_maps()
+        self._persisted_deleted = set(self.deleted_ids)
+        self._needs_checkpoint = False
+        self._load_lexical_index()
+        self._replay_log()
+        if self.index_type not in REMOVABLE_INDEX_TYPES:
+            self.index_tombstones = set(self.deleted_ids)  # Still in the HNSW graph
+        self._persisted_rows = len(self.metadata)
+        self._persisted_deleted = set(self.deleted_ids)
+        self._loaded_generation = current_generation(settings.chunk_store_path).name
+        self._apply_vector_settings()
+        return True
+    
+    def _new_lexical_index(self):
+        """Empty BM25 index (None when lexical retrieval is disabled)"""
+        if not settings.bm25_enabled:
+            return None
+        return BM25Index(k1=settings.bm25_k1, b=settings.bm25_b)
+    
+    def _open_lexical_index(self):
+        """Memory-map the BM25 index of the current store generation (None if it has none)"""
+        return BM25Index.open(current_generation(settings.chunk_store_path), k1=settings.bm25_k1, b=settings.bm25_b)
+    
+    def _load_lexical_index(self):
+        """Load the checkpointed BM25 index, building it from the stored chunk texts if missing"""
+        if not settings.bm25_enabled:
+            self.lexical = None
+            return
+        self.lexical = self._open_lexical_index()
+        if self.lexical is None:
+            log_info("🔤 Building BM25 index from stored chunks...")
+            self.lexical = self._new_lexical_index()
+            for chunk_uid, text in zip(self.metadata.ids().tolist(), self.documents):
+                self.lexical.add(chunk_uid, text)
+            self._needs_checkpoint = True
+    
+    def _apply_vector_settings(self):
+        """Convert stored embeddings / re-encode the index when their configured formats changed
+        
+        Both are done from the stored embeddings (no re-embedding) and are
+        persisted by the next checkpoint.
+        """
+        if self.embeddings.dtype.name != self.embedding_dtype:
+            log_info(f"🗜️  Converting stored embeddings from {self.embeddings.dtype.name} to {self.embedding_dtype}...")
+            self.embeddings = encode_vectors(np.asarray(self.embeddings), self.embedding_dtype)
+            self._needs_checkpoint = True
+        if self.requested_vector_codec != vector_codec():
+            log_info(f"🗜️  Index vector codec changed ({self.requested_vector_codec} → {vector_codec()}), rebuilding index...")
+            self._rebuild_index_from_embeddings()
+    
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed a batch of query strings"""
+        return self.embedder.encode(queries)
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Cache key for a query
+        
+        Only whitespace is collapsed, which tokenizers ignore. Case is kept:
+        `embedding_model` may be a cased model, where it changes the embedding.
+        """
+        return ' '.join(query.split())
+    
+    def _filter_selection(self, snapshot: IndexSnapshot, retrieval_filter: RetrievalFilter):
+        """Live chunk IDs passing a filter and their FAISS selector bitmap
+        
+        Cached per (filter, generation), so repeated filters only pay for a
+        bitmap lookup inside the search. The search parameters wrapping the
+        bitmap are built per query (see `search_parameters`).
+        """
+        cache_key = (retrieval_filter.key(), snapshot.generation)
+        selection = self.filter_cache.get(cache_key)
+        if selection is None:
+            allowed_ids = retrieval_filter.allowed_ids(
+                snapshot.metadata.ids(), snapshot.metadata.file_indexes(), snapshot.metadata.files(), self._history_path()
+            )
+            if snapshot.deleted_ids:
+                deleted = np.fromiter(snapshot.deleted_ids, dtype='int64', count=len(snapshot.deleted_ids))
+                allowed_ids = allowed_ids[~np.isin(allowed_ids, deleted)]
+            selection = (allowed_ids, id_bitmap(allowed_ids))
+            self.filter_cache.put(cache_key, selection)
+        return selection
+    
+    def _search_ids(self, snapshot: IndexSnapshot, query_embedding: np.ndarray, k: int, selection=None) -> List[Tuple[int, float]]:
+        """Return (chunk ID, L2 distance) for the top-k live chunks of an encoded query
+        
+        `selection` (from `_filter_selection`) restricts the search to the
+        chunks passing a metadata filter.
+        """
+        query_embedding = query_embedding.reshape(1, -1)
+        if selection is not None:
+            return self._search_selected(snapshot, query_embedding, k, selection)
+        
+        k = min(k, snapshot.live_chunks)  # Don't search for more than we have
+        if k <= 0:
+            return []
+        # Optionally fetch more candidates from the compressed index and re-score them
+        rerank = settings.rerank_enabled and snapshot.embeddings is not None
+        wanted = k * max(1, settings.rerank_factor) if rerank else k
+        # Over-fetch past tombstones whose vectors are still in the main index
+        hits = []
+        for chunk_uid, distance in self._search_layers(snapshot, query_embedding, wanted, extra=snapshot.index_tombstones):
+            if chunk_uid in snapshot.deleted_ids:
+                continue
+            hits.append((chunk_uid, distance))
+            if len(hits) >= wanted:
+                break
+        if rerank:
+            return self._rerank(snapshot.embeddings, snapshot.id_to_pos, query_embedding[0], [chunk_uid for chunk_uid, _ in hits], k)
+        return hits
+    
+    def _search_selected(self, snapshot: IndexSnapshot, query_embedding: np.ndarray, k: int, selection) -> List[Tuple[int, float]]:
+        """Top-k of the filtered chunks, with the filter applied inside the FAISS search
+        
+        Tombstones are excluded from the selection, so no over-fetching is
+        needed. Index codes whose search does not take an ID selector are
+        answered exactly from the stored embeddings of the selected chunks.
+        """
+        allowed_ids, bitmap = selection
+        k = min(k, len(allowed_ids))
+        if k <= 0:
+            return []
+        rerank = settings.rerank_enabled and snapshot.embeddings is not None
+        wanted = min(k * max(1, settings.rerank_factor), len(allowed_ids)) if rerank else k
         try:
-            if not self.documents or self.index.ntotal == 0:
+            hits = self._search_layers(snapshot, query_embedding, wanted, bitmap=bitmap)[:wanted]
+        except RuntimeError:
+            if snapshot.embeddings is None:
+                raise
+            return self._rerank(snapshot.embeddings, snapshot.id_to_pos, query_embedding[0], allowed_ids.tolist(), k)
+        
+        if rerank:
+            return self._rerank(snapshot.embeddings, snapshot.id_to_pos, query_embedding[0], [chunk_uid for chunk_uid, _ in hits], k)
+        return hits
+    
+    @staticmethod
+    def _search_layers(snapshot: IndexSnapshot, query_embedding: np.ndarray, k: int, extra: int = 0, bitmap=None) -> List[Tuple[int, float]]:
+        """(chunk ID, L2 distance) of the nearest vectors in the main and delta indexes, closest first
+        
+        The main index is asked for `extra` more hits to make up for
+        tombstones the caller skips. `bitmap` restricts both searches to the
+        selected IDs; search parameters are built per search, since FAISS
+        writes into them.
+        """
+        hits = []
+        for index, index_type, fetch_k in (
+            (snapshot.index, snapshot.index_type, k + extra),
+            (snapshot.delta_index, 'flat', k)
+        ):
+            if index is None or index.ntotal == 0:
+                continue
+            fetch_k = min(fetch_k, index.ntotal)
+            if bitmap is None:
+                distances, chunk_ids = index.search(query_embedding, fetch_k)
+            else:
+                distances, chunk_ids = index.search(query_embedding, fetch_k, params=search_parameters(index_type, bitmap))
+            # IVF/HNSW return -1 for empty slots when fewer than k hits are found
+            hits.extend((int(chunk_uid), float(distance)) for chunk_uid, distance in zip(chunk_ids[0], distances[0]) if chunk_uid >= 0)
+        if snapshot.delta_index is not None:
+            hits.sort(key=lambda hit: hit[1])
+        return hits
+    
+    @staticmethod
+    def _rerank(embeddings: np.ndarray, id_to_pos: Dict[int, int], query_embedding: np.ndarray, candidate_ids: List[int], k: int) -> List[Tuple[int, float]]:
+        """Re-score candidate chunks with their stored embeddings and keep the best k
+        
+        Distances are exact squared L2 for float32 storage and near exact for
+        float16 / int8 storage, which is far closer than SQ8 / PQ index codes.
+        """
+        candidate_ids = [chunk_uid for chunk_uid in candidate_ids if chunk_uid in id_to_pos]
+        if not candidate_ids:
+            return []
+        vectors = decode_vectors(embeddings[[id_to_pos[chunk_uid] for chunk_uid in candidate_ids]])
+        distances = ((vectors - query_embedding) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return [(candidate_ids[i], float(distances[i])) for i in order]
+    
+    def _retrieval_mode(self, snapshot: IndexSnapshot, mode: Optional[str]) -> str:
+        """Validate a requested retrieval mode (default: `settings.retrieval_mode`)
+        
+        Unknown modes fall back to vector search, as do lexical / hybrid when
+        the snapshot has no BM25 index.
+        """
+        mode = (mode or settings.retrieval_mode or 'vector').lower()
+        if mode not in RETRIEVAL_MODES:
+            log_info(f"⚠️  Unknown retrieval mode '{mode}', using vector")
+            return 'vector'
+        if mode != 'vector' and snapshot.lexical is None:
+            return 'vector'
+        return mode
+    
+    def _rank(
+        self,
+        snapshot: IndexSnapshot,
+        mode: str,
+        query: str,
+        query_embedding: Optional[np.ndarray],
+        k: int,
+        retrieval_filter: Optional[RetrievalFilter] = None
+    ) -> List[tuple]:
+        """Rank chunks for a query in the given retrieval mode
+        
+        Returns (chunk ID, L2 distance or None, BM25 score or None, fused RRF
+        score or None) tuples, best first. Hybrid mode takes
+        `settings.hybrid_candidates` from each ranking and fuses them with
+        reciprocal rank fusion: score = sum of 1 / (rrf_k + rank).
+        Both rankings only consider chunks passing `retrieval_filter`.
+        """
+        selection = self._filter_selection(snapshot, retrieval_filter) if retrieval_filter is not None else None
+        allowed_ids = selection[0] if selection is not None else None
+        if mode == 'vector':
+            return [(chunk_uid, distance, None, None) for chunk_uid, distance in self._search_ids(snapshot, query_embedding, k, selection)]
+        if mode == 'lexical':
+            lexical_hits = snapshot.lexical.search(query, k, snapshot.deleted_ids, allowed_ids)
+            return [(chunk_uid, None, score, None) for chunk_uid, score in lexical_hits]
+        
+        candidates = max(k, settings.hybrid_candidates)
+        vector_hits = self._search_ids(snapshot, query_embedding, candidates, selection)
+        lexical_hits = snapshot.lexical.search(query, candidates, snapshot.deleted_ids, allowed_ids)
+        fused: Dict[int, float] = {}
+        for ranking in (vector_hits, lexical_hits):
+            for rank, (chunk_uid, _) in enumerate(ranking):
+                fused[chunk_uid] = fused.get(chunk_uid, 0.0) + 1.0 / (settings.hybrid_rrf_k + rank + 1)
+        distances = dict(vector_hits)
+        lexical_scores = dict(lexical_hits)
+        top = sorted(fused, key=lambda chunk_uid: -fused[chunk_uid])[:k]
+        return [(chunk_uid, distances.get(chunk_uid), lexical_scores.get(chunk_uid), fused[chunk_uid]) for chunk_uid in top]
+    
+    def _resolve_hits(self, snapshot: IndexSnapshot, hits: List[tuple]) -> List[dict]:
+        """Turn ranked hits (see `_rank`) into structured hits from the snapshot they were found in
+        
+        Each hit is a dict with the chunk's persistent `id`, the squared L2
+        `distance` reported by FAISS and the BM25 `lexical_score` (each None
+        if that ranking did not return the chunk), a `score`, the chunk `text`
+        and its `source`, `chunk_id` and `file_path` metadata. `score` is the
+        cosine similarity in vector mode (MiniLM embeddings are unit length, so
+        cos = 1 - d / 2), the BM25 score in lexical mode and the RRF score in
+        hybrid mode.
+        """
+        results = []
+        for chunk_uid, distance, lexical_score, fused_score in hits:
+            pos = snapshot.id_to_pos.get(chunk_uid)
+            if pos is None or chunk_uid in snapshot.deleted_ids:
+                continue
+            if fused_score is not None:
+                score = fused_score
+            elif distance is not None:
+                score = 1.0 - distance / 2.0
+            else:
+                score = lexical_score
+            meta = snapshot.metadata[pos]
+            results.append({
+                'id': chunk_uid,
+                'distance': distance,
+                'lexical_score': lexical_score,
+                'score': score,
+                'text': snapshot.documents[pos],
+                'source': meta.get('source', 'Unknown'),
+                'chunk_id': meta.get('chunk_id'),
+                'file_path': meta.get('file_path')
+            })
+        return results
+    
+    @staticmethod
+    def _result_cache_key(snapshot: IndexSnapshot, key: str, k: int, mode: str, retrieval_filter: Optional[RetrievalFilter]) -> tuple:
+        return key, k, mode, retrieval_filter.key() if retrieval_filter is not None else None, snapshot.generation
+    
+    def _cached_hits(self, snapshot: IndexSnapshot, query: str, k: int, mode: str, retrieval_filter: Optional[RetrievalFilter]):
+        """Return (cache key, cached hits or None, cached embedding or None)"""
+        key = self._normalize_query(query)
+        hits = None
+        if settings.query_result_cache_enabled:
+            hits = self.query_result_cache.get(self._result_cache_key(snapshot, key, k, mode, retrieval_filter))
+        embedding = None if hits is not None or mode == 'lexical' else self.query_embedding_cache.get(key)
+        return key, hits, embedding
+    
+    def _search_and_cache(
+        self,
+        snapshot: IndexSnapshot,
+        key: str,
+        query: str,
+        query_embedding: Optional[np.ndarray],
+        k: int,
+        mode: str,
+        retrieval_filter: Optional[RetrievalFilter]
+    ) -> List[tuple]:
+        """Search the snapshot and remember the ranked hits for its generation"""
+        hits = self._rank(snapshot, mode, query, query_embedding, k, retrieval_filter)
+        if settings.query_result_cache_enabled:
+            self.query_result_cache.put(self._result_cache_key(snapshot, key, k, mode, retrieval_filter), hits)
+        return hits
+    
+    def search(self, query: str, k: int = 3, mode: Optional[str] = None, filters: Optional[RetrievalFilter] = None) -> List[dict]:
+        """Retrieve the top-k chunks for query as structured hits (see `_resolve_hits`)
+        
+        `mode` is one of RETRIEVAL_MODES (default: `settings.retrieval_mode`);
+        `filters` restricts the hits to chunks whose file matches it.
+        """
+        try:
+            snapshot = self.snapshot  # One consistent view for the whole query
+            if snapshot is None or snapshot.is_empty:
                 log_info("No documents in index for retrieval")
                 return []
             
-            # Encode query
-            query_embedding = self.model.encode([query])
-            query_embedding = np.array(query_embedding).astype('float32')
-            
-            # Search
-            k = min(k, len(self.documents))  # Don't search for more than we have
-            distances, indices = self.index.search(query_embedding, k)
-            
-            # Get relevant documents
-            results = []
-            for idx in indices[0]:
-                if idx < len(self.documents):
-                    results.append(self.documents[idx])
+            mode = self._retrieval_mode(snapshot, mode)
+            key, hits, query_embedding = self._cached_hits(snapshot, query, k, mode, filters)
+            if hits is None:
+                # Encode query (skipped when the embedding is cached or not needed)
+                if query_embedding is None and mode != 'lexical':
+                    query_embedding = self._encode_queries([query])[0]
+                    self.query_embedding_cache.put(key, query_embedding)
+                hits = self._search_and_cache(snapshot, key, query, query_embedding, k, mode, filters)
+            return self._resolve_hits(snapshot, hits)
+        except Exception as e:
+            log_error(f"Error retrieving context: {str(e)}")
+            return []
+    
+    async def asearch(self, query: str, k: int = 3, mode: Optional[str] = None, filters: Optional[RetrievalFilter] = None) -> List[dict]:
+        """Async search for request handlers
+        
+        The query is encoded by the micro-batching scheduler together with
+        other in-flight queries, and the FAISS / BM25 search runs in a worker
+        thread, so the event loop is never blocked by the model or the index.
+        Repeated queries are answered from the embedding / result caches.
+        """
+        try:
+            snapshot = self.snapshot  # One consistent view for the whole query
+            if snapshot is None or snapshot.is_empty:
+                log_info("No documents in index for retrieval")
+                return []
             
-            return results
+            mode = self._retrieval_mode(snapshot, mode)
+            key, hits, query_embedding = self._cached_hits(snapshot, query, k, mode, filters)
+            if hits is None:
+                if query_embedding is None and mode != 'lexical':
+                    query_embedding = await self.query_batcher.embed(query)
+                    self.query_embedding_cache.put(key, query_embedding)
+                hits = await asyncio.to_thread(self._search_and_cache, snapshot, key, query, query_embedding, k, mode, filters)
+            return self._resolve_hits(snapshot, hits)
         except Exception as e:
             log_error(f"Error retrieving context: {str(e)}")
             return []
     
+    async def aembed_query(self, query: str) -> np.ndarray:
+        """Embedding of a query, reusing the one retrieval cached for it"""
+        key = self._normalize_query(query)
+        embedding = self.query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = await self.query_batcher.embed(query)
+            self.query_embedding_cache.put(key, embedding)
+        return embedding
+
+    def retrieve_context(self, query: str, k: int = 3, mode: Optional[str] = None, filters: Optional[RetrievalFilter] = None) -> List[str]:
+        """Retrieve top-k relevant document chunks for query"""
+        return [hit['text'] for hit in self.search(query, k, mode, filters)]
+    
+    async def aretrieve_context(self, query: str, k: int = 3, mode: Optional[str] = None, filters: Optional[RetrievalFilter] = None) -> List[str]:
+        """Async retrieve_context for request handlers"""
+        return [hit['text'] for hit in await self.asearch(query, k, mode, filters)]
+    
+    def _vector_storage_stats(self, snapshot: IndexSnapshot) -> dict:
+        """Vector formats, approximate memory per chunk and sampled recall (for node sizing)"""
+        embedding_dtype = snapshot.embeddings.dtype.name if snapshot.embeddings is not None else self.embedding_dtype
+        dim = snapshot.index.d  # Stats never force the embedding model to load
+        index_bytes = bytes_per_vector(snapshot.index_type, snapshot.vector_codec, dim)
+        embedding_bytes = np.dtype(embedding_dtype).itemsize * dim
+        return {
+            'index_codec': snapshot.vector_codec,
+            'embedding_dtype': embedding_dtype,
+            'index_bytes_per_chunk': index_bytes,
+            'embedding_bytes_per_chunk': embedding_bytes,
+            'bytes_per_chunk': index_bytes + embedding_bytes,
+            'estimated_vector_bytes': (index_bytes + embedding_bytes) * len(snapshot.metadata),
+            'rerank_enabled': settings.rerank_enabled,
+            'rerank_factor': settings.rerank_factor,
+            'recall': self.recall
+        }
+    
     def get_stats(self) -> dict:
-        """Get RAG statistics"""
+        """Get RAG statistics (of the published snapshot)"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {'indexed_documents': 0, 'total_chunks': 0, 'index_size': 0, 'index_generation': self.index_generation}
         return {
-            'indexed_documents': len(set(m['source'] for m in self.metadata)) if self.metadata else 0,
-            'total_chunks': len(self.documents),
-            'index_size': self.index.ntotal if self.index else 0
+            'indexed_documents': snapshot.live_files,
+            'total_chunks': snapshot.live_chunks,
+            'index_size': snapshot.index_size if snapshot.index else 0,
+            'index_delta_size': snapshot.delta_index.ntotal if snapshot.delta_index is not None else 0,
+            'index_tombstones': snapshot.index_tombstones,
+            'index_type': snapshot.index_type,
+            'embedding_backend': self._embedder.name if self._embedder is not None else None,
+            'vector_storage': self._vector_storage_stats(snapshot),
+            'lexical_index': snapshot.lexical.get_stats() if snapshot.lexical is not None else None,
+            'retrieval_mode': settings.retrieval_mode,
+            'tombstoned_chunks': len(snapshot.deleted_ids),
+            'embedding_cache': self.embedding_cache.get_stats() if self.embedding_cache else None,
+            'query_batching': self.query_batcher.get_stats(),
+            'index_generation': snapshot.generation,
+            'query_embedding_cache': self.query_embedding_cache.get_stats(),
+            'query_result_cache': self.query_result_cache.get_stats(),
+            'filter_cache': self.filter_cache.get_stats()
         }
 rag_service = RAGService()
\ No newline at end of file
@@ -0,0 +1,147 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional
+import numpy as np
+from config import settings
+
+
+# Minute-resolution time note LLMService prepends to every prompt
+_TIMESTAMP_PREFIX = re.compile(r'^\s*\[System Note: Current Time is [^\]]*\]\s*')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Cache identity of a prompt: no timestamp note, lowercase, collapsed whitespace"""
+    return ' '.join(_TIMESTAMP_PREFIX.sub('', prompt).lower().split())
+
+
+def context_key(model: str, chunk_ids: Iterable[int], extra_context: Iterable[str] = ()) -> tuple:
+    """What a response depends on besides the prompt
+
+    The model, the retrieved chunk IDs (in prompt order) and a digest of any
+    other context lines (e.g. earlier conversation turns).
+    """
+    digest = hashlib.sha256('\x00'.join(extra_context).encode('utf-8')).hexdigest()
+    return model, tuple(int(i) for i in chunk_ids), digest
+
+
+class ResponseCache:
+    """Semantic cache of direct (no Letta memory) LLM responses
+
+    Entries are grouped by context key; within a group a prompt hits if it is
+    the same after normalization or its embedding has cosine similarity of
+    at least `similarity_threshold` with a cached prompt's. Entries expire
+    after `ttl_seconds`, the least recently used are evicted past
+    `max_entries`, and everything is dropped when the index generation
+    changes (chunk texts the answers were based on may have changed).
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = 3600.0, similarity_threshold: float = 0.95):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # (context key, normalized prompt) -> (unit prompt embedding or None, response, expires at)
+        self._entries: OrderedDict = OrderedDict()
+        # context key -> normalized prompts cached for it
+        self._groups: Dict[Hashable, Dict[str, None]] = {}
+        self._generation = None
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _sync_generation(self, generation: int):
+        """Drop every entry if the index generation moved on (caller holds the lock)"""
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._groups.clear()
+            self._generation = generation
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key, None)
+        group = self._groups.get(key[0])
+        if group is not None:
+            group.pop(key[1], None)
+            if not group:
+                del self._groups[key[0]]
+
+    def get(self, context: tuple, prompt: str, embedding: Optional[np.ndarray], generation: int) -> Optional[str]:
+        """Cached response for the prompt in this context, or None"""
+        prompt = normalize_prompt(prompt)
+        now = time.monotonic()
+        with self._lock:
+            self._sync_generation(generation)
+            key = (context, prompt)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[1]
+
+            if embedding is not None and context in self._groups:
+                query = _unit(embedding)
+                best_key, best_score = None, self.similarity_threshold
+                for cached_prompt in list(self._groups[context]):
+                    cached_key = (context, cached_prompt)
+                    cached_embedding, _, expires_at = self._entries[cached_key]
+                    if expires_at <= now:
+                        self._remove(cached_key)
+                        continue
+                    if cached_embedding is None:
+                        continue
+                    score = float(cached_embedding @ query)
+                    if score >= best_score:
+                        best_key, best_score = cached_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key][1]
+
+            self.misses += 1
+            return None
+
+    def put(self, context: tuple, prompt: str, embedding: Optional[np.ndarray], generation: int, response: str):
+        """Cache a response, evicting the least recently used entries past the cap"""
+        prompt = normalize_prompt(prompt)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else float('inf')
+        with self._lock:
+            self._sync_generation(generation)
+            key = (context, prompt)
+            self._entries[key] = (_unit(embedding) if embedding is not None else None, response, expires_at)
+            self._entries.move_to_end(key)
+            self._groups.setdefault(context, {})[prompt] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        }
+
+
+def _unit(embedding: np.ndarray) -> np.ndarray:
+    vector = np.asarray(embedding, dtype='float32').reshape(-1)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+# Global response cache instance
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    similarity_threshold=settings.response_cache_similarity_threshold
+)
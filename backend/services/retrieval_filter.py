@@ -0,0 +1,112 @@
+from pathlib import Path
+from typing import Iterable, List, Optional
+import numpy as np
+
+
+class RetrievalFilter:
+    """Metadata predicates a retrieval is restricted to
+
+    Every predicate is a per-file attribute (source name, extension, upload
+    time, history.txt or not), so a filter is evaluated once over the small
+    file table and expanded to a chunk bitmap through the per-row file index
+    column. All given predicates must hold.
+    """
+
+    __slots__ = ('sources', 'file_types', 'uploaded_after', 'uploaded_before', 'exclude_history')
+
+    def __init__(
+        self,
+        sources: Optional[Iterable[str]] = None,
+        file_types: Optional[Iterable[str]] = None,
+        uploaded_after: Optional[float] = None,
+        uploaded_before: Optional[float] = None,
+        exclude_history: bool = False
+    ):
+        self.sources = frozenset(sources) if sources else None
+        self.file_types = frozenset(_normalize_extension(ext) for ext in file_types) if file_types else None
+        self.uploaded_after = uploaded_after
+        self.uploaded_before = uploaded_before
+        self.exclude_history = bool(exclude_history)
+
+    @classmethod
+    def from_dict(cls, filters: Optional[dict]) -> Optional['RetrievalFilter']:
+        """Build a filter from request fields (None when nothing is restricted)
+
+        `uploaded_after` / `uploaded_before` may be datetimes or Unix timestamps.
+        """
+        if not filters:
+            return None
+        retrieval_filter = cls(
+            sources=filters.get('sources'),
+            file_types=filters.get('file_types'),
+            uploaded_after=_timestamp(filters.get('uploaded_after')),
+            uploaded_before=_timestamp(filters.get('uploaded_before')),
+            exclude_history=filters.get('exclude_history', False)
+        )
+        return None if retrieval_filter.is_empty else retrieval_filter
+
+    @property
+    def is_empty(self) -> bool:
+        return (
+            self.sources is None and self.file_types is None and self.uploaded_after is None
+            and self.uploaded_before is None and not self.exclude_history
+        )
+
+    def key(self) -> tuple:
+        """Hashable identity of the filter (for caches)"""
+        return (
+            tuple(sorted(self.sources)) if self.sources is not None else None,
+            tuple(sorted(self.file_types)) if self.file_types is not None else None,
+            self.uploaded_after,
+            self.uploaded_before,
+            self.exclude_history
+        )
+
+    def matches_file(self, file_info: dict, history_path: str) -> bool:
+        """True if chunks of a file (a file table entry) pass the filter"""
+        if self.exclude_history and file_info['file_path'] == history_path:
+            return False
+        if self.sources is not None and file_info['source'] not in self.sources:
+            return False
+        if self.file_types is not None and Path(file_info['file_path']).suffix.lower() not in self.file_types:
+            return False
+        uploaded_at = file_info.get('uploaded_at', 0.0)
+        if self.uploaded_after is not None and uploaded_at < self.uploaded_after:
+            return False
+        if self.uploaded_before is not None and uploaded_at > self.uploaded_before:
+            return False
+        return True
+
+    def allowed_ids(self, chunk_ids: np.ndarray, file_indexes: np.ndarray, files: List[dict], history_path: str) -> np.ndarray:
+        """Sorted chunk IDs whose file passes the filter
+
+        Args:
+            chunk_ids: Chunk ID of every row
+            file_indexes: File table position of every row
+            files: The file table
+        """
+        file_mask = np.array([self.matches_file(f, history_path) for f in files], dtype=bool)
+        if not len(file_mask):
+            return np.zeros(0, dtype='int64')
+        return np.sort(chunk_ids[file_mask[file_indexes]])
+
+
+def id_bitmap(chunk_ids: np.ndarray) -> np.ndarray:
+    """Bitmap over the chunk ID space with the given IDs set (FAISS IDSelectorBitmap layout)"""
+    size = int(chunk_ids.max()) + 1 if len(chunk_ids) else 1
+    bits = np.zeros(size, dtype=bool)
+    bits[chunk_ids] = True
+    return np.packbits(bits, bitorder='little')
+
+
+def _normalize_extension(ext: str) -> str:
+    ext = ext.lower()
+    return ext if ext.startswith('.') else f'.{ext}'
+
+
+def _timestamp(value) -> Optional[float]:
+    if value is None:
+        return None
+    if hasattr(value, 'timestamp'):
+        return value.timestamp()
+    return float(value)
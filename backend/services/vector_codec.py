@@ -0,0 +1,92 @@
+from typing import Callable, Optional, Tuple
+import numpy as np
+
+
+# dtypes the chunk embeddings can be persisted (and held in memory) as
+STORAGE_DTYPES = ['float32', 'float16', 'int8']
+
+# MiniLM embeddings are unit length, so every component lies in [-1, 1] and a
+# fixed int8 scale needs no training (max error 1/254 per component)
+INT8_SCALE = 127.0
+
+# Rows decoded at a time when a whole matrix has to be scanned
+DECODE_BLOCK_ROWS = 65536
+
+
+def storage_dtype(name: str) -> str:
+    """Validate a configured storage dtype (unknown values fall back to float32)"""
+    name = (name or 'float32').lower()
+    return name if name in STORAGE_DTYPES else 'float32'
+
+
+def encode_vectors(vectors: np.ndarray, dtype: str) -> np.ndarray:
+    """Convert float32 embeddings to the storage dtype"""
+    if dtype == 'int8':
+        if vectors.dtype == np.int8:
+            return vectors
+        return np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype('int8')
+    if vectors.dtype == np.int8:
+        vectors = decode_vectors(vectors)
+    return vectors.astype(dtype, copy=False)
+
+
+def decode_vectors(stored: np.ndarray) -> np.ndarray:
+    """Convert stored embeddings (any STORAGE_DTYPES) back to float32"""
+    if stored.dtype == np.int8:
+        return stored.astype('float32') / INT8_SCALE
+    return np.ascontiguousarray(stored, dtype='float32')
+
+
+def exact_top_k(stored: np.ndarray, chunk_ids: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Brute-force top-k chunk IDs (squared L2) of `queries` over stored embeddings
+
+    Scans `stored` in blocks so only one decoded block is in memory at a time.
+    """
+    best_ids = np.full((queries.shape[0], 0), -1, dtype='int64')
+    best_dist = np.zeros((queries.shape[0], 0), dtype='float32')
+    query_norms = (queries ** 2).sum(axis=1, keepdims=True)
+    for start in range(0, stored.shape[0], DECODE_BLOCK_ROWS):
+        block = decode_vectors(stored[start:start + DECODE_BLOCK_ROWS])
+        dist = query_norms - 2.0 * queries @ block.T + (block ** 2).sum(axis=1)
+        ids = np.broadcast_to(chunk_ids[start:start + block.shape[0]], dist.shape)
+        best_dist = np.concatenate([best_dist, dist], axis=1)
+        best_ids = np.concatenate([best_ids, ids], axis=1)
+        if best_dist.shape[1] > k:
+            keep = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+            best_dist = np.take_along_axis(best_dist, keep, axis=1)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+    order = np.argsort(best_dist, axis=1)
+    return np.take_along_axis(best_ids, order, axis=1)
+
+
+def evaluate_recall(
+    search_fn: Callable[[np.ndarray, int], np.ndarray],
+    stored: np.ndarray,
+    chunk_ids: np.ndarray,
+    k: int = 10,
+    num_queries: int = 50,
+    seed: int = 1234
+) -> Optional[Tuple[float, int]]:
+    """Recall@k of an approximate search against exact search on the stored embeddings
+
+    Queries are a random sample of the stored vectors themselves.
+
+    Args:
+        search_fn: (queries, k) -> chunk IDs per query, e.g. a FAISS index search
+        stored: Stored embeddings (any STORAGE_DTYPES)
+        chunk_ids: Chunk ID of each stored row
+
+    Returns: (recall, number of queries) or None when there is nothing to measure
+    """
+    n = stored.shape[0]
+    k = min(k, n)
+    if k <= 0 or num_queries <= 0:
+        return None
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n, size=min(num_queries, n), replace=False))
+    queries = decode_vectors(stored[rows])
+
+    expected = exact_top_k(stored, chunk_ids, queries, k)
+    found = search_fn(queries, k)
+    hits = sum(len(set(e.tolist()) & {int(i) for i in f}) for e, f in zip(expected, found))
+    return hits / float(k * len(rows)), len(rows)
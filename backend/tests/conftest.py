@@ -0,0 +1,96 @@
+import hashlib
+import re
+from pathlib import Path
+import numpy as np
+import pytest
+from config import settings
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder standing in for the sentence-transformers model
+
+    Each word is hashed to one of `dim` buckets and the counts are
+    L2-normalized, so texts sharing words are close and no model has to be
+    downloaded.
+    """
+
+    name = 'hashing'
+    cache_key = 'hashing-test'
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                bucket = int.from_bytes(hashlib.md5(word.encode('utf-8')).digest()[:4], 'little') % self.dim
+                vectors[row, bucket] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+@pytest.fixture
+def rag_settings(tmp_path, monkeypatch):
+    """Point every RAG storage path at a temporary directory and ingest in-process"""
+    data = tmp_path / 'data'
+    storage = tmp_path / 'storage'
+    data.mkdir()
+    storage.mkdir()
+    overrides = {
+        'data_folder': str(data),
+        'history_file_path': str(data / 'history.txt'),
+        'chunk_store_path': str(storage / 'chunks'),
+        'file_hash_path': str(storage / 'file_hashes.json'),
+        'faiss_index_path': str(storage / 'faiss_index.bin'),
+        'metadata_path': str(storage / 'doc_metadata.json'),
+        'embedding_cache_enabled': False,
+        'ingest_workers': 1,
+        'encode_workers': 1,
+        'checkpoint_interval_seconds': 0,
+        'faiss_index_type': 'flat',
+        'faiss_vector_codec': 'fp32',
+        'rerank_enabled': False,
+        'compaction_min_tombstones': 10 ** 9,  # Tests compact explicitly
+        'compaction_tombstone_ratio': 2.0,
+    }
+    for name, value in overrides.items():
+        monkeypatch.setattr(settings, name, value)
+    return data
+
+
+@pytest.fixture
+def make_rag(rag_settings):
+    """Factory for RAGService instances over the temporary data folder
+
+    Every call returns a fresh service (as after a restart) sharing the same
+    storage. Background checkpoints / compactions are joined before the
+    settings are restored, so they never write outside the temporary folder.
+    """
+    from services.rag_service import RAGService
+    services = []
+
+    def factory() -> RAGService:
+        service = RAGService()
+        service._embedder = HashingEmbedder()
+        services.append(service)
+        return service
+
+    yield factory
+    for service in services:
+        for thread in (service._compaction_thread, service._checkpoint_thread):
+            if thread is not None:
+                thread.join()
+
+
+def words(tag: str, count: int) -> str:
+    """`count` words dominated by a tag, e.g. 'alpha alpha1 alpha alpha3 ...'
+
+    Every chunk of the text embeds close to the query `tag` and far from
+    other tags.
+    """
+    return ' '.join(tag if i % 2 == 0 else f'{tag}{i}' for i in range(count))
+
+
+def write(path: Path, text: str):
+    path.write_text(text, encoding='utf-8')
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+from config import settings
+from models.schemas import ChatRequest
+from routes import chat
+from services.letta_service import letta_service
+from services.llm_service import StreamInterruptedError, llm_service
+from services.provider_clients import provider_clients
+from services.provider_router import provider_router
+from services.response_cache import response_cache
+
+
+async def broken_stream(*args, **kwargs):
+    yield "The answer "
+    yield "is"
+    raise ConnectionError("connection reset")
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+async def collect(agen):
+    return [item async for item in agen]
+
+
+def stream_events(request):
+    response = asyncio.run(chat.chat_stream(request, ConnectedRequest()))
+    body = asyncio.run(collect(response.body_iterator))
+    events = []
+    for message in body:
+        event, data = message.strip().split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+@pytest.fixture
+def saved_turns(monkeypatch):
+    turns = []
+
+    async def retrieve_for_chat(request, session_id):
+        return [], [], None
+
+    async def record_turn(request, session_id, rag_context, llm_response, query_embedding):
+        turns.append(llm_response)
+
+    monkeypatch.setattr(chat, 'retrieve_for_chat', retrieve_for_chat)
+    monkeypatch.setattr(chat, 'record_turn', record_turn)
+    return turns
+
+
+def test_letta_stream_failing_mid_reply_is_not_a_complete_answer(monkeypatch):
+    monkeypatch.setattr(letta_service, 'client', object())
+    monkeypatch.setattr(letta_service, 'stream_with_memory', broken_stream)
+    route = {}
+    received = []
+
+    async def consume():
+        async for text in llm_service.stream_response("question", route=route):
+            received.append(text)
+
+    with pytest.raises(StreamInterruptedError):
+        asyncio.run(consume())
+    assert received == ["The answer ", "is"]
+    assert route['error'] == "connection reset"
+
+
+def test_interrupted_chat_stream_ends_with_an_error_and_is_not_saved(monkeypatch, saved_turns):
+    monkeypatch.setattr(letta_service, 'client', object())
+    monkeypatch.setattr(letta_service, 'stream_with_memory', broken_stream)
+
+    events = stream_events(ChatRequest(message="question", use_letta=True))
+    assert [event for event, _ in events] == ['sources', 'token', 'token', 'error']
+    assert events[-1][1]['partial'] is True
+    assert saved_turns == []
+
+
+@pytest.fixture
+def broken_provider(monkeypatch):
+    """Direct provider streams that fail after two tokens, with fresh router stats"""
+    monkeypatch.setattr(letta_service, 'client', None)
+    monkeypatch.setattr(provider_router, '_health', {})
+    monkeypatch.setattr(provider_router, 'interrupted', 0)
+
+    class BrokenChunks:
+        def __aiter__(self):
+            return broken_chunks()
+
+        async def close(self):
+            pass
+
+    async def broken_chunks():
+        async for text in broken_stream():
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    async def create(**kwargs):
+        return BrokenChunks()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(provider_clients, 'get', lambda provider: client)
+
+
+def test_provider_stream_failing_mid_reply_is_recorded_as_a_failure(broken_provider):
+    routes_before = dict(provider_router.routes)
+    route = {}
+
+    with pytest.raises(StreamInterruptedError):
+        asyncio.run(collect(llm_service.stream_response("question", use_memory=False, model="longcat", route=route)))
+    assert route['interrupted'] and route['error'] == "connection reset"
+    assert provider_router.interrupted == 1
+    assert dict(provider_router.routes) == routes_before  # Not counted as an answer
+    assert provider_router.get_stats()['providers']['longcat']['failures'] == 1  # Counted by the circuit breaker
+
+
+def test_interrupted_reply_is_not_cached(monkeypatch, broken_provider, saved_turns):
+    monkeypatch.setattr(settings, 'response_cache_enabled', True)
+    cached = []
+    monkeypatch.setattr(response_cache, 'get', lambda *args: None)
+    monkeypatch.setattr(response_cache, 'put', lambda *args: cached.append(args))
+
+    events = stream_events(ChatRequest(message="question", use_letta=False))
+    assert events[-1][0] == 'error'
+    assert cached == []
+    assert saved_turns == []
+
+
+def test_replies_with_a_route_error_are_not_cached(monkeypatch):
+    cached = []
+    monkeypatch.setattr(response_cache, 'put', lambda *args: cached.append(args))
+    request = ChatRequest(message="question", use_letta=False)
+
+    chat.cache_response(request, 'context', None, "partial answer", {"error": "connection reset"})
+    assert cached == []
+    chat.cache_response(request, 'context', None, "full answer", {"via": "provider"})
+    assert len(cached) == 1
@@ -0,0 +1,41 @@
+from concurrent.futures import Future
+from utils import document_loader
+from utils.document_loader import iter_document_chunks, iter_file_chunks
+from tests.conftest import words, write
+
+
+class InlineExecutor:
+    """Runs `parse_file` on submit and records how far submissions got ahead of consumption"""
+
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.submitted = 0
+        InlineExecutor.instances.append(self)
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def test_pool_parsing_keeps_a_bounded_window_of_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_loader, 'ProcessPoolExecutor', InlineExecutor)
+    monkeypatch.setattr(InlineExecutor, 'instances', [])
+    paths = []
+    for i in range(20):
+        write(tmp_path / f'doc{i}.txt', words(f'doc{i}', 700))
+        paths.append(str(tmp_path / f'doc{i}.txt'))
+
+    chunks = iter_document_chunks(paths, workers=2)
+    first = next(chunks)
+    assert first[0] == paths[0]
+    assert InlineExecutor.instances[0].submitted == 4  # 2 * workers, not all 20 files
+    assert [first] + list(chunks) == [(path, i, chunk) for path in paths for i, chunk in enumerate(iter_file_chunks(path))]
@@ -0,0 +1,71 @@
+import pytest
+from utils.document_loader import iter_file_chunks
+from tests.conftest import words, write
+
+
+def history_chunks(rag):
+    """(chunk index, text) of the live history.txt chunks, in chunk order"""
+    history_path = rag._history_path()
+    chunks = []
+    for chunk_uid in rag.file_chunk_ids.get(history_path, []):
+        pos = rag.id_to_pos[chunk_uid]
+        chunks.append((rag.metadata[pos]['chunk_id'], rag.documents[pos]))
+    return sorted(chunks)
+
+
+def expected_chunks(path):
+    return list(enumerate(iter_file_chunks(str(path))))
+
+
+@pytest.fixture
+def history(rag_settings):
+    path = rag_settings / 'history.txt'
+    write(path, words('chat', 700) + '\n')
+    return path
+
+
+def test_full_build_indexes_history_once(make_rag, history):
+    rag = make_rag()
+    rag.initialize_index()
+    assert len(rag.metadata) == 2
+    assert history_chunks(rag) == expected_chunks(history)
+
+
+def test_full_build_with_documents_indexes_history_once(make_rag, rag_settings, history):
+    write(rag_settings / 'notes.txt', words('notes', 300))
+    rag = make_rag()
+    rag.initialize_index()
+    assert len(rag.metadata) == 3
+    assert history_chunks(rag) == expected_chunks(history)
+
+    restarted = make_rag()
+    restarted.initialize_index()
+    assert len(restarted.metadata) == 3
+
+
+def test_appended_history_only_indexes_the_tail(make_rag, history):
+    rag = make_rag()
+    rag.initialize_index()
+    sealed_id = rag.file_chunk_ids[rag._history_path()][0]
+
+    with open(history, 'a', encoding='utf-8') as f:
+        f.write(words('reply', 900) + '\n')
+    restarted = make_rag()
+    restarted.initialize_index()
+
+    assert history_chunks(restarted) == expected_chunks(history)
+    assert restarted.file_chunk_ids[restarted._history_path()][0] == sealed_id  # Sealed chunk kept
+    assert restarted.search('reply', k=1)[0]['source'] == 'history.txt'
+
+
+def test_rewritten_history_is_reindexed_from_the_start(make_rag, history):
+    rag = make_rag()
+    rag.initialize_index()
+    old_ids = set(rag.file_chunk_ids[rag._history_path()])
+
+    write(history, words('fresh', 200) + '\n')
+    restarted = make_rag()
+    restarted.initialize_index()
+
+    assert history_chunks(restarted) == expected_chunks(history)
+    assert old_ids <= restarted.deleted_ids
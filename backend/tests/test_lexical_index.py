@@ -0,0 +1,16 @@
+from services.lexical_index import BM25Index
+
+
+def test_snapshots_share_a_logarithmic_number_of_segments():
+    index = BM25Index()
+    snapshots = []
+    for chunk_uid in range(64):
+        index.add(chunk_uid, f'common term{chunk_uid}')
+        snapshots.append(index.snapshot())
+        assert len(index.segments) <= chunk_uid.bit_length() + 1
+
+    assert snapshots[-1].segments is index.segments
+    assert snapshots[0].search('common', k=100) == [(0, snapshots[0].search('common', k=1)[0][1])]
+    assert sorted(chunk_uid for chunk_uid, _ in index.search('common', k=100)) == list(range(64))
+    assert index.search('term17', k=1)[0][0] == 17
+    assert index.get_stats()['pending_chunks'] == 64
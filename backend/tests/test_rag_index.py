@@ -0,0 +1,201 @@
+import pytest
+from services.chunk_store import read_log
+from config import settings
+from tests.conftest import words, write
+
+
+def sources(hits):
+    return [hit['source'] for hit in hits]
+
+
+def file_ids(rag, name):
+    return next(ids for path, ids in rag.file_chunk_ids.items() if path.endswith(name))
+
+
+@pytest.fixture
+def corpus(rag_settings):
+    """Two files of two chunks each (500-word chunks with 100 words overlap)"""
+    write(rag_settings / 'alpha.txt', words('alpha', 700))
+    write(rag_settings / 'beta.txt', words('beta', 700))
+    return rag_settings
+
+
+def test_chunk_ids_are_stable_across_restarts(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    ids = dict(rag.file_chunk_ids)
+    hits = rag.search('alpha', k=2)
+
+    restarted = make_rag()
+    restarted.initialize_index()
+    assert restarted.file_chunk_ids == ids
+    assert [hit['id'] for hit in restarted.search('alpha', k=2)] == [hit['id'] for hit in hits]
+
+
+def test_modified_file_is_replaced_in_place(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    old_alpha = file_ids(rag, 'alpha.txt')
+    beta = file_ids(rag, 'beta.txt')
+
+    write(corpus / 'alpha.txt', words('gamma', 300))
+    rag.initialize_index(check_history=False)
+
+    assert set(old_alpha) <= rag.deleted_ids
+    assert file_ids(rag, 'beta.txt') == beta
+    new_alpha = file_ids(rag, 'alpha.txt')
+    assert min(new_alpha) > max(old_alpha + beta)  # IDs are never reused
+    assert rag.snapshot.index_size - rag.snapshot.index_tombstones == len(new_alpha) + len(beta)
+    assert sources(rag.search('gamma', k=1)) == ['alpha.txt']
+    assert not set(hit['id'] for hit in rag.search('alpha', k=4)) & set(old_alpha)
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw'])
+def test_deleted_file_is_dropped_without_rebuild(make_rag, corpus, monkeypatch, index_type):
+    monkeypatch.setattr(settings, 'faiss_index_type', index_type)
+    rag = make_rag()
+    rag.initialize_index()
+    index_before = rag.index
+    alpha = file_ids(rag, 'alpha.txt')
+
+    (corpus / 'alpha.txt').unlink()
+    rag.initialize_index(check_history=False)
+
+    assert rag.index_type == index_type
+    assert set(alpha) <= rag.deleted_ids
+    assert rag.snapshot.live_chunks == len(file_ids(rag, 'beta.txt'))
+    assert sources(rag.search('alpha', k=4)) == ['beta.txt', 'beta.txt']
+    assert rag.index is index_before  # Tombstoned until the next merge
+    assert rag.snapshot.index_tombstones == len(alpha)
+
+    rag.checkpoint()
+    assert rag.snapshot.index_tombstones == (0 if index_type == 'flat' else len(alpha))
+    assert rag.index.ntotal == index_before.ntotal - (len(alpha) if index_type == 'flat' else 0)
+    assert sources(rag.search('alpha', k=4)) == ['beta.txt', 'beta.txt']
+
+
+def test_updates_go_to_the_delta_without_copying_the_published_index(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    published = rag.snapshot
+
+    write(corpus / 'gamma.txt', words('gamma', 200))
+    rag.initialize_index(check_history=False)
+    assert rag.snapshot.index is published.index
+    assert rag.snapshot.id_to_pos is rag.id_to_pos
+    assert rag.snapshot.delta_index.ntotal == len(file_ids(rag, 'gamma.txt'))
+    assert published.delta_index is None  # Older snapshots don't see the update
+    assert sources(rag.search('gamma', k=1)) == ['gamma.txt']
+
+    (corpus / 'gamma.txt').unlink()
+    rag.initialize_index(check_history=False)
+    assert rag.snapshot.delta_index.ntotal == 0  # Delta rows are removed right away
+    assert rag.snapshot.index_tombstones == 0
+    assert 'gamma.txt' not in sources(rag.search('gamma', k=4))
+
+
+def test_delta_is_merged_past_the_threshold(make_rag, corpus, monkeypatch):
+    rag = make_rag()
+    rag.initialize_index()
+    index_before = rag.index
+    monkeypatch.setattr(settings, 'faiss_delta_max_chunks', 2)
+
+    write(corpus / 'gamma.txt', words('gamma', 700))
+    rag.initialize_index(check_history=False)
+    gamma = file_ids(rag, 'gamma.txt')
+    assert rag.index is not index_before
+    assert index_before.ntotal == 4  # The published index was copied, not modified
+    assert rag.index.ntotal == 4 + len(gamma)
+    assert rag.delta_index is None
+    assert sources(rag.search('gamma', k=2)) == ['gamma.txt', 'gamma.txt']
+
+
+def test_logged_updates_are_replayed_after_restart(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    write(corpus / 'gamma.txt', words('gamma', 200))
+    (corpus / 'alpha.txt').unlink()
+    rag.initialize_index(check_history=False)
+    assert read_log(settings.chunk_store_path)  # Persisted as log records, not a checkpoint
+
+    restarted = make_rag()
+    restarted.initialize_index()
+    assert restarted.file_chunk_ids == rag.file_chunk_ids
+    assert restarted.deleted_ids == rag.deleted_ids
+    assert restarted.next_chunk_id == rag.next_chunk_id
+    assert sources(restarted.search('gamma', k=1)) == ['gamma.txt']
+    assert 'alpha.txt' not in sources(restarted.search('alpha', k=3))
+
+
+def test_incremental_passes_reuse_the_loaded_state(make_rag, corpus, monkeypatch):
+    rag = make_rag()
+    rag.initialize_index()
+    loads = []
+    load_index = rag._load_index
+    monkeypatch.setattr(rag, '_load_index', lambda: loads.append(1) or load_index())
+
+    write(corpus / 'gamma.txt', words('gamma', 200))
+    rag.initialize_index(check_history=False)
+    (corpus / 'gamma.txt').unlink()
+    rag.initialize_index(check_history=False)
+    assert loads == []
+
+    make_rag().initialize_index(force_rebuild=True)  # Another writer checkpointed a new generation
+    rag.initialize_index(check_history=False)
+    assert loads == [1]
+
+
+def test_checkpoint_merges_the_log(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    write(corpus / 'gamma.txt', words('gamma', 200))
+    rag.initialize_index(check_history=False)
+    rag.checkpoint()
+    assert read_log(settings.chunk_store_path) == []
+
+    restarted = make_rag()
+    restarted.initialize_index()
+    assert restarted.file_chunk_ids == rag.file_chunk_ids
+    assert sources(restarted.search('gamma', k=1)) == ['gamma.txt']
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw'])
+def test_compaction_reclaims_rows_and_keeps_ids(make_rag, corpus, monkeypatch, index_type):
+    monkeypatch.setattr(settings, 'faiss_index_type', index_type)
+    rag = make_rag()
+    rag.initialize_index()
+    beta = file_ids(rag, 'beta.txt')
+    hits = rag.search('beta', k=1)
+    (corpus / 'alpha.txt').unlink()
+    rag.initialize_index(check_history=False)
+
+    rag.compact_index()
+    assert rag.deleted_ids == set()
+    assert len(rag.metadata) == len(beta)
+    assert rag.index.ntotal == len(beta)
+    assert [hit['id'] for hit in rag.search('beta', k=1)] == [hit['id'] for hit in hits]
+
+    restarted = make_rag()
+    restarted.initialize_index()
+    assert file_ids(restarted, 'beta.txt') == beta
+    assert restarted.deleted_ids == set()
+
+
+def test_force_rebuild_issues_new_ids(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    first = rag.next_chunk_id
+
+    rebuilt = make_rag()
+    rebuilt.initialize_index(force_rebuild=True)
+    assert min(id for ids in rebuilt.file_chunk_ids.values() for id in ids) >= first
+    assert sources(rebuilt.search('beta', k=1)) == ['beta.txt']
+
+
+def test_query_caches_keep_case_and_ignore_whitespace(make_rag, corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    rag.search('Alpha  beta', k=1)
+    rag.search('Alpha beta', k=1)
+    rag.search('alpha beta', k=1)
+    assert len(rag.query_embedding_cache) == 2  # A cased model embeds these differently
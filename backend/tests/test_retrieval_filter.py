@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from config import settings
+from services.index_factory import build_index, search_parameters
+from services.retrieval_filter import RetrievalFilter, id_bitmap
+from tests.conftest import write
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw', 'ivf'])
+def test_search_parameters_only_return_allowed_ids(index_type):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 32)).astype('float32')
+    ids = np.arange(1000, dtype='int64') * 3  # Sparse, non-positional IDs
+    index, actual_type, _ = build_index(index_type, 32, vectors, 'fp32')
+    assert actual_type == index_type
+    index.add_with_ids(vectors, ids)
+    allowed = np.sort(rng.choice(ids, size=50, replace=False))
+
+    _, found = index.search(rng.standard_normal((30, 32)).astype('float32'), 10, params=search_parameters(actual_type, id_bitmap(allowed)))
+    found = found[found >= 0]
+    assert len(found) > 0
+    assert set(found.tolist()) <= set(allowed.tolist())
+
+
+@pytest.fixture
+def tagged_corpus(rag_settings):
+    """200 single-chunk files sharing the word 'common', tagged by file number mod 4"""
+    for i in range(200):
+        write(rag_settings / f'doc{i}.txt', f'common {"common " * 5}group{i % 4} doc{i}')
+    return rag_settings
+
+
+@pytest.mark.parametrize('index_type, codec', [('flat', 'fp32'), ('ivf', 'sq8')])
+@pytest.mark.parametrize('mode', ['vector', 'lexical', 'hybrid'])
+def test_filtered_search_returns_a_subset_of_the_allowed_files(make_rag, tagged_corpus, monkeypatch, index_type, codec, mode):
+    monkeypatch.setattr(settings, 'faiss_index_type', index_type)
+    monkeypatch.setattr(settings, 'faiss_vector_codec', codec)
+    rag = make_rag()
+    rag.initialize_index()
+    assert (rag.index_type, rag.vector_codec) == (index_type, codec)
+
+    allowed = {'doc3.txt', 'doc7.txt', 'doc150.txt'}
+    retrieval_filter = RetrievalFilter(sources=allowed)
+    for _ in range(2):  # The second query reuses the cached selection
+        hits = rag.search('common', k=5, mode=mode, filters=retrieval_filter)
+        assert hits
+        assert {hit['source'] for hit in hits} <= allowed
+
+
+def test_filter_skips_deleted_chunks(make_rag, tagged_corpus):
+    rag = make_rag()
+    rag.initialize_index()
+    (tagged_corpus / 'doc3.txt').unlink()
+    rag.initialize_index(check_history=False)
+
+    hits = rag.search('common', k=5, filters=RetrievalFilter(sources=['doc3.txt', 'doc7.txt']))
+    assert [hit['source'] for hit in hits] == ['doc7.txt']
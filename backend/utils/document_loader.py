@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+from PyPDF2 import PdfReader
+from docx import Document
+from config import settings
+from utils.logger import log_info, log_error
+
+
+# File types the RAG index can ingest
+SUPPORTED_EXTENSIONS = ['.txt', '.md', '.pdf', '.docx']
+
+
+def iter_text_file(filepath: str) -> Iterator[str]:
+    """Stream a .txt or .md file line by line"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        yield from f
+
+
+def iter_pdf_pages(filepath: str) -> Iterator[str]:
+    """Stream the text of a PDF one page at a time"""
+    try:
+        reader = PdfReader(filepath)
+        for page in reader.pages:
+            yield (page.extract_text() or "") + "\n"
+    except Exception as e:
+        log_error(f"Error loading PDF {filepath}: {str(e)}")
+
+
+def iter_docx_paragraphs(filepath: str) -> Iterator[str]:
+    """Stream the paragraphs of a DOCX file"""
+    try:
+        doc = Document(filepath)
+        for para in doc.paragraphs:
+            yield para.text + "\n"
+    except Exception as e:
+        log_error(f"Error loading DOCX {filepath}: {str(e)}")
+
+
+def iter_file_text(filepath: str) -> Iterator[str]:
+    """Stream the text of any supported file in pieces (lines, pages or paragraphs)"""
+    suffix = Path(filepath).suffix
+    if suffix in ['.txt', '.md']:
+        return iter_text_file(filepath)
+    if suffix == '.pdf':
+        return iter_pdf_pages(filepath)
+    if suffix == '.docx':
+        return iter_docx_paragraphs(filepath)
+    return iter(())
+
+
+def iter_words(pieces: Iterable[str]) -> Iterator[str]:
+    """Split streamed text pieces into words (same result as splitting the joined text)"""
+    for piece in pieces:
+        yield from piece.split()
+
+
+def iter_chunks(words: Iterable[str], chunk_size: int = 500, overlap: int = 100) -> Iterator[str]:
+    """Group a word stream into overlapping chunks
+
+    Produces exactly the chunks of `chunk_text`, but only ever holds one
+    chunk's worth of words in memory.
+    """
+    step = max(1, chunk_size - overlap)
+    window = deque()
+    for word in words:
+        window.append(word)
+        if len(window) == chunk_size:
+            yield ' '.join(window)
+            for _ in range(step):
+                window.popleft()
+    # Tail chunks start every `step` words until the stream is exhausted
+    while window:
+        yield ' '.join(window)
+        for _ in range(min(step, len(window))):
+            window.popleft()
+
+
+def chunk_text(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
+    """Split text into overlapping chunks"""
+    return list(iter_chunks(text.split(), chunk_size, overlap))
+
+
+def iter_file_chunks(filepath: str) -> Iterator[str]:
+    """Stream the chunks of one file: pages -> words -> overlapping chunks"""
+    return iter_chunks(iter_words(iter_file_text(filepath)))
+
+
+def read_tail_chunks(filepath: str, start_offset: int, end_offset: int, chunk_size: int = 500, overlap: int = 100) -> Tuple[List[str], int, int]:
+    """Chunk the part of an append-only text file from `start_offset` to `end_offset`
+
+    `start_offset` must be the byte offset where a chunk starts (0, or a
+    `next_offset` returned earlier). Chunks start every `chunk_size - overlap`
+    words, so re-chunking from there yields exactly the chunks of
+    `iter_file_chunks` for the same part of the file, including the overlap
+    with the last chunk before it.
+
+    A chunk is sealed when it has `chunk_size` complete words (the file may
+    end mid-word). Sealed chunks never change when the file grows; the ones
+    after them are re-chunked on the next call.
+
+    Returns: (chunks, number of sealed chunks, next_offset = byte offset of the first unsealed chunk)
+    """
+    step = max(1, chunk_size - overlap)
+    with open(filepath, 'rb') as f:
+        f.seek(start_offset)
+        data = f.read(max(0, end_offset - start_offset))
+    text = data.decode('utf-8', errors='replace')
+
+    # Byte offset of every word, computed incrementally (UTF-8 widths)
+    words, starts = [], []
+    byte_pos, char_pos = start_offset, 0
+    for match in re.finditer(r'\S+', text):
+        byte_pos += len(text[char_pos:match.start()].encode('utf-8'))
+        char_pos = match.start()
+        words.append(match.group())
+        starts.append(byte_pos)
+
+    complete_words = len(words) if not text or text[-1].isspace() else len(words) - 1
+    chunks = [' '.join(words[first:first + chunk_size]) for first in range(0, len(words), step)]
+    sealed = sum(1 for first in range(0, len(words), step) if first + chunk_size <= complete_words)
+    next_offset = starts[sealed * step] if sealed else start_offset
+    return chunks, sealed, next_offset
+
+
+def parse_file(filepath: str) -> dict:
+    """Load and chunk one file
+
+    Runs in ingestion worker processes, so it must stay a module-level
+    function. Errors are returned instead of raised so one bad file never
+    aborts the rest of the batch.
+
+    Returns:
+        {'file_path': ..., 'chunks': [...], 'error': None or message}
+    """
+    try:
+        return {'file_path': filepath, 'chunks': list(iter_file_chunks(filepath)), 'error': None}
+    except Exception as e:
+        return {'file_path': filepath, 'chunks': [], 'error': str(e)}
+
+
+def ingest_worker_count() -> int:
+    """Configured number of parsing processes (0 means one per CPU)"""
+    return settings.ingest_workers or os.cpu_count() or 1
+
+
+def iter_document_chunks(file_paths: List[str], workers: int = None) -> Iterator[Tuple[str, int, str]]:
+    """Stream (file_path, chunk_index, chunk) for a list of files, in file order
+
+    With one worker every file is streamed in-process page by page, so memory
+    is bounded by a single chunk. With more workers files are parsed in a
+    spawn-based process pool (workers start fresh instead of forking the
+    parent's model and index, but spawn re-imports the parent's `__main__`,
+    so under `python main.py` each worker also imports the app's modules;
+    the server itself only starts under `if __name__ == "__main__"`). Each
+    worker returns one file's chunks, and results are yielded in input
+    order as soon as they are ready so the caller can embed while later
+    files are still being parsed. Only 2 * workers files are submitted
+    ahead of the one being consumed, so at most that many parsed files wait
+    in the parent however many files there are.
+
+    Per-file errors are logged and the file is skipped.
+    """
+    if workers is None:
+        workers = ingest_worker_count()
+    workers = min(workers, len(file_paths))
+
+    if workers <= 1:
+        for filepath in file_paths:
+            try:
+                for i, chunk in enumerate(iter_file_chunks(filepath)):
+                    yield filepath, i, chunk
+            except Exception as e:
+                log_error(f"Error loading {filepath}: {str(e)}")
+        return
+
+    log_info(f"⚙️  Parsing {len(file_paths)} files with {workers} worker processes...")
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        in_flight = deque()
+        for filepath in file_paths:
+            in_flight.append(executor.submit(parse_file, filepath))
+            if len(in_flight) >= 2 * workers:
+                yield from _result_chunks(in_flight.popleft().result())
+        while in_flight:
+            yield from _result_chunks(in_flight.popleft().result())
+
+
+def _result_chunks(result: dict) -> Iterator[Tuple[str, int, str]]:
+    """(file_path, chunk_index, chunk) of one `parse_file` result (nothing if it failed)"""
+    if result['error']:
+        log_error(f"Error loading {result['file_path']}: {result['error']}")
+        return
+    for i, chunk in enumerate(result['chunks']):
+        yield result['file_path'], i, chunk
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import stat
+from pathlib import Path
+from typing import Dict, List
+from utils.logger import log_info, log_error
+
+
+def hash_file(filepath: str, block_size: int = 1 << 20) -> str:
+    """MD5 of a file, read in fixed-size blocks so large files never sit in memory"""
+    hasher = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def scan_files(root: str, extensions: List[str], extra_files: List[str] = None) -> Dict[str, os.stat_result]:
+    """Walk `root` once and stat every supported file
+
+    Keys are `str(path)` as produced by rglob (the form used in chunk
+    metadata). `extra_files` (e.g. history.txt, keyed by its resolved path)
+    are stat'ed too when they exist; copies of them found during the walk are
+    not listed twice.
+    """
+    extra = {str(Path(p).resolve()) for p in (extra_files or [])}
+    files = {}
+    root_path = Path(root)
+    if root_path.exists():
+        for filepath in root_path.rglob('*'):
+            if filepath.suffix not in extensions or str(filepath.resolve()) in extra:
+                continue
+            try:
+                file_stat = filepath.stat()
+            except OSError:
+                continue  # Deleted between listing and stat
+            if stat.S_ISREG(file_stat.st_mode):
+                files[str(filepath)] = file_stat
+    for filepath in extra:
+        if os.path.isfile(filepath):
+            files[filepath] = os.stat(filepath)
+    return files
+
+
+class FileManifest:
+    """Persisted record of what has been indexed, keyed by file path
+
+    Each entry holds the file's (size, mtime_ns, inode) signature, its content
+    digest and the IDs of its chunks. A file is only re-hashed when its stat
+    signature differs from the recorded one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+
+    def load(self) -> bool:
+        """Load the manifest from disk
+
+        Accepts older file_hashes.json layouts ({path: digest} or
+        {path: {digest, chunk_ids}}); their files are re-hashed once.
+
+        Returns False if the file exists but cannot be read.
+        """
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return True
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            log_error(f"Error loading file manifest: {str(e)}")
+            return False
+        for file_path, entry in saved.items():
+            self.entries[file_path] = entry if isinstance(entry, dict) else {'digest': entry}
+        return True
+
+    @staticmethod
+    def _signature(entry: dict) -> tuple:
+        return entry.get('size'), entry.get('mtime_ns'), entry.get('inode')
+
+    def refresh(self, scan: Dict[str, os.stat_result]) -> Dict[str, dict]:
+        """Current state of the scanned files
+
+        Reuses the recorded digest for files whose stat signature is
+        unchanged and hashes (streamed) only the others. The manifest itself is
+        not modified until `commit`.
+        """
+        current = {}
+        rehashed = 0
+        for file_path, file_stat in scan.items():
+            entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'inode': file_stat.st_ino}
+            recorded = self.entries.get(file_path)
+            if recorded and recorded.get('digest') and self._signature(recorded) == self._signature(entry):
+                entry['digest'] = recorded['digest']
+            else:
+                try:
+                    entry['digest'] = hash_file(file_path)
+                    rehashed += 1
+                except OSError as e:
+                    log_error(f"Error hashing {file_path}: {str(e)}")
+                    continue
+            current[file_path] = entry
+        if rehashed:
+            log_info(f"🔍 Hashed {rehashed} of {len(current)} files with changed size/mtime")
+        return current
+
+    def digest(self, file_path: str) -> str:
+        """Recorded digest of a file (None if unknown)"""
+        entry = self.entries.get(file_path)
+        return entry.get('digest') if entry else None
+
+    def commit(self, current: Dict[str, dict], chunk_ids: Dict[str, List[int]]):
+        """Record `current` as the indexed state and write the manifest atomically"""
+        self.entries = {
+            file_path: {**entry, 'chunk_ids': chunk_ids.get(file_path, [])}
+            for file_path, entry in current.items()
+        }
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
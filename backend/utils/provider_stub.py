@@ -0,0 +1,70 @@
+"""Local OpenAI-compatible stub provider for testing
+
+Run from backend/:
+
+    STUB_DELAY_SECONDS=2 uvicorn utils.provider_stub:app --port 9001
+
+and point a provider at it, e.g. LONGCAT_BASE_URL=http://localhost:9001/v1.
+Every chat completion waits STUB_DELAY_SECONDS (non-blocking) and echoes the
+last user message, so concurrent chats show whether provider calls overlap.
+With "stream": true the reply is sent as SSE chunks, one word every
+STUB_TOKEN_DELAY_SECONDS.
+"""
+import asyncio
+import os
+import time
+import json
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="Provider stub")
+
+DELAY_SECONDS = float(os.getenv("STUB_DELAY_SECONDS", "0"))
+TOKEN_DELAY_SECONDS = float(os.getenv("STUB_TOKEN_DELAY_SECONDS", "0.05"))
+
+
+def _stream(completion_id: str, model: str, content: str):
+    async def chunks():
+        for i, word in enumerate(content.split(" ")):
+            delta = {"content": word if i == 0 else f" {word}"}
+            yield "data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+            }) + "\n\n"
+            await asyncio.sleep(TOKEN_DELAY_SECONDS)
+        yield "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }) + "\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(DELAY_SECONDS)
+    user_messages = [m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user"]
+    content = f"stub reply to: {user_messages[-1] if user_messages else ''}"
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    if body.get("stream"):
+        return _stream(completion_id, body.get("model", "stub"), content)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable
+from utils.logger import log_success, log_error
+
+
+class Readiness:
+    """Startup state of each backend subsystem
+
+    Liveness only says the process is serving; readiness says the
+    subsystems a request needs have finished initializing. Each subsystem
+    moves pending -> starting -> ready (or failed).
+    """
+
+    def __init__(self, required: Iterable[str]):
+        self.required = set(required)
+        self._state: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str):
+        self._state.setdefault(name, {'status': 'pending'})
+
+    async def run(self, name: str, start: Callable[[], Awaitable[Any]]) -> bool:
+        """Initialize one subsystem, recording its status and startup time
+
+        Returns True if it became ready.
+        """
+        self._state[name] = {'status': 'starting'}
+        started = time.perf_counter()
+        try:
+            await start()
+        except asyncio.CancelledError:
+            self._state[name] = {'status': 'failed', 'error': 'cancelled'}
+            raise
+        except Exception as e:
+            log_error(f"Error starting {name}: {str(e)}")
+            self._state[name] = {'status': 'failed', 'error': str(e), 'seconds': round(time.perf_counter() - started, 3)}
+            return False
+        seconds = round(time.perf_counter() - started, 3)
+        self._state[name] = {'status': 'ready', 'seconds': seconds}
+        log_success(f"✅ {name} ready in {seconds}s")
+        return True
+
+    def is_ready(self) -> bool:
+        """True once every required subsystem is ready"""
+        return all(self._state.get(name, {}).get('status') == 'ready' for name in self.required)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(state, required=name in self.required) for name, state in self._state.items()}
+
+
+# MongoDB and the RAG index are needed to answer chats; without Letta chats
+# still work (no memory), so it is reported but not required.
+readiness = Readiness(required=['mongodb', 'rag'])